@@ -0,0 +1,348 @@
+"""
+Hot/cold tiering of the predictions table.
+
+Rows older than the hot horizon are moved out of SQLite into one compressed,
+columnar .npz file per calendar month (archive/predictions_YYYY-MM.npz). Each
+feature column is stored in the narrowest dtype that holds it, user IDs and
+prediction labels are dictionary-encoded, and rows are sorted by user so a
+user's slice of a month is found with a binary search.
+
+The dashboard reads through fetch_user_history(), which merges the hot rows
+from SQLite with the user's archived rows.
+
+Usage (archive rows older than the horizon, then VACUUM the live database):
+    python archive.py compact [--horizon-days 365]
+    python archive.py stats
+"""
+import argparse
+import os
+import sqlite3
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+import prediction_cache
+import sharding
+from database import DB_PATH, FEATURE_NAMES, fetch_user_data, fetch_user_date_range, fetch_users, numeric_features
+from tracing import span
+
+ARCHIVE_DIR = os.getenv("HEALTHTRACK_ARCHIVE_DIR", "archive")
+
+# Predictions newer than this many days stay in SQLite
+HOT_DAYS = int(os.getenv("HEALTHTRACK_HOT_DAYS", "365"))
+
+# Storage dtype per column. Every encoded feature except BMI is a small integer.
+COLUMN_DTYPES = {feature: np.int8 for feature in FEATURE_NAMES}
+COLUMN_DTYPES.update({'id': np.int64, 'BMI': np.float64, 'Probability': np.float64})
+
+EPOCH = date(1970, 1, 1)
+
+# Recently read partitions, keyed by path and modification time
+_partitions = prediction_cache.LRUCache(maxsize=24)
+
+
+def partition_path(month, archive_dir=ARCHIVE_DIR):
+    return os.path.join(archive_dir, f"predictions_{month}.npz")
+
+
+def list_partitions(archive_dir=ARCHIVE_DIR):
+    """
+    Archived months ('YYYY-MM'), oldest first.
+    """
+    if not os.path.isdir(archive_dir):
+        return []
+    return sorted(
+        name[len("predictions_"):-len(".npz")] for name in os.listdir(archive_dir)
+        if name.startswith("predictions_") and name.endswith(".npz")
+    )
+
+
+def _encode(frame):
+    """
+    Columnar arrays for a frame of prediction rows (sorted by user and date).
+    """
+    frame = frame.sort_values(['user_id', 'date', 'id'], ignore_index=True)
+    users, user_codes = np.unique(frame['user_id'].to_numpy(dtype=str), return_inverse=True)
+    labels, label_codes = np.unique(frame['Prediction'].to_numpy(dtype=str), return_inverse=True)
+    days = (pd.to_datetime(frame['date']) - pd.Timestamp(EPOCH)).dt.days
+    arrays = {column: frame[column].to_numpy(dtype=dtype) for column, dtype in COLUMN_DTYPES.items()}
+    arrays.update({
+        'users': users,
+        # Row range of each user: user_offsets[i]:user_offsets[i + 1]
+        'user_offsets': np.searchsorted(user_codes, np.arange(len(users) + 1)).astype(np.int64),
+        'labels': labels,
+        'label_codes': label_codes.astype(np.int8),
+        'days': days.to_numpy(dtype=np.int32),
+    })
+    return arrays
+
+
+def _decode(arrays, start=0, stop=None):
+    """
+    Prediction rows start:stop of a partition as a frame with the predictions table columns.
+    """
+    stop = len(arrays['id']) if stop is None else stop
+    user_codes = np.searchsorted(arrays['user_offsets'], np.arange(start, stop), side='right') - 1
+    columns = {'id': arrays['id'][start:stop], 'user_id': arrays['users'][user_codes]}
+    columns.update({feature: arrays[feature][start:stop] for feature in FEATURE_NAMES})
+    columns['Prediction'] = arrays['labels'][arrays['label_codes'][start:stop]]
+    columns['Probability'] = arrays['Probability'][start:stop]
+    days = arrays['days'][start:stop].astype('datetime64[D]')
+    columns['date'] = np.datetime_as_string(days)
+    return pd.DataFrame(columns)
+
+
+def load_partition(month, archive_dir=ARCHIVE_DIR):
+    path = partition_path(month, archive_dir)
+    key = (path, os.path.getmtime(path))
+
+    def read():
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+
+    return _partitions.get_or_compute(key, read)
+
+
+def write_partition(month, frame, archive_dir=ARCHIVE_DIR):
+    """
+    Write (or rewrite) a month's partition atomically.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    path = partition_path(month, archive_dir)
+    tmp_path = path + ".tmp.npz"
+    np.savez_compressed(tmp_path, **_encode(frame))
+    os.replace(tmp_path, path)
+
+
+def read_partition(month, archive_dir=ARCHIVE_DIR):
+    return _decode(load_partition(month, archive_dir))
+
+
+def _user_slice(arrays, user_id):
+    i = np.searchsorted(arrays['users'], user_id)
+    if i < len(arrays['users']) and arrays['users'][i] == user_id:
+        return arrays['user_offsets'][i], arrays['user_offsets'][i + 1]
+    return None
+
+
+def _day(date_string):
+    return (date.fromisoformat(date_string) - EPOCH).days
+
+
+def read_user_rows(user_id, archive_dir=ARCHIVE_DIR, start_date=None, end_date=None):
+    """
+    A user's archived predictions, optionally limited to an inclusive date window.
+    Months outside the window are not opened.
+    """
+    frames = []
+    for month in list_partitions(archive_dir):
+        if (start_date and month < start_date[:7]) or (end_date and month > end_date[:7]):
+            continue
+        arrays = load_partition(month, archive_dir)
+        rows = _user_slice(arrays, user_id)
+        if rows is None:
+            continue
+        start, stop = rows
+        # Rows are sorted by date within the user's slice
+        days = arrays['days'][start:stop]
+        if start_date:
+            start += int(np.searchsorted(days, _day(start_date), side='left'))
+        if end_date:
+            stop = rows[0] + int(np.searchsorted(days, _day(end_date), side='right'))
+        if stop > start:
+            frames.append(_decode(arrays, start, stop))
+    if not frames:
+        return pd.DataFrame(columns=['id', 'user_id'] + FEATURE_NAMES + ['Prediction', 'Probability', 'date'])
+    return pd.concat(frames, ignore_index=True)
+
+
+def archived_user_ids(archive_dir=ARCHIVE_DIR):
+    users = set()
+    for month in list_partitions(archive_dir):
+        users.update(load_partition(month, archive_dir)['users'].tolist())
+    return users
+
+
+def fetch_user_history(conn, user_id, archive_dir=ARCHIVE_DIR, start_date=None, end_date=None):
+    """
+    A user's prediction history: hot rows from SQLite plus archived rows, newest
+    first, in the same shape as database.fetch_user_data(). start_date and
+    end_date ('YYYY-MM-DD', inclusive) limit it to a window.
+
+    If a row exists in both tiers (an interrupted compaction), the SQLite row wins.
+    """
+    with span("archive.fetch_hot"):
+        hot = fetch_user_data(conn, user_id, start_date, end_date)
+    with span("archive.fetch_cold"):
+        cold = read_user_rows(user_id, archive_dir, start_date, end_date)
+    if cold.empty:
+        return hot
+
+    if hot.empty:
+        user = conn.execute("SELECT email, name FROM users WHERE unique_id = ?", (user_id,)).fetchone()
+        if user is None:
+            return hot
+        email, name = user
+    else:
+        email, name = hot['email'].iloc[0], hot['name'].iloc[0]
+    cold['email'] = email
+    cold['name'] = name
+
+    if hot.empty:
+        history = cold
+    else:
+        history = pd.concat([hot, cold[hot.columns]], ignore_index=True)
+        history = history.drop_duplicates(subset='date', keep='first')
+    return history.sort_values('date', ascending=False, ignore_index=True)
+
+
+def user_date_range(conn, user_id, archive_dir=ARCHIVE_DIR):
+    """
+    (first date, last date) of a user's predictions across both tiers, or (None, None).
+    """
+    first, last = fetch_user_date_range(conn, user_id)
+    for month in list_partitions(archive_dir):
+        arrays = load_partition(month, archive_dir)
+        rows = _user_slice(arrays, user_id)
+        if rows is None:
+            continue
+        days = arrays['days'][rows[0]:rows[1]]
+        month_first = str(np.datetime64(int(days[0]), 'D'))
+        month_last = str(np.datetime64(int(days[-1]), 'D'))
+        first = month_first if first is None else min(first, month_first)
+        last = month_last if last is None else max(last, month_last)
+    return first, last
+
+
+def fetch_all_users(conn, archive_dir=ARCHIVE_DIR, users=None):
+    """
+    database.fetch_users() plus users whose predictions have all been archived.
+
+    Parameters:
+    - conn: Connection to the database holding the users table.
+    - archive_dir: Directory holding the monthly partitions.
+    - users: Already fetched live users (e.g. merged across shards); fetched from conn if None.
+    """
+    if users is None:
+        users = fetch_users(conn)
+    missing = archived_user_ids(archive_dir) - set(users['user_id'])
+    if not missing:
+        return users
+    archived = pd.read_sql_query("SELECT unique_id AS user_id, email FROM users", conn)
+    archived = archived[archived['user_id'].isin(missing)]
+    return pd.concat([users, archived], ignore_index=True)
+
+
+def compact(db_path=DB_PATH, archive_dir=ARCHIVE_DIR, horizon_days=HOT_DAYS, today=None, vacuum=True):
+    """
+    Move predictions older than the horizon into the monthly archive.
+
+    Each affected month is merged with its existing partition and rewritten, then
+    the archived rows are deleted from SQLite (by id). Partitions are written before
+    the delete, so an interruption leaves rows in both tiers rather than losing them.
+    "Yes"/"No" features are stored as 1/0. Rows with a missing or non-numeric feature
+    can't be stored in the archive's integer columns, so they stay in SQLite.
+
+    Parameters:
+    - db_path: Live SQLite database.
+    - archive_dir: Directory holding the monthly partitions.
+    - horizon_days: Rows dated before today - horizon_days are archived.
+    - today: Reference date (defaults to today).
+    - vacuum: Reclaim the freed pages afterwards.
+
+    Returns:
+    - Dictionary with the number of rows archived, months written and rows left
+      in SQLite because of invalid features.
+    """
+    cutoff = ((today or date.today()) - timedelta(days=horizon_days)).strftime('%Y-%m-%d')
+    conn = sqlite3.connect(db_path)
+    try:
+        months = [row[0] for row in conn.execute(
+            "SELECT DISTINCT substr(date, 1, 7) FROM predictions WHERE date < ? ORDER BY 1", (cutoff,)
+        )]
+        archived = 0
+        skipped = 0
+        written = []
+        for month in months:
+            with span("archive.compact_month"):
+                rows = pd.read_sql_query(
+                    f"SELECT id, user_id, {', '.join(FEATURE_NAMES)}, Prediction, Probability, date "
+                    "FROM predictions WHERE date >= ? AND date < ? AND date < ?",
+                    conn, params=(f"{month}-01", f"{month}-32", cutoff)
+                )
+                features = numeric_features(rows)
+                # The int8 columns only hold whole numbers in range (NaN fails both checks)
+                small_ints = features.drop(columns=['BMI'])
+                valid = (
+                    features['BMI'].notna() & (small_ints == small_ints.round()).all(axis=1)
+                    & small_ints.abs().le(np.iinfo(np.int8).max).all(axis=1)
+                ).to_numpy()
+                rows[FEATURE_NAMES] = features
+                skipped += int((~valid).sum())
+                rows = rows[valid]
+                if rows.empty:
+                    continue
+                archived_ids = rows['id'].tolist()
+                archived += len(rows)
+                written.append(month)
+                if os.path.exists(partition_path(month, archive_dir)):
+                    existing = read_partition(month, archive_dir)
+                    rows = pd.concat([rows, existing], ignore_index=True)
+                    rows = rows.drop_duplicates(subset=['user_id', 'date'], keep='first')
+                write_partition(month, rows, archive_dir)
+                for start in range(0, len(archived_ids), 900):
+                    chunk = archived_ids[start:start + 900]
+                    conn.execute(f"DELETE FROM predictions WHERE id IN ({', '.join('?' for _ in chunk)})", chunk)
+                conn.commit()
+        if vacuum and written:
+            with span("archive.vacuum"):
+                conn.execute("VACUUM")
+    finally:
+        conn.close()
+    return {"rows": archived, "months": written, "skipped": skipped}
+
+
+def stats(db_path=DB_PATH, archive_dir=ARCHIVE_DIR):
+    conn = sqlite3.connect(db_path)
+    try:
+        hot_rows = conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+    finally:
+        conn.close()
+    months = list_partitions(archive_dir)
+    return {
+        "hot_rows": hot_rows,
+        "db_bytes": os.path.getsize(db_path),
+        "cold_rows": int(sum(len(load_partition(month, archive_dir)['id']) for month in months)),
+        "archive_bytes": sum(os.path.getsize(partition_path(month, archive_dir)) for month in months),
+        "months": len(months),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive old predictions into compressed monthly partitions")
+    parser.add_argument("--db", default=None, help="Database to archive (default: every prediction shard)")
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compact_parser = subparsers.add_parser("compact", help="Move rows older than the horizon into the archive")
+    compact_parser.add_argument("--horizon-days", type=int, default=HOT_DAYS)
+    compact_parser.add_argument("--no-vacuum", action="store_true")
+    subparsers.add_parser("stats", help="Row counts and sizes of both tiers")
+    args = parser.parse_args()
+
+    # Shards share one archive: a user's rows all come from the same shard, so merging is safe
+    for db_path in [args.db] if args.db else sharding.load_config().shard_paths:
+        if args.command == "compact":
+            result = compact(db_path, args.archive_dir, args.horizon_days, vacuum=not args.no_vacuum)
+            print(f"{db_path}: archived {result['rows']} rows into {len(result['months'])} monthly partitions")
+            if result['skipped']:
+                print(f"{db_path}: kept {result['skipped']} rows with missing or non-numeric features in SQLite")
+        result = stats(db_path, args.archive_dir)
+        print(
+            f"{db_path}: hot {result['hot_rows']} rows, {result['db_bytes'] / 1e6:.1f} MB | "
+            f"Cold: {result['cold_rows']} rows in {result['months']} months, {result['archive_bytes'] / 1e6:.1f} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
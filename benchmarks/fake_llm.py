@@ -0,0 +1,124 @@
+"""
+Local stand-in for the OpenAI chat completions API, for exercising the cohort
+report generator without a key or network access.
+
+Every request sleeps for a fixed latency, a configurable fraction fails with
+HTTP 429, and successful responses echo a short deterministic text. The server
+counts requests and the highest number handled at once.
+
+Usage (then run python cohort_report.py --base-url http://127.0.0.1:8765/v1):
+    python benchmarks/fake_llm.py --port 8765 --latency 0.5 --error-rate 0.05
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeLLMServer:
+    """
+    Threaded HTTP server answering POST /v1/chat/completions.
+
+    Parameters:
+    - port: Port to listen on (0 picks a free one).
+    - latency_s: Seconds each request takes.
+    - error_rate: Fraction of requests answered with 429 Too Many Requests.
+    - seed: Seed for the error draws.
+    """
+
+    def __init__(self, port=0, latency_s=0.2, error_rate=0.0, seed=42):
+        self.latency_s = latency_s
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with server._lock:
+                    server.requests += 1
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                    fail = server._random.random() < server.error_rate
+                try:
+                    time.sleep(server.latency_s)
+                    if fail:
+                        with server._lock:
+                            server.errors += 1
+                        self._send(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}})
+                        return
+                    prompt = "".join(message.get("content", "") for message in body.get("messages", []))
+                    text = f"- Recommendation set {hashlib.sha1(prompt.encode()).hexdigest()[:8]}: keep active and eat well."
+                    self._send(200, {
+                        "id": "chatcmpl-fake",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": body.get("model", "fake"),
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                        "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(text) // 4,
+                                  "total_tokens": (len(prompt) + len(text)) // 4},
+                    })
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+
+            def _send(self, status, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI chat completions server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    args = parser.parse_args()
+
+    server = FakeLLMServer(args.port, args.latency, args.error_rate)
+    print(f"Fake LLM listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"{server.requests} requests, {server.errors} errors, at most {server.max_in_flight} at once")
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+Synthetic fixtures for the benchmark suite: feature rows, prediction
+histories, databases and a stand-in model. Everything is generated locally
+from a seed, so the benchmarks never need the network.
+"""
+import os
+import sqlite3
+
+import joblib
+import numpy as np
+
+import synthetic_data
+from database import FEATURE_NAMES, PREDICTION_COLUMNS, init_db
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_PATH = os.path.join(REPO_ROOT, 'models', 'random_forest_diabetes_model.pkl')
+SCALER_PATH = os.path.join(REPO_ROOT, 'models', 'scaler.pkl')
+CACHE_DIR = os.path.join(REPO_ROOT, 'benchmarks', '.cache')
+
+_sampler = None
+
+
+def feature_sampler():
+    global _sampler
+    if _sampler is None:
+        _sampler = synthetic_data.FeatureSampler(os.path.join(REPO_ROOT, 'data', 'cdc_diabetes_health_indicators.csv'))
+    return _sampler
+
+
+def random_features(rng, n_rows):
+    """
+    Draw n_rows realistic encoded feature vectors (see synthetic_data.FeatureSampler).
+    """
+    return feature_sampler().sample(rng, n_rows)
+
+
+def add_long_history_user(db_path, model, scaler, user_id="longhistory1", days=3650, seed=42):
+    """
+    Add a user with one prediction per day for `days` days (ten years by default).
+    """
+    history = synthetic_data.generate_block(feature_sampler(), seed, 0, 1, days, 1.0, '2014-01-01')
+    history['user_id'] = user_id
+    history['Prediction'], history['Probability'] = synthetic_data.score(model, scaler, history[FEATURE_NAMES])
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "INSERT OR IGNORE INTO users (name, email, unique_id) VALUES (?, ?, ?)",
+        ("Long History", f"{user_id}@example.com", user_id)
+    )
+    conn.executemany(
+        f"INSERT INTO predictions ({', '.join(PREDICTION_COLUMNS)}) VALUES ({', '.join('?' for _ in PREDICTION_COLUMNS)})",
+        history[PREDICTION_COLUMNS].astype(object).itertuples(index=False, name=None)
+    )
+    conn.commit()
+    conn.close()
+    return user_id
+
+
+def synthetic_labels(rng, X):
+    """
+    Diabetes labels from a fixed risk score plus noise (what the stand-in model learns).
+    """
+    risk = 0.08 * (X['BMI'] - 28) + 0.9 * X['HighBP'] + 0.7 * X['HighChol'] + 0.5 * (X['GenHlth'] - 3) + 0.2 * (X['Age'] - 7)
+    return (risk + rng.normal(0, 1, len(X)) > 0.5).astype(int)
+
+
+def load_or_train_model(seed=42):
+    """
+    Return (model, scaler, source). Uses the trained model in models/ when it
+    exists, otherwise fits a stand-in forest with the notebook's hyperparameters
+    on synthetic rows so the timings stay representative.
+    """
+    if os.path.exists(MODEL_PATH) and os.path.exists(SCALER_PATH):
+        return joblib.load(MODEL_PATH), joblib.load(SCALER_PATH), 'models/'
+
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.preprocessing import StandardScaler
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    cached_model = os.path.join(CACHE_DIR, f'standin_model_{seed}.pkl')
+    cached_scaler = os.path.join(CACHE_DIR, f'standin_scaler_{seed}.pkl')
+    if os.path.exists(cached_model) and os.path.exists(cached_scaler):
+        return joblib.load(cached_model), joblib.load(cached_scaler), 'stand-in'
+
+    rng = np.random.default_rng(seed)
+    X = random_features(rng, 20000)
+    y = synthetic_labels(rng, X)
+
+    scaler = StandardScaler()
+    X_scaled = scaler.fit_transform(X)
+    model = RandomForestClassifier(n_estimators=100, max_depth=10, class_weight='balanced', random_state=42)
+    model.fit(X_scaled, y)
+
+    joblib.dump(model, cached_model)
+    joblib.dump(scaler, cached_scaler)
+    return model, scaler, 'stand-in'
+
+
+def heart_disease_bundle(seed=42):
+    """
+    The heart-disease ModelBundle from models/ when it has been trained, otherwise a
+    stand-in trained like model_host.train_heart_disease_model on the Cleveland
+    features with synthetic labels (the CSV ships without outcomes).
+    """
+    import model_host
+
+    if os.path.exists(model_host.HEART_MODEL_PATH):
+        return model_host.get_host().get("heart_disease")
+
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.impute import SimpleImputer
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+
+    rng = np.random.default_rng(seed)
+    X = heart_features()
+    risk = 0.05 * (X['age'] - 55) + 0.6 * (X['cp'] == 4) + 0.01 * (X['chol'] - 240) + 0.8 * X['exang']
+    y = (risk + rng.normal(0, 1, len(X)) > 0.3).astype(int)
+    scaler = make_pipeline(SimpleImputer(strategy='mean'), StandardScaler())
+    model = RandomForestClassifier(n_estimators=100, max_depth=5, class_weight='balanced', random_state=42)
+    model.fit(scaler.fit_transform(X), y)
+    return model_host.ModelBundle(
+        "heart_disease", model, scaler, model_host.HEART_FEATURE_NAMES, "stand-in",
+        positive_label="Heart Disease Present", negative_label="No Heart Disease Present"
+    )
+
+
+def heart_features():
+    import model_host
+    import pandas as pd
+    return pd.read_csv(os.path.join(REPO_ROOT, 'data', 'cleveland_heart_disease.csv'))[model_host.HEART_FEATURE_NAMES]
+
+
+def build_database(db_path, n_rows, seed=42):
+    """
+    Create a predictions database with n_rows synthetic, model-scored rows (and their users).
+    """
+    model, scaler, _ = load_or_train_model(seed)
+    random_features(np.random.default_rng(seed), 1)  # load the sampler once
+    blocks = synthetic_data.generate(n_rows // 150 + 1, months=12, visit_rate=0.5, seed=seed, sampler=_sampler)
+    synthetic_data.bulk_load(db_path, blocks, model, scaler, max_rows=n_rows)
+
+
+def cached_database(n_rows, seed=42):
+    """
+    Path to a synthetic database with n_rows predictions, built once and reused.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    db_path = os.path.join(CACHE_DIR, f'predictions_{n_rows}_{seed}.db')
+    if not os.path.exists(db_path):
+        tmp_path = db_path + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        build_database(tmp_path, n_rows, seed=seed)
+        os.replace(tmp_path, db_path)
+    return db_path
+
+
+def cached_users_database(n_users, seed=42):
+    """
+    Path to a database with n_users users whose last names follow a Zipf-like
+    distribution, so the most common surname has tens of thousands of IDs.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    db_path = os.path.join(CACHE_DIR, f'users_{n_users}_{seed}.db')
+    if not os.path.exists(db_path):
+        tmp_path = db_path + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        init_db(tmp_path)
+        rng = np.random.default_rng(seed)
+        surnames = rng.zipf(1.3, size=n_users) % 5000
+        counters = {}
+        rows = []
+        for i, surname in enumerate(surnames):
+            last_name = f"surname{surname}x"
+            counters[last_name] = counters.get(last_name, 0) + 1
+            rows.append((f"Bench User{i} {last_name}", f"user{i}@example.com", f"{last_name}{counters[last_name]}"))
+        conn = sqlite3.connect(tmp_path)
+        conn.executemany("INSERT INTO users (name, email, unique_id) VALUES (?, ?, ?)", rows)
+        conn.commit()
+        conn.close()
+        os.replace(tmp_path, db_path)
+    return db_path
+
+
+def cached_training_csv(n_rows=253680, seed=42):
+    """
+    The CDC training CSV if it has been downloaded, otherwise a synthetic CSV of the same shape.
+    """
+    real_csv = os.path.join(REPO_ROOT, 'data', 'cdc_diabetes_health_indicators.csv')
+    if os.path.exists(real_csv):
+        return real_csv
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    csv_path = os.path.join(CACHE_DIR, f'cdc_synthetic_{n_rows}_{seed}.csv')
+    if not os.path.exists(csv_path):
+        rng = np.random.default_rng(seed)
+        df = random_features(rng, n_rows).astype(float)
+        df['Diabetes_binary'] = rng.integers(0, 2, size=n_rows)
+        df.to_csv(csv_path, index=False)
+    return csv_path
+
+
+def cached_labeled_training_csv(n_rows=253680, seed=42):
+    """
+    The CDC training CSV if it has been downloaded, otherwise a synthetic CSV of the
+    same shape whose labels follow synthetic_labels() (so model quality can be measured).
+    """
+    real_csv = os.path.join(REPO_ROOT, 'data', 'cdc_diabetes_health_indicators.csv')
+    if os.path.exists(real_csv):
+        return real_csv
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    csv_path = os.path.join(CACHE_DIR, f'cdc_labeled_{n_rows}_{seed}.csv')
+    if not os.path.exists(csv_path):
+        rng = np.random.default_rng(seed)
+        df = random_features(rng, n_rows).astype(float)
+        df['Diabetes_binary'] = synthetic_labels(rng, df)
+        df.to_csv(csv_path, index=False)
+    return csv_path
+
+
+def add_outcomes(db_path, n_rows, seed=42):
+    """
+    Add n_rows confirmed outcomes (synthetic inputs labelled by synthetic_labels) to a database's outcomes table.
+    """
+    rng = np.random.default_rng(seed)
+    X = random_features(rng, n_rows)
+    X['Diabetes_binary'] = synthetic_labels(rng, X)
+    X['user_id'] = [f"outcome{seed}_{i}" for i in range(n_rows)]
+    X['diagnosed_on'] = '2024-01-01'
+    columns = ['user_id'] + FEATURE_NAMES + ['Diabetes_binary', 'diagnosed_on']
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        f"INSERT INTO outcomes ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+        X[columns].astype(object).itertuples(index=False, name=None)
+    )
+    conn.commit()
+    conn.close()
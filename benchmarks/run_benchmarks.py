@@ -0,0 +1,601 @@
+"""
+Benchmark suite for inference, explanation, storage and page rendering.
+
+Usage:
+    python benchmarks/run_benchmarks.py                       # full run
+    python benchmarks/run_benchmarks.py --quick               # small sizes only
+    python benchmarks/run_benchmarks.py --save-baseline       # record benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --fail-on-regression  # exit 1 if slower than the baseline
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd  # noqa: E402
+
+import archive  # noqa: E402
+import cohort_index  # noqa: E402
+import database  # noqa: E402
+import drift  # noqa: E402
+import sharding  # noqa: E402
+from benchmarks import fixtures  # noqa: E402
+from utils import explain_model  # noqa: E402
+
+BASELINE_PATH = os.path.join(fixtures.REPO_ROOT, 'benchmarks', 'baseline.json')
+
+
+def measure(fn, repeats=5, warmup=1):
+    """
+    Run fn warmup + repeats times and summarise the timed runs in seconds.
+    """
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        "median_s": statistics.median(timings),
+        "min_s": timings[0],
+        "p95_s": timings[min(len(timings) - 1, int(round(0.95 * (len(timings) - 1))))],
+        "repeats": repeats,
+    }
+
+
+def bench_inference(results, model, scaler, rng, repeats):
+    single = fixtures.random_features(rng, 1).values
+    batch = fixtures.random_features(rng, 1000).values
+    single_scaled = scaler.transform(single)
+    batch_scaled = scaler.transform(batch)
+
+    results["scaler_transform_1"] = measure(lambda: scaler.transform(single), repeats)
+    results["predict_proba_1"] = measure(lambda: model.predict_proba(single_scaled), repeats)
+    results["predict_proba_1000"] = measure(lambda: model.predict_proba(batch_scaled), repeats)
+
+    # Multi-model host (diabetes and heart disease): 1000 patients scored one at a time
+    # vs in one batch (one predict_proba per model), both with a cold cache, and a cache hit
+    import model_host
+    import prediction_cache
+    host = model_host.ModelHost(cache=prediction_cache.LRUCache(maxsize=4096))
+    host.register(model_host.ModelBundle("diabetes", model, scaler, database.FEATURE_NAMES, "benchmark"))
+    host.register(fixtures.heart_disease_bundle())
+    heart = fixtures.heart_features().sample(len(batch), replace=True, random_state=0).reset_index(drop=True)
+    patients = [
+        dict(zip(database.FEATURE_NAMES, row), **heart.iloc[i].to_dict())
+        for i, row in enumerate(batch)
+    ]
+
+    def cold(score):
+        def run():
+            host.cache.clear()
+            score()
+        return run
+
+    results["score_all_1000_one_by_one"] = measure(
+        cold(lambda: [host.score_all(patient) for patient in patients]), max(1, repeats // 2), warmup=0
+    )
+    results["score_batch_1000"] = measure(cold(lambda: host.score_batch(patients)), repeats)
+    host.score_all(patients[0])
+    results["score_all_1_cached"] = measure(lambda: host.score_all(patients[0]), repeats * 20)
+
+
+def bench_explain(results, model, scaler, rng, explain_rows, repeats):
+    for n_rows in explain_rows:
+        X = fixtures.random_features(rng, n_rows).values
+        X_scaled = scaler.transform(X)
+        # Large batches take minutes per run, so they are timed fewer times
+        runs = repeats if n_rows <= 100 else 1
+        results[f"explain_model_{n_rows}"] = measure(
+            lambda: explain_model(database.FEATURE_NAMES, X, X_scaled, model),
+            runs, warmup=0 if n_rows > 100 else 1
+        )
+
+    # Single-row explanation with the explainer built once, as the model host does
+    import shap
+    explainer = shap.TreeExplainer(model)
+    X = fixtures.random_features(rng, 1).values
+    X_scaled = scaler.transform(X)
+    results["explain_model_1_shared_explainer"] = measure(
+        lambda: explain_model(database.FEATURE_NAMES, X, X_scaled, model, explainer=explainer), repeats
+    )
+
+    # Fast explanation modes (with exact fallback), calibrated on synthetic rows,
+    # with their agreement against exact SHAP on the held-out half
+    import explanations
+    X_fit = scaler.transform(fixtures.random_features(rng, 500).values)
+    X_validation = scaler.transform(fixtures.random_features(rng, 1000).values)
+    workdir = tempfile.mkdtemp(prefix="healthtrack_bench_")
+    try:
+        calibration = explanations.calibrate(
+            model, X_fit, X_validation, "benchmark", path=os.path.join(workdir, "calibration.json")
+        )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    for mode in ("sampled", "surrogate"):
+        mode_explainer = explanations.build_explainer(model, explainer, mode, calibration)
+        results[f"explain_model_1_{mode}"] = dict(
+            measure(lambda: explain_model(database.FEATURE_NAMES, X, X_scaled, model, explainer=mode_explainer), repeats),
+            **{key: value for key, value in calibration["modes"][mode]["with_fallback"].items() if key != "ms_per_row"}
+        )
+
+
+def bench_storage(results, sizes, rng, repeats, seed):
+    user_input = fixtures.random_features(rng, 1).iloc[0].to_dict()
+    # Added to every save_prediction_to_db call, so it must stay in the microseconds
+    monitor = drift.DriftMonitor(reference=None, state_path=None)
+    results["drift_update"] = measure(lambda: monitor.update(user_input), repeats * 100)
+    for size in sizes:
+        db_path = fixtures.cached_database(size, seed=seed)
+        conn = sqlite3.connect(db_path)
+        some_user = conn.execute("SELECT user_id FROM predictions LIMIT 1").fetchone()[0]
+
+        days = iter(range(1_000_000))
+
+        def save_new_day():
+            day = next(days)
+            database.save_prediction(conn, "bench_writer", user_input, "No Diabetes Present", 0.25,
+                                     prediction_date=(date(1900, 1, 1) + timedelta(days=day)).isoformat())
+
+        results[f"save_prediction_{size}"] = measure(save_new_day, repeats)
+        conn.execute("DELETE FROM predictions WHERE user_id = 'bench_writer'")
+        conn.commit()
+
+        results[f"fetch_users_{size}"] = measure(lambda: database.fetch_users(conn), max(1, repeats // 2))
+        results[f"fetch_user_data_{size}"] = measure(lambda: database.fetch_user_data(conn, some_user), repeats)
+        conn.close()
+
+
+def bench_archive(results, sizes, repeats, seed, horizon_days=90):
+    for size in sizes:
+        db_path = fixtures.cached_database(size, seed=seed)
+        workdir = tempfile.mkdtemp(prefix="healthtrack_archive_")
+        try:
+            work_path = os.path.join(workdir, "predictions.db")
+            archive_dir = os.path.join(workdir, "archive")
+            shutil.copy(db_path, work_path)
+            conn = sqlite3.connect(work_path)
+            # Busiest user, so the history spans every archived month
+            busiest_user = conn.execute(
+                "SELECT user_id FROM predictions GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1"
+            ).fetchone()[0]
+            max_date = conn.execute("SELECT MAX(date) FROM predictions").fetchone()[0]
+            conn.close()
+            size_before = os.path.getsize(work_path)
+
+            start = time.perf_counter()
+            archive.compact(work_path, archive_dir, horizon_days, today=date.fromisoformat(max_date))
+            results[f"archive_compact_{size}"] = {"median_s": time.perf_counter() - start, "repeats": 1}
+            tiers = archive.stats(work_path, archive_dir)
+            results[f"archive_storage_{size}"] = {
+                "db_mb_before": size_before / 1e6,
+                "db_mb_after": tiers["db_bytes"] / 1e6,
+                "archive_mb": tiers["archive_bytes"] / 1e6,
+            }
+
+            conn = sqlite3.connect(work_path)
+            results[f"fetch_user_history_{size}"] = measure(
+                lambda: archive.fetch_user_history(conn, busiest_user, archive_dir), repeats
+            )
+            results[f"fetch_users_tiered_{size}"] = measure(
+                lambda: archive.fetch_all_users(conn, archive_dir), max(1, repeats // 2)
+            )
+            conn.close()
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_shards(results, rng, seed, shard_counts=(1, 2, 4, 8), writers=8, rows_per_writer=200):
+    """
+    Concurrent writers (one thread per session) saving predictions through the router.
+    """
+    import threading
+
+    user_input = fixtures.random_features(rng, 1).iloc[0].to_dict()
+    for n_shards in shard_counts:
+        workdir = tempfile.mkdtemp(prefix="healthtrack_shards_")
+        try:
+            router = sharding.ShardRouter(
+                [os.path.join(workdir, f"predictions_{i:02d}.db") for i in range(n_shards)],
+                catalog_path=os.path.join(workdir, "catalog.db")
+            )
+            router.init_shards()
+            start_barrier = threading.Barrier(writers + 1)
+            latencies = []
+
+            def write(writer):
+                connections = {}
+                timings = []
+                start_barrier.wait()
+                for i in range(rows_per_writer):
+                    user_id = f"writer{writer}_user{i}"
+                    shard = router.shard_for(user_id)
+                    if shard not in connections:
+                        connections[shard] = router.connect(shard)
+                    start = time.perf_counter()
+                    database.save_prediction(connections[shard], user_id, user_input, "No Diabetes Present", 0.25)
+                    timings.append(time.perf_counter() - start)
+                for conn in connections.values():
+                    conn.close()
+                latencies.extend(timings)
+
+            threads = [threading.Thread(target=write, args=(writer,)) for writer in range(writers)]
+            for thread in threads:
+                thread.start()
+            start_barrier.wait()
+            start = time.perf_counter()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            latencies.sort()
+            results[f"concurrent_writes_{n_shards}_shards"] = {
+                "median_s": statistics.median(latencies),
+                "p95_s": latencies[int(0.95 * (len(latencies) - 1))],
+                "p99_s": latencies[int(0.99 * (len(latencies) - 1))],
+                "repeats": len(latencies),
+                "rows_per_s": len(latencies) / elapsed,
+            }
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_cohort(results, scaler, sizes, seed):
+    for size in sizes:
+        conn = sqlite3.connect(fixtures.cached_database(size, seed=seed))
+        vectors, ids, users = cohort_index.load_vectors(conn, scaler)
+        conn.close()
+        stats = cohort_index.benchmark(vectors, ids, users, seed=seed)
+        results[f"cohort_index_build_{size}"] = {"median_s": stats["build_s"], "repeats": 1, "index_mb": stats["index_mb"]}
+        results[f"cohort_search_bruteforce_{size}"] = {"median_s": stats["brute_force_ms"] / 1000, "repeats": 100}
+        results[f"cohort_search_partitioned_{size}"] = {
+            "median_s": stats["partitioned_ms"] / 1000, "repeats": 100, "recall_at_10": stats["recall_at_k"]
+        }
+
+
+def bench_login(results, n_users, repeats, seed):
+    db_path = fixtures.cached_users_database(n_users, seed=seed)
+    work_path = db_path + '.work'
+    shutil.copy(db_path, work_path)
+    # Fixtures cached by older versions predate the users.clinic column
+    database.init_db(work_path)
+    try:
+        conn = sqlite3.connect(work_path)
+        # Zipf rank 1 is the most common surname in the fixture
+        common_surname = "surname1x"
+        existing_email = conn.execute("SELECT email FROM users ORDER BY id DESC LIMIT 1").fetchone()[0]
+
+        # The previous allocation scheme: LIKE scan over every same-surname ID
+        def like_scan_unique_id():
+            rows = conn.execute("SELECT unique_id FROM users WHERE unique_id LIKE ?", (f"{common_surname}%",)).fetchall()
+            numbers = [int(row[0].replace(common_surname, "")) for row in rows if row[0].replace(common_surname, "").isdigit()]
+            return f"{common_surname}{max(numbers, default=0) + 1}"
+
+        results[f"generate_unique_id_like_scan_{n_users}"] = measure(like_scan_unique_id, repeats)
+        conn.close()
+
+        counter = iter(range(10 ** 9))
+        # First call seeds the surname counter; the timed runs use the O(1) path
+        results[f"create_user_{n_users}"] = measure(
+            lambda: database.create_user(f"Bench {common_surname}", f"new{next(counter)}@example.com", db_path=work_path),
+            repeats
+        )
+
+        def uncached_lookup():
+            database.user_cache.clear()
+            database.find_user(email=existing_email, db_path=work_path)
+
+        results[f"find_user_by_email_{n_users}"] = measure(uncached_lookup, repeats)
+        database.find_user(email=existing_email, db_path=work_path)
+        results[f"find_user_by_email_cached_{n_users}"] = measure(
+            lambda: database.find_user(email=existing_email, db_path=work_path), repeats
+        )
+    finally:
+        os.remove(work_path)
+
+
+def bench_pages(results, model, scaler, seed, repeats):
+    from streamlit.testing.v1 import AppTest
+    import joblib
+
+    workdir = tempfile.mkdtemp(prefix="healthtrack_bench_")
+    cwd = os.getcwd()
+    try:
+        # Pages use relative paths, so render them from a scratch directory holding
+        # the model files and a small synthetic database
+        os.makedirs(os.path.join(workdir, 'models'))
+        joblib.dump(model, os.path.join(workdir, 'models', 'random_forest_diabetes_model.pkl'))
+        joblib.dump(scaler, os.path.join(workdir, 'models', 'scaler.pkl'))
+        shutil.copy(fixtures.cached_database(10000, seed=seed), os.path.join(workdir, database.DB_PATH))
+        long_user = fixtures.add_long_history_user(os.path.join(workdir, database.DB_PATH), model, scaler, seed=seed)
+        os.chdir(workdir)
+        os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+        def render(script, logged_in=True):
+            def run():
+                at = AppTest.from_file(os.path.join(fixtures.REPO_ROOT, script), default_timeout=120)
+                at.secrets["OPENAI_API_KEY"] = "sk-benchmark"
+                if logged_in:
+                    at.session_state["logged_in"] = True
+                    at.session_state["user_id"] = "synthetic1"
+                at.run()
+                if at.exception:
+                    raise RuntimeError(f"{script} raised: {at.exception[0].value}")
+            return run
+
+        results["render_login"] = measure(render("login.py", logged_in=False), repeats)
+        results["render_predictions"] = measure(render("pages/predictions.py"), repeats)
+        results["render_dashboard"] = measure(render("pages/dashboard.py"), repeats)
+
+        # Ten years of daily predictions: time the rerun after selecting the user
+        dashboard = AppTest.from_file(os.path.join(fixtures.REPO_ROOT, "pages/dashboard.py"), default_timeout=300)
+        dashboard.session_state["logged_in"] = True
+        dashboard.run()
+        option = next(option for option in dashboard.selectbox[0].options if option.startswith(long_user))
+        dashboard.selectbox[0].set_value(option)
+        results["render_dashboard_10y_history"] = measure(lambda: dashboard.run(), max(1, repeats // 2))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_report(results, model, scaler, seed):
+    import cohort_report
+    import model_host
+    from benchmarks.fake_llm import FakeLLMServer
+
+    workdir = tempfile.mkdtemp(prefix="healthtrack_bench_")
+    # 200 ms per LLM call and 5% rate-limit errors, served locally
+    server = FakeLLMServer(latency_s=0.2, error_rate=0.05, seed=seed).start()
+    try:
+        db_path = os.path.join(workdir, "predictions.db")
+        shutil.copy(fixtures.cached_database(10000, seed=seed), db_path)
+        router = sharding.ShardRouter([db_path], catalog_path=db_path)
+        bundle = model_host.ModelBundle("diabetes", model, scaler, database.FEATURE_NAMES, "benchmark")
+
+        def run(concurrency, report_dir):
+            server.max_in_flight = 0
+            summary = cohort_report.run_report(
+                router, bundle, bundle.explainer, cohort_report.openai_completion("sk-benchmark", server.url),
+                report_date=date(2024, 1, 1), days=None, report_dir=report_dir,
+                concurrency=concurrency, requests_per_minute=60000, backoff_s=0.05
+            )
+            return {
+                "median_s": summary["elapsed_s"],
+                "repeats": 1,
+                "patients": summary["patients"],
+                "generated": summary["generated"],
+                "requests": summary["requests"],
+                "retries": summary["retries"],
+                "max_in_flight": server.max_in_flight,
+                "patients_per_min": summary["patients_per_min"],
+            }
+
+        # Every at-risk patient of the 10k-row database, one call at a time vs through the pool
+        for concurrency in (1, 8, 32):
+            results[f"cohort_report_concurrency_{concurrency}"] = run(concurrency, os.path.join(workdir, f"report_{concurrency}"))
+        # Rerun over a finished checkpoint: selection and SHAP only
+        results["cohort_report_resume"] = run(8, os.path.join(workdir, "report_8"))
+    finally:
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_sessions(results, rng, repeats, n_sessions=1000):
+    """
+    Session accounting with n_sessions sessions, each pinning one compact cached prediction.
+    """
+    import prediction_cache
+    import session_memory
+
+    cache = prediction_cache.LRUCache(maxsize=n_sessions)
+    registry = session_memory.SessionRegistry(idle_timeout_s=1800)
+    now = time.time()
+    states = []
+    for i in range(n_sessions):
+        key = f"input{i}"
+        cache.put(key, {
+            "diabetes_prob": 0.5, "prediction_result": "Diabetes Present",
+            "user_model_text": "The model predicts: **Diabetes Present** with 50.00% probability",
+            "shap_values": rng.normal(size=len(database.FEATURE_NAMES)).astype(np.float32),
+            "scaled_input": rng.normal(size=len(database.FEATURE_NAMES)).astype(np.float32),
+            "recommendations": "x" * 3000,
+        })
+        state = dict(session_memory.LOGGED_OUT_STATE, logged_in=True, user_id=f"user{i}", prediction_made=True, prediction_key=key)
+        states.append((f"session{i}", state, [(cache, key)]))
+        registry.track(f"session{i}", state, [(cache, key)], now=now)
+
+    session_id, state, pinned = states[0]
+    results["session_track"] = measure(lambda: registry.track(session_id, state, pinned, now=now), repeats * 20)
+    results["session_memory"] = {"sessions": n_sessions, "bytes_per_session": registry.totals()["bytes"] / n_sessions}
+    start = time.perf_counter()
+    evicted = registry.sweep(now=now + 3600)
+    results[f"session_sweep_{n_sessions}"] = {
+        "median_s": time.perf_counter() - start, "repeats": 1, "evicted": evicted, "cache_entries_left": len(cache)
+    }
+
+
+def bench_training(results, model, scaler, seed, outcome_counts=(500, 5000, 50000)):
+    """
+    Full retrain (notebook pipeline without ADASYN) vs incremental updates from n new outcomes.
+    """
+    import joblib
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.model_selection import train_test_split
+    from sklearn.preprocessing import StandardScaler
+
+    import incremental_training
+
+    csv_path = fixtures.cached_labeled_training_csv(seed=seed)
+    start = time.perf_counter()
+    data = pd.read_csv(csv_path)
+    X = data[database.FEATURE_NAMES].fillna(data[database.FEATURE_NAMES].mean())
+    X_train, _, y_train, _ = train_test_split(X, data['Diabetes_binary'], test_size=0.2, random_state=42)
+    RandomForestClassifier(n_estimators=100, max_depth=10, class_weight='balanced', random_state=42).fit(
+        StandardScaler().fit_transform(X_train), y_train
+    )
+    results["training_full_retrain"] = {"median_s": time.perf_counter() - start, "repeats": 1, "rows": len(X_train)}
+
+    workdir = tempfile.mkdtemp(prefix="healthtrack_bench_")
+    try:
+        paths = {
+            "model_path": os.path.join(workdir, "model.pkl"),
+            "scaler_path": os.path.join(workdir, "scaler.pkl"),
+            "holdout_path": os.path.join(workdir, "holdout.npz"),
+            "versions_dir": os.path.join(workdir, "versions"),
+            "log_path": os.path.join(workdir, "versions.jsonl"),
+        }
+        joblib.dump(scaler, paths["scaler_path"])
+        start = time.perf_counter()
+        incremental_training.build_holdout(csv_path, paths["holdout_path"])
+        results["training_init_holdout"] = {"median_s": time.perf_counter() - start, "repeats": 1}
+
+        for n_outcomes in outcome_counts:
+            # Every update starts from the same model, with n_outcomes pending outcomes
+            joblib.dump(model, paths["model_path"])
+            db_path = os.path.join(workdir, f"outcomes_{n_outcomes}.db")
+            database.init_db(db_path)
+            fixtures.add_outcomes(db_path, n_outcomes, seed=seed)
+            summary = incremental_training.update(sharding.ShardRouter([db_path], catalog_path=db_path), **paths)
+            results[f"training_incremental_{n_outcomes}"] = {
+                "median_s": summary["timings"]["total_s"],
+                "repeats": 1,
+                "status": summary["status"],
+                "fit_s": summary["timings"]["fit_s"],
+                "evaluate_s": summary["timings"]["evaluate_s"],
+                "replay_rows": summary["replay_rows"],
+                "roc_auc_before": summary["current_metrics"]["roc_auc"],
+                "roc_auc_after": summary["metrics"]["roc_auc"],
+            }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_csv(results, repeats, seed):
+    csv_path = fixtures.cached_training_csv(seed=seed)
+    results["training_csv_load"] = measure(lambda: pd.read_csv(csv_path), repeats)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Return [(name, baseline_median, current_median, ratio)] for cases slower than the baseline by more than tolerance.
+    Size and memory results (no median_s) are not compared.
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous or not previous.get("median_s") or "median_s" not in current:
+            continue
+        ratio = current["median_s"] / previous["median_s"]
+        if ratio > 1 + tolerance:
+            regressions.append((name, previous["median_s"], current["median_s"], ratio))
+    return regressions
+
+
+def parse_int_list(value):
+    return [int(item) for item in value.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HealthTrack benchmark suite")
+    parser.add_argument("--sizes", type=parse_int_list, default=[10_000, 1_000_000, 10_000_000],
+                        help="Comma-separated prediction counts for the synthetic databases")
+    parser.add_argument("--users", type=int, default=1_000_000, help="User count for the login benchmarks")
+    parser.add_argument("--explain-rows", type=parse_int_list, default=[1, 100, 10_000])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--quick", action="store_true", help="Only 10k-row databases and small explain batches")
+    parser.add_argument("--only", nargs="*", default=None,
+                        help="Groups to run: inference explain storage archive shards cohort login pages report sessions training csv")
+    parser.add_argument("--output", default=None, help="Write results JSON here (default: stdout)")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown ratio before flagging")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    if args.quick:
+        args.sizes = [10_000]
+        args.users = 10_000
+        args.explain_rows = [1, 100]
+        args.repeats = min(args.repeats, 3)
+    groups = set(args.only or ["inference", "explain", "storage", "archive", "shards", "cohort", "login", "pages", "report", "sessions", "training", "csv"])
+
+    rng = np.random.default_rng(args.seed)
+    model, scaler, model_source = fixtures.load_or_train_model(args.seed)
+    results = {}
+
+    if "inference" in groups:
+        bench_inference(results, model, scaler, rng, args.repeats)
+    if "explain" in groups:
+        bench_explain(results, model, scaler, rng, args.explain_rows, args.repeats)
+    if "storage" in groups:
+        bench_storage(results, args.sizes, rng, args.repeats, args.seed)
+    if "archive" in groups:
+        bench_archive(results, args.sizes, args.repeats, args.seed)
+    if "shards" in groups:
+        bench_shards(results, rng, args.seed)
+    if "cohort" in groups:
+        bench_cohort(results, scaler, args.sizes, args.seed)
+    if "login" in groups:
+        bench_login(results, args.users, args.repeats, args.seed)
+    if "pages" in groups:
+        bench_pages(results, model, scaler, args.seed, args.repeats)
+    if "report" in groups:
+        bench_report(results, model, scaler, args.seed)
+    if "sessions" in groups:
+        bench_sessions(results, rng, args.repeats)
+    if "training" in groups:
+        bench_training(results, model, scaler, args.seed)
+    if "csv" in groups:
+        bench_csv(results, args.repeats, args.seed)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.platform(),
+            "model": model_source,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            f.write(text)
+        print(f"Baseline saved to {args.baseline}", file=sys.stderr)
+        return 0
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, before, after, ratio in regressions:
+            print(f"REGRESSION {name}: {before * 1000:.2f} ms -> {after * 1000:.2f} ms ({ratio:.2f}x)", file=sys.stderr)
+        if regressions and args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
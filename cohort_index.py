@@ -0,0 +1,386 @@
+"""
+Nearest-neighbour index over the scaled feature vectors in the predictions table,
+used for "patients like me" lookups.
+
+Vectors are scaled with models/scaler.pkl and stored as one contiguous float32
+array, grouped by a coarse k-means partition (an inverted file): a query only
+scans the rows in the few partitions closest to it. New predictions are added
+to a small pending buffer that is scanned exhaustively, and the partitioned part
+is rebuilt from the database on a background thread once the buffer grows.
+A failed build is logged, and no new build starts for REBUILD_BACKOFF_S.
+"""
+import logging
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import sharding
+from database import FEATURE_NAMES, numeric_features
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Rebuild once this share of rows (or at least MIN_PENDING_REBUILD rows) is pending
+PENDING_REBUILD_SHARE = 0.05
+MIN_PENDING_REBUILD = 1000
+KMEANS_SAMPLE = 50000
+KMEANS_ITERATIONS = 10
+ASSIGN_CHUNK = 32768
+# Seconds to wait after a failed build before trying again
+REBUILD_BACKOFF_S = 300
+
+
+def _squared_distances(vectors, query, vector_norms=None):
+    if vector_norms is None:
+        vector_norms = np.einsum('ij,ij->i', vectors, vectors)
+    return vector_norms - 2.0 * (vectors @ query) + float(query @ query)
+
+
+def _nearest_centroids(vectors, centroids):
+    centroid_norms = np.einsum('ij,ij->i', centroids, centroids)
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_CHUNK):
+        chunk = vectors[start:start + ASSIGN_CHUNK]
+        # |x - c|^2 without the |x|^2 term, which doesn't change the argmin
+        distances = centroid_norms[None, :] - 2.0 * (chunk @ centroids.T)
+        assignments[start:start + ASSIGN_CHUNK] = np.argmin(distances, axis=1)
+    return assignments
+
+
+def train_partitions(vectors, n_lists, seed=0):
+    """
+    Fit n_lists k-means centroids on a sample of the vectors (Lloyd's algorithm).
+    """
+    rng = np.random.default_rng(seed)
+    sample = vectors if len(vectors) <= KMEANS_SAMPLE else vectors[rng.choice(len(vectors), KMEANS_SAMPLE, replace=False)]
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assignments = _nearest_centroids(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=n_lists)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+class CohortIndex:
+    """
+    Inverted-file nearest-neighbour index over scaled prediction vectors.
+
+    Parameters:
+    - vectors: (n, n_features) float32 array of scaled feature vectors.
+    - prediction_ids: Prediction row id of every vector.
+    - user_ids: User id of every vector.
+    """
+
+    def __init__(self, vectors, prediction_ids, user_ids, n_lists=None, seed=0):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        prediction_ids = np.asarray(prediction_ids, dtype=np.int64)
+        user_ids = np.asarray(user_ids, dtype=object)
+        self.user_names, user_codes = np.unique(user_ids, return_inverse=True)
+        user_codes = user_codes.astype(np.int32)
+
+        n_rows = len(vectors)
+        if n_lists is None:
+            n_lists = int(np.clip(np.sqrt(n_rows), 1, 4096))
+        n_lists = max(1, min(n_lists, n_rows))
+        if n_rows:
+            self.centroids = train_partitions(vectors, n_lists, seed)
+            assignments = _nearest_centroids(vectors, self.centroids)
+        else:
+            self.centroids = np.zeros((1, len(FEATURE_NAMES)), dtype=np.float32)
+            assignments = np.zeros(0, dtype=np.int32)
+
+        # Store rows grouped by partition so each partition is one contiguous slice
+        order = np.argsort(assignments, kind='stable')
+        self.vectors = vectors[order]
+        self.norms = np.einsum('ij,ij->i', self.vectors, self.vectors)
+        self.prediction_ids = prediction_ids[order]
+        self.user_codes = user_codes[order]
+        self.alive = np.ones(n_rows, dtype=bool)
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=len(self.centroids)))])
+        self._id_order = np.argsort(self.prediction_ids)
+
+        # Rows added since the build, scanned exhaustively
+        self._pending_vectors = []
+        self._pending_ids = []
+        self._pending_users = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return int(self.alive.sum()) + len(self._pending_ids)
+
+    @property
+    def pending(self):
+        return len(self._pending_ids)
+
+    def nbytes(self):
+        return self.vectors.nbytes + self.norms.nbytes + self.prediction_ids.nbytes + self.user_codes.nbytes + self.centroids.nbytes
+
+    def add(self, prediction_id, user_id, vector):
+        """
+        Add (or replace) the vector for a prediction row.
+        """
+        with self._lock:
+            position = np.searchsorted(self.prediction_ids, prediction_id, sorter=self._id_order)
+            if position < len(self._id_order) and self.prediction_ids[self._id_order[position]] == prediction_id:
+                self.alive[self._id_order[position]] = False
+            if prediction_id in self._pending_ids:
+                index = self._pending_ids.index(prediction_id)
+                del self._pending_ids[index], self._pending_vectors[index], self._pending_users[index]
+            self._pending_ids.append(int(prediction_id))
+            self._pending_vectors.append(np.asarray(vector, dtype=np.float32).ravel())
+            self._pending_users.append(user_id)
+
+    def search(self, query, k=10, nprobe=8, exact=False):
+        """
+        Find the k nearest stored vectors to a scaled query vector.
+
+        Parameters:
+        - query: Scaled feature vector.
+        - k: Number of neighbours to return.
+        - nprobe: Number of partitions to scan (ignored when exact=True).
+        - exact: Scan every row instead of the nearest partitions.
+
+        Returns:
+        - (prediction ids, user ids, squared distances), nearest first.
+        """
+        query = np.asarray(query, dtype=np.float32).ravel()
+        if exact or nprobe >= len(self.centroids):
+            candidate_rows = np.arange(len(self.vectors))
+            distances = _squared_distances(self.vectors, query, self.norms)
+        else:
+            nearest_lists = np.argsort(_squared_distances(self.centroids, query))[:nprobe]
+            candidate_rows = np.concatenate([
+                np.arange(self.offsets[i], self.offsets[i + 1]) for i in nearest_lists
+            ])
+            distances = _squared_distances(self.vectors[candidate_rows], query, self.norms[candidate_rows])
+
+        alive = self.alive[candidate_rows]
+        distances = distances[alive]
+        candidate_rows = candidate_rows[alive]
+        ids = self.prediction_ids[candidate_rows]
+        users = self.user_names[self.user_codes[candidate_rows]]
+
+        with self._lock:
+            if self._pending_ids:
+                pending_vectors = np.vstack(self._pending_vectors)
+                distances = np.concatenate([distances, _squared_distances(pending_vectors, query)])
+                ids = np.concatenate([ids, np.asarray(self._pending_ids, dtype=np.int64)])
+                users = np.concatenate([users, np.asarray(self._pending_users, dtype=object)])
+
+        k = min(k, len(distances))
+        if k == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=object), np.array([], dtype=np.float32)
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top])]
+        return ids[top], users[top], distances[top]
+
+    def similar_patients(self, query, n_patients=10, exclude_user=None, nprobe=8):
+        """
+        Distinct users whose stored predictions are closest to the query.
+        """
+        k = n_patients * 20
+        while True:
+            _, users, distances = self.search(query, k=k, nprobe=nprobe)
+            seen = []
+            for user in users:
+                if user != exclude_user and user not in seen:
+                    seen.append(user)
+                    if len(seen) == n_patients:
+                        return seen
+            if k >= len(self):
+                return seen
+            k *= 4
+
+
+def load_vectors(conn, scaler, chunk_size=200000):
+    """
+    Read and scale every stored prediction vector. "Yes"/"No" text features are read
+    as 1/0; rows with missing or other non-numeric features are skipped.
+
+    Returns:
+    - (float32 vectors, prediction ids, user ids)
+    """
+    query = f"SELECT id, user_id, {', '.join(FEATURE_NAMES)} FROM predictions"
+    vectors, ids, users = [], [], []
+    for chunk in pd.read_sql_query(query, conn, chunksize=chunk_size):
+        features = numeric_features(chunk)
+        valid = features.notna().all(axis=1).to_numpy()
+        vectors.append(scaler.transform(features.to_numpy()[valid]).astype(np.float32))
+        ids.append(chunk['id'].to_numpy(dtype=np.int64)[valid])
+        users.append(chunk['user_id'].to_numpy(dtype=object)[valid])
+    if not vectors:
+        return np.zeros((0, len(FEATURE_NAMES)), dtype=np.float32), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=object)
+    return np.vstack(vectors), np.concatenate(ids), np.concatenate(users)
+
+
+def build_from_database(scaler, router=None):
+    """
+    Index over the predictions of every shard (loaded in parallel).
+    """
+    router = router or sharding.get_router()
+    parts = router.fan_out(lambda conn: load_vectors(conn, scaler))
+    vectors, ids, users = (np.concatenate([part[i] for part in parts]) for i in range(3))
+    return CohortIndex(vectors, ids, users)
+
+
+def summarize_patients(conn, user_ids):
+    """
+    Outcome and trend of each user's prediction history.
+
+    Returns:
+    - DataFrame with user_id, first and latest diabetes probability, latest
+      prediction, number of predictions and days covered.
+    """
+    if not len(user_ids):
+        return pd.DataFrame(columns=["user_id", "first_probability", "latest_probability", "latest_prediction", "predictions", "days"])
+    placeholders = ", ".join("?" for _ in user_ids)
+    history = pd.read_sql_query(
+        f"SELECT user_id, date, Probability, Prediction FROM predictions WHERE user_id IN ({placeholders}) ORDER BY date",
+        conn, params=list(user_ids)
+    )
+    history['date'] = pd.to_datetime(history['date'])
+    grouped = history.groupby('user_id')
+    summary = pd.DataFrame({
+        "first_probability": grouped['Probability'].first(),
+        "latest_probability": grouped['Probability'].last(),
+        "latest_prediction": grouped['Prediction'].last(),
+        "predictions": grouped.size(),
+        "days": (grouped['date'].max() - grouped['date'].min()).dt.days,
+    })
+    return summary.reindex(user_ids).reset_index().rename(columns={"index": "user_id"})
+
+
+def summarize_cohort(user_ids, router=None):
+    """
+    summarize_patients() for users spread over any number of shards, in the given order.
+    """
+    router = router or sharding.get_router()
+    summaries = [summary for summary in router.fan_out_users(summarize_patients, list(user_ids)) if not summary.empty]
+    if not summaries:
+        return summarize_patients(None, [])
+    merged = pd.concat(summaries, ignore_index=True).set_index("user_id")
+    return merged.reindex(user_ids).reset_index().rename(columns={"index": "user_id"})
+
+
+# Process-wide index shared by all sessions
+_index = None
+_building = False
+_rebuild_adds = None
+_failed_at = None
+_last_error = None
+_state_lock = threading.Lock()
+
+
+def get_index():
+    """
+    The current index, or None while the first build is still running (or after it failed).
+    """
+    return _index
+
+
+def is_building():
+    with _state_lock:
+        return _building
+
+
+def last_error():
+    """
+    "<exception type>: <message>" of the last failed build, or None if the last build succeeded.
+    """
+    return _last_error
+
+
+def build_in_background(scaler, router=None):
+    """
+    Start a background (re)build of the index from the database, unless one is running
+    or the last one failed less than REBUILD_BACKOFF_S ago. Rows added while the build
+    runs are replayed onto the new index before it is swapped in.
+
+    Returns:
+    - The build thread, or None if a build was already running or is backing off.
+    """
+    global _building, _rebuild_adds
+    with _state_lock:
+        if _building or (_failed_at is not None and time.time() - _failed_at < REBUILD_BACKOFF_S):
+            return None
+        _building = True
+        _rebuild_adds = []
+
+    def run():
+        global _index, _building, _rebuild_adds, _failed_at, _last_error
+        try:
+            with span("cohort_index.build"):
+                new_index = build_from_database(scaler, router)
+            with _state_lock:
+                for prediction_id, user_id, vector in _rebuild_adds:
+                    new_index.add(prediction_id, user_id, vector)
+                _index = new_index
+                _failed_at, _last_error = None, None
+        except Exception as e:
+            logger.exception("Cohort index build failed; retrying in %s s at the earliest", REBUILD_BACKOFF_S)
+            with _state_lock:
+                _failed_at, _last_error = time.time(), f"{type(e).__name__}: {e}"
+        finally:
+            with _state_lock:
+                _building = False
+                _rebuild_adds = None
+
+    thread = threading.Thread(target=run, name="cohort-index-build", daemon=True)
+    thread.start()
+    return thread
+
+
+def add_prediction(prediction_id, user_id, scaled_vector, scaler, router=None):
+    """
+    Incrementally index a newly saved prediction, triggering a background rebuild
+    when the pending buffer gets large.
+    """
+    with _state_lock:
+        if _rebuild_adds is not None:
+            _rebuild_adds.append((prediction_id, user_id, scaled_vector))
+        index = _index
+    if index is None:
+        return
+    index.add(prediction_id, user_id, scaled_vector)
+    if index.pending >= max(MIN_PENDING_REBUILD, PENDING_REBUILD_SHARE * len(index)):
+        build_in_background(scaler, router)
+
+
+def benchmark(vectors, ids, users, n_queries=100, k=10, nprobe=8, seed=0):
+    """
+    Compare partitioned search against a brute-force scan.
+
+    Returns:
+    - Dictionary with build time, median query times (ms) and recall@k of the partitioned search.
+    """
+    start = time.perf_counter()
+    index = CohortIndex(vectors, ids, users, seed=seed)
+    build_s = time.perf_counter() - start
+
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.choice(len(vectors), n_queries, replace=False)]
+    exact_times, fast_times, recalls = [], [], []
+    for query in queries:
+        start = time.perf_counter()
+        exact_ids, _, exact_distances = index.search(query, k=k, exact=True)
+        exact_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        _, _, fast_distances = index.search(query, k=k, nprobe=nprobe)
+        fast_times.append(time.perf_counter() - start)
+        # Compare by distance so ties between identical vectors count as hits
+        threshold = exact_distances[-1] + 1e-4
+        recalls.append(np.sum(fast_distances <= threshold) / len(exact_ids))
+    return {
+        "rows": len(vectors),
+        "partitions": len(index.centroids),
+        "index_mb": index.nbytes() / 1e6,
+        "build_s": build_s,
+        "brute_force_ms": float(np.median(exact_times) * 1000),
+        "partitioned_ms": float(np.median(fast_times) * 1000),
+        "recall_at_k": float(np.mean(recalls)),
+    }
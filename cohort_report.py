@@ -0,0 +1,413 @@
+"""
+Weekly cohort report: personalised lifestyle recommendations for every at-risk patient.
+
+Patients are selected from the predictions table on every shard: each user's latest
+prediction in the report window, if its probability reaches the risk threshold.
+Their SHAP contributions are computed in one batch and every patient's prompt (the
+same one the predictions page sends) goes through an asyncio pool that limits
+concurrency and request rate, retries rate-limit and server errors with backoff and
+sends identical prompts only once.
+
+Each finished recommendation is appended to a JSONL checkpoint next to the report,
+so rerunning an interrupted report only generates what is missing.
+
+Usage:
+    python cohort_report.py                          # patients at >= 50% risk in the last 7 days
+    python cohort_report.py --threshold 0.7 --days 14
+    python cohort_report.py --base-url http://127.0.0.1:8765/v1   # against benchmarks/fake_llm.py
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from database import FEATURE_NAMES, numeric_features
+from tracing import span
+from utils import contributions_frame, recommendation_prompt
+
+REPORT_DIR = os.getenv("HEALTHTRACK_REPORT_DIR", "reports")
+
+# Patients whose latest prediction in the window reaches this probability are included
+RISK_THRESHOLD = 0.5
+WINDOW_DAYS = 7
+
+# LLM pool defaults: requests in flight, requests per minute, retries per prompt
+CONCURRENCY = 8
+REQUESTS_PER_MINUTE = 500
+MAX_RETRIES = 4
+BACKOFF_S = 1.0
+
+# SQLite's default limit on host parameters per statement is 999
+_IN_CHUNK = 900
+
+
+def select_patients(router, threshold=RISK_THRESHOLD, since=None):
+    """
+    Latest prediction per user since a date, for users at or above the risk threshold.
+
+    Parameters:
+    - router: sharding.ShardRouter.
+    - threshold: Minimum Probability.
+    - since: First 'YYYY-MM-DD' date of the window (None for all history).
+
+    Returns:
+    - DataFrame of prediction rows (id, user_id, features, Prediction, Probability,
+      date) plus the user's name, highest risk first.
+    """
+    def query(conn):
+        return pd.read_sql_query('''
+            SELECT predictions.*
+            FROM predictions
+            INNER JOIN (
+                SELECT user_id, MAX(date) AS date FROM predictions WHERE date >= ? GROUP BY user_id
+            ) latest
+            ON latest.user_id = predictions.user_id AND latest.date = predictions.date
+            WHERE predictions.Probability >= ?
+        ''', conn, params=(since or '', threshold))
+
+    with span("cohort_report.select_patients"):
+        frames = router.fan_out(query)
+        patients = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+        names = {}
+        user_ids = patients['user_id'].tolist()
+        conn = router.connect_catalog()
+        try:
+            for start in range(0, len(user_ids), _IN_CHUNK):
+                chunk = user_ids[start:start + _IN_CHUNK]
+                names.update(conn.execute(
+                    f"SELECT unique_id, name FROM users WHERE unique_id IN ({', '.join('?' for _ in chunk)})", chunk
+                ))
+        finally:
+            conn.close()
+    patients['name'] = patients['user_id'].map(names)
+    return patients.sort_values(['Probability', 'user_id'], ascending=[False, True], ignore_index=True)
+
+
+def unusable_patients(patients):
+    """
+    Patients whose features can't be read as numbers (legacy "Yes"/"No" text is fine).
+
+    Returns:
+    - {prediction id: error message naming the unreadable features}.
+    """
+    features = numeric_features(patients)
+    missing = features.isna()
+    return {
+        int(prediction_id): f"non-numeric {', '.join(features.columns[row])} in the prediction"
+        for prediction_id, row in zip(patients['id'], missing.to_numpy()) if row.any()
+    }
+
+
+def build_prompts(patients, bundle, explainer):
+    """
+    The recommendations prompt of every patient, with SHAP values computed in one batch.
+
+    Parameters:
+    - patients: Result of select_patients, without the unusable_patients rows.
+    - bundle: The diabetes model_host bundle (for the scaler).
+    - explainer: Explainer with shap_values(X_scaled), e.g. explanations.explainer_for(bundle).
+
+    Returns:
+    - List of prompt strings, in patient order.
+    """
+    if patients.empty:
+        return []
+    with span("cohort_report.shap_values"):
+        X_scaled = bundle.transform(numeric_features(patients).to_numpy())
+        shap_values = np.asarray(explainer.shap_values(X_scaled))
+        shap_values = shap_values[..., 1] if shap_values.ndim == 3 else shap_values
+
+    prompts = []
+    for (_, patient), values in zip(patients.iterrows(), shap_values):
+        probability = float(patient['Probability'])
+        # Same wording as the predictions page
+        user_model_text = f"The model predicts: **{patient['Prediction']}** with {max(probability, 1 - probability) * 100:.2f}% probability"
+        prompts.append(recommendation_prompt(contributions_frame(FEATURE_NAMES, values), user_model_text))
+    return prompts
+
+
+def prompt_key(prompt):
+    return hashlib.sha256(prompt.encode()).hexdigest()[:16]
+
+
+def retryable_errors():
+    """
+    Exceptions worth retrying: rate limits, timeouts, dropped connections and 5xx responses.
+    """
+    import openai
+    return (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError, asyncio.TimeoutError)
+
+
+def openai_completion(api_key, base_url=None, model=None, timeout_s=60):
+    """
+    Async completion function backed by ChatOpenAI.
+
+    The client's own retries are disabled; LLMPool retries instead, so they are
+    counted and honour the pool's rate limit.
+    """
+    from langchain_openai import ChatOpenAI
+    options = {"model": model} if model else {}
+    llm = ChatOpenAI(api_key=api_key, base_url=base_url, max_retries=0, timeout=timeout_s, **options)
+
+    async def complete(prompt):
+        return (await llm.ainvoke(prompt)).content
+    return complete
+
+
+class RateLimiter:
+    """
+    Spaces request starts at least 60 / requests_per_minute seconds apart.
+    """
+
+    def __init__(self, requests_per_minute):
+        self.interval = 60.0 / requests_per_minute
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class LLMPool:
+    """
+    Bounded, rate-limited, retrying and deduplicating front for an async completion function.
+
+    Parameters:
+    - complete: Async function prompt -> text.
+    - concurrency: Most requests in flight at once.
+    - requests_per_minute: Request start rate limit.
+    - max_retries: Retries per prompt after a retryable error.
+    - backoff_s: First retry delay; doubles on each attempt, with jitter.
+    - retry_on: Exception types to retry (default: retryable_errors()).
+    """
+
+    def __init__(self, complete, concurrency=CONCURRENCY, requests_per_minute=REQUESTS_PER_MINUTE,
+                 max_retries=MAX_RETRIES, backoff_s=BACKOFF_S, retry_on=None):
+        self.complete = complete
+        self.max_retries = max_retries
+        self.backoff_s = backoff_s
+        self.retry_on = retry_on if retry_on is not None else retryable_errors()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._limiter = RateLimiter(requests_per_minute)
+        self._tasks = {}
+        self.stats = {"requests": 0, "retries": 0, "deduplicated": 0, "failed": 0}
+
+    async def generate(self, prompt):
+        """
+        Text for a prompt. Concurrent and repeated calls with the same prompt share one request.
+        """
+        key = prompt_key(prompt)
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(self._request(prompt))
+        else:
+            self.stats["deduplicated"] += 1
+        return await asyncio.shield(task)
+
+    async def _request(self, prompt):
+        for attempt in range(self.max_retries + 1):
+            async with self._semaphore:
+                await self._limiter.wait()
+                self.stats["requests"] += 1
+                try:
+                    return await self.complete(prompt)
+                except self.retry_on:
+                    if attempt == self.max_retries:
+                        self.stats["failed"] += 1
+                        raise
+            # Back off outside the semaphore so other prompts keep going
+            self.stats["retries"] += 1
+            await asyncio.sleep(self.backoff_s * 2 ** attempt * random.uniform(0.5, 1.0))
+
+
+def load_checkpoint(path):
+    """
+    Finished recommendations from an earlier run: {prediction id: record}.
+    """
+    done = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A run killed mid-write leaves a partial last line
+                    continue
+                done[record["prediction_id"]] = record
+    return done
+
+
+async def generate_all(patients, prompts, pool, checkpoint_path, done):
+    """
+    Recommendations for every patient not already in the checkpoint.
+
+    Parameters:
+    - patients: Patients still to generate (rows of select_patients).
+    - prompts: build_prompts output, aligned with patients.
+    - pool: LLMPool.
+    - checkpoint_path: JSONL file finished records are appended to.
+    - done: load_checkpoint(checkpoint_path); updated in place.
+
+    Returns:
+    - ({prediction id: record}, {prediction id: error message}, number generated in this run).
+    """
+    # Prompts answered in an earlier run are reused for identical prompts of other patients
+    answered = {record["prompt_key"]: record["recommendations"] for record in done.values()}
+    errors = {}
+    generated = 0
+
+    with open(checkpoint_path, "a") as checkpoint:
+        async def run_one(patient, prompt):
+            nonlocal generated
+            prediction_id = int(patient['id'])
+            key = prompt_key(prompt)
+            try:
+                text = answered[key] if key in answered else await pool.generate(prompt)
+            except Exception as e:
+                errors[prediction_id] = f"{type(e).__name__}: {e}"
+                return
+            record = {"prediction_id": prediction_id, "user_id": patient['user_id'], "prompt_key": key, "recommendations": text}
+            checkpoint.write(json.dumps(record) + "\n")
+            checkpoint.flush()
+            done[prediction_id] = record
+            generated += 1
+
+        await asyncio.gather(*[
+            run_one(patient, prompt) for (_, patient), prompt in zip(patients.iterrows(), prompts)
+        ])
+    return done, errors, generated
+
+
+def write_report(path, patients, done, errors, report_date, threshold, since):
+    """
+    Write the Markdown report, one section per patient, highest risk first.
+    """
+    lines = [
+        f"# Cohort report {report_date}",
+        "",
+        f"Patients whose latest prediction since {since or 'the first record'} has a diabetes risk of at least {threshold:.0%}: {len(patients)}.",
+        "",
+    ]
+    for _, patient in patients.iterrows():
+        prediction_id = int(patient['id'])
+        name = patient['name'] if pd.notna(patient['name']) else None
+        lines.append(f"## {name or patient['user_id']} ({patient['user_id']})")
+        lines.append(f"Risk {patient['Probability']:.1%} on {patient['date']}")
+        lines.append("")
+        if prediction_id in done:
+            lines.append(done[prediction_id]["recommendations"].strip())
+        else:
+            lines.append(f"_Not generated ({errors.get(prediction_id, 'not attempted')}); rerun the report to retry._")
+        lines.append("")
+    with open(path, "w") as f:
+        f.write("\n".join(lines))
+
+
+def run_report(router, bundle, explainer, complete, report_date=None, threshold=RISK_THRESHOLD, days=WINDOW_DAYS,
+               report_dir=REPORT_DIR, concurrency=CONCURRENCY, requests_per_minute=REQUESTS_PER_MINUTE,
+               max_retries=MAX_RETRIES, backoff_s=BACKOFF_S, retry_on=None):
+    """
+    Select, explain and generate recommendations for one report, resuming from its checkpoint.
+
+    Parameters:
+    - router: sharding.ShardRouter.
+    - bundle: The diabetes model_host bundle.
+    - explainer: Explainer used for the batch SHAP values.
+    - complete: Async completion function (see openai_completion).
+    - report_date: datetime.date of the report (default today); names the output files.
+    - days: Window length; None includes all history.
+    - Remaining parameters configure the LLMPool.
+
+    Returns:
+    - Dictionary with the report path, patient counts, pool statistics, elapsed
+      seconds and patients per minute.
+    """
+    report_date = report_date or date.today()
+    since = (report_date - timedelta(days=days - 1)).isoformat() if days else None
+    os.makedirs(report_dir, exist_ok=True)
+    report_path = os.path.join(report_dir, f"cohort_report_{report_date.isoformat()}.md")
+    checkpoint_path = report_path[:-3] + ".jsonl"
+
+    start = time.perf_counter()
+    patients = select_patients(router, threshold, since)
+    done = load_checkpoint(checkpoint_path)
+    # Patients finished in an earlier run need neither SHAP values nor a prompt
+    pending = patients[~patients['id'].isin(list(done))]
+    # Rows that can't be explained are listed in the report as not generated
+    skipped = unusable_patients(pending)
+    pending = pending[~pending['id'].isin(list(skipped))]
+    prompts = build_prompts(pending, bundle, explainer)
+
+    async def generate():
+        pool = LLMPool(complete, concurrency, requests_per_minute, max_retries, backoff_s, retry_on)
+        results = await generate_all(pending, prompts, pool, checkpoint_path, done)
+        return results, pool.stats
+
+    with span("cohort_report.generate"):
+        (done, errors, generated), stats = asyncio.run(generate())
+    errors.update(skipped)
+    write_report(report_path, patients, done, errors, report_date, threshold, since)
+    elapsed = time.perf_counter() - start
+    return dict(
+        stats,
+        report=report_path,
+        patients=len(patients),
+        generated=generated,
+        resumed=len(patients) - generated - len(errors),
+        errors=len(errors),
+        elapsed_s=elapsed,
+        patients_per_min=generated / elapsed * 60 if elapsed > 0 else 0.0,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the weekly cohort recommendations report")
+    parser.add_argument("--threshold", type=float, default=RISK_THRESHOLD, help="Minimum diabetes probability")
+    parser.add_argument("--days", type=int, default=WINDOW_DAYS, help="Report window (0 for all history)")
+    parser.add_argument("--date", type=date.fromisoformat, default=None, help="Report date, YYYY-MM-DD (default today)")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--rpm", type=int, default=REQUESTS_PER_MINUTE, help="LLM requests per minute")
+    parser.add_argument("--retries", type=int, default=MAX_RETRIES)
+    parser.add_argument("--base-url", default=None, help="OpenAI-compatible endpoint, e.g. the fake LLM server")
+    parser.add_argument("--model", default=None, help="Chat model name (default: ChatOpenAI's)")
+    parser.add_argument("--out", default=REPORT_DIR, help="Report directory")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    import explanations
+    import model_host
+    import sharding
+
+    load_dotenv()
+    api_key = os.getenv("OPENAI_API_KEY") or ("sk-fake" if args.base_url else None)
+    if not api_key:
+        parser.error("Set OPENAI_API_KEY (or .env), or pass --base-url for a local server")
+
+    bundle = model_host.get_host().get("diabetes")
+    summary = run_report(
+        sharding.get_router(), bundle, explanations.explainer_for(bundle),
+        openai_completion(api_key, args.base_url, args.model),
+        report_date=args.date, threshold=args.threshold, days=args.days or None, report_dir=args.out,
+        concurrency=args.concurrency, requests_per_minute=args.rpm, max_retries=args.retries,
+    )
+    print(f"{summary['report']}: {summary['patients']} patients, {summary['generated']} generated, "
+          f"{summary['resumed']} from checkpoint, {summary['errors']} failed")
+    print(f"{summary['requests']} requests ({summary['retries']} retries, {summary['deduplicated']} deduplicated) "
+          f"in {summary['elapsed_s']:.1f}s: {summary['patients_per_min']:.0f} patients/min")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+import sqlite3
+from datetime import date
+
+import pandas as pd
+
+import prediction_cache
+
+DB_PATH = 'user_predictions.db'
+
+# How long a writer waits for another session's transaction before giving up
+BUSY_TIMEOUT_S = 30
+
+# Model input features, in the order the scaler and model expect them
+FEATURE_NAMES = [
+    'HighBP', 'HighChol', 'CholCheck', 'BMI', 'Smoker', 'Stroke',
+    'HeartDiseaseorAttack', 'PhysActivity', 'Fruits', 'Veggies',
+    'HvyAlcoholConsump', 'AnyHealthcare', 'NoDocbcCost', 'GenHlth',
+    'MentHlth', 'PhysHlth', 'DiffWalk', 'Sex', 'Age', 'Education', 'Income'
+]
+
+PREDICTION_COLUMNS = ['user_id'] + FEATURE_NAMES + ['Prediction', 'Probability', 'date']
+
+# Older rows (e.g. from the notebook's test-data generator) store binary features as text
+TEXT_FEATURE_VALUES = {'Yes': 1, 'No': 0}
+
+
+def numeric_feature(column):
+    """
+    One feature column as floats: "Yes"/"No" text becomes 1/0 and any other
+    non-numeric value becomes NaN, so callers can skip those rows explicitly.
+    """
+    numeric = pd.to_numeric(column, errors='coerce')
+    if column.dtype == object:
+        numeric = numeric.fillna(column.map(TEXT_FEATURE_VALUES))
+    return numeric.astype(float)
+
+
+def numeric_features(frame):
+    """
+    The feature columns of a frame of prediction rows as numbers (see numeric_feature).
+    """
+    return pd.DataFrame({feature: numeric_feature(frame[feature]) for feature in FEATURE_NAMES}, index=frame.index)
+
+
+def connect(db_path=DB_PATH):
+    return sqlite3.connect(db_path)
+
+
+def create_user_tables(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT,
+        email TEXT UNIQUE,
+        unique_id TEXT UNIQUE,
+        clinic TEXT
+    )
+    """)
+    # Databases created before clinic-based sharding lack the clinic column
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(users)")]
+    if 'clinic' not in columns:
+        cursor.execute("ALTER TABLE users ADD COLUMN clinic TEXT")
+    # Last numeric suffix handed out per last name (unique IDs are "<lastname><n>")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS id_counters (
+        last_name TEXT PRIMARY KEY,
+        last_value INTEGER NOT NULL
+    )
+    """)
+
+
+def create_prediction_tables(cursor):
+    feature_columns = ",\n        ".join(
+        f"{feature} {'REAL' if feature == 'BMI' else 'INTEGER'}" for feature in FEATURE_NAMES
+    )
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS predictions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT,
+        {feature_columns},
+        Prediction TEXT,
+        Probability REAL,
+        date TEXT
+    )
+    """)
+    # Per-user history lookups (dashboard, same-day upserts, cohort summaries)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_predictions_user_date ON predictions (user_id, date)")
+
+
+def create_outcome_tables(cursor):
+    # Confirmed diagnoses, with the inputs of the prediction they label (a snapshot, so
+    # archiving or resharding predictions never orphans them). model_version is the model
+    # trained on the row, NULL until incremental_training.py uses it.
+    feature_columns = ",\n        ".join(
+        f"{feature} {'REAL' if feature == 'BMI' else 'INTEGER'}" for feature in FEATURE_NAMES
+    )
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS outcomes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT,
+        {feature_columns},
+        Diabetes_binary INTEGER,
+        diagnosed_on TEXT,
+        model_version TEXT
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_outcomes_model_version ON outcomes (model_version)")
+
+
+def init_db(db_path=DB_PATH):
+    """
+    Create the users, predictions and outcomes tables if they don't exist yet.
+    """
+    conn = connect(db_path)
+    cursor = conn.cursor()
+    create_user_tables(cursor)
+    create_prediction_tables(cursor)
+    create_outcome_tables(cursor)
+    conn.commit()
+    conn.close()
+
+
+def save_prediction(conn, user_id, user_input, prediction_result, diabetes_prob, prediction_date=None):
+    """
+    Insert or update the prediction for a user on a given date (one row per user per day).
+
+    Parameters:
+    - conn: Open SQLite connection.
+    - user_id: The user's unique ID.
+    - user_input: Dictionary of encoded feature values, keyed by FEATURE_NAMES.
+    - prediction_result: String ("Diabetes Present" or "No Diabetes Present").
+    - diabetes_prob: Float, probability of the positive class.
+    - prediction_date: 'YYYY-MM-DD' string, defaults to today.
+
+    Returns:
+    - The id of the inserted or updated predictions row.
+    """
+    if prediction_date is None:
+        prediction_date = date.today().strftime('%Y-%m-%d')  # Format as YYYY-MM-DD
+    cursor = conn.cursor()
+    values = [user_input[feature] for feature in FEATURE_NAMES]
+
+    # Check if an entry exists for this user and date
+    cursor.execute('''
+    SELECT id FROM predictions
+    WHERE user_id = ? AND date = ?
+    ''', (user_id, prediction_date))
+    existing_entry = cursor.fetchone()
+
+    if existing_entry:
+        # Update the existing entry
+        assignments = ", ".join(f"{feature} = ?" for feature in FEATURE_NAMES)
+        cursor.execute(f'''
+        UPDATE predictions
+        SET {assignments}, Prediction = ?, Probability = ?
+        WHERE id = ?
+        ''', values + [prediction_result, diabetes_prob, existing_entry[0]])
+        prediction_id = existing_entry[0]
+    else:
+        # Insert a new entry
+        placeholders = ", ".join("?" for _ in PREDICTION_COLUMNS)
+        cursor.execute(f'''
+        INSERT INTO predictions ({", ".join(PREDICTION_COLUMNS)})
+        VALUES ({placeholders})
+        ''', [user_id] + values + [prediction_result, diabetes_prob, prediction_date])
+        prediction_id = cursor.lastrowid
+
+    conn.commit()
+    return prediction_id
+
+
+def save_outcome(conn, user_id, user_input, diabetes, diagnosed_on=None):
+    """
+    Record a confirmed diagnosis (or a ruled-out one) for a user, for incremental training.
+
+    Parameters:
+    - conn: Open SQLite connection to the catalog database.
+    - user_id: The user's unique ID.
+    - user_input: Dictionary of encoded feature values the label applies to, keyed by FEATURE_NAMES.
+    - diabetes: 1 if diabetes was confirmed, 0 if it was ruled out.
+    - diagnosed_on: 'YYYY-MM-DD' string, defaults to today.
+
+    Returns:
+    - The id of the inserted outcomes row.
+    """
+    if diagnosed_on is None:
+        diagnosed_on = date.today().strftime('%Y-%m-%d')
+    columns = ['user_id'] + FEATURE_NAMES + ['Diabetes_binary', 'diagnosed_on']
+    cursor = conn.execute(f'''
+    INSERT INTO outcomes ({", ".join(columns)})
+    VALUES ({", ".join("?" for _ in columns)})
+    ''', [user_id] + [user_input[feature] for feature in FEATURE_NAMES] + [int(diabetes), diagnosed_on])
+    conn.commit()
+    return cursor.lastrowid
+
+
+# Hot cache of (unique_id, name) by catalog and email or unique ID. Only hits are
+# cached, so a user who signs up in another session is found on the next lookup.
+user_cache = prediction_cache.LRUCache(maxsize=10000)
+
+
+def _last_name(name):
+    return name.split()[-1].lower()
+
+
+def _highest_existing_suffix(cursor, last_name):
+    # Range scan on the unique_id index instead of LIKE, which can't use it
+    cursor.execute(
+        "SELECT unique_id FROM users WHERE unique_id >= ? AND unique_id < ?",
+        (last_name, last_name + "\uffff")
+    )
+    suffixes = [unique_id[len(last_name):] for (unique_id,) in cursor.fetchall()]
+    return max((int(suffix) for suffix in suffixes if suffix.isdigit()), default=0)
+
+
+def allocate_unique_id(cursor, name):
+    """
+    Allocate the next "<lastname><n>" ID from the per-surname counter.
+
+    Must run inside a write transaction (see create_user). The first allocation for
+    a last name seeds the counter from existing users; after that it's a primary-key
+    update plus a unique_id lookup.
+    """
+    last_name = _last_name(name)
+    cursor.execute("UPDATE id_counters SET last_value = last_value + 1 WHERE last_name = ?", (last_name,))
+    if cursor.rowcount == 0:
+        cursor.execute(
+            "INSERT INTO id_counters (last_name, last_value) VALUES (?, ?)",
+            (last_name, _highest_existing_suffix(cursor, last_name) + 1)
+        )
+    cursor.execute("SELECT last_value FROM id_counters WHERE last_name = ?", (last_name,))
+    value = cursor.fetchone()[0]
+    # Surnames can end in digits ("smith1" + 1 and "smith" + 11 are both "smith11"),
+    # so skip values whose ID another surname's counter already handed out
+    while cursor.execute("SELECT 1 FROM users WHERE unique_id = ?", (f"{last_name}{value}",)).fetchone():
+        value += 1
+    cursor.execute("UPDATE id_counters SET last_value = ? WHERE last_name = ?", (value, last_name))
+    return f"{last_name}{value}"
+
+
+def create_user(name, email, db_path=DB_PATH, clinic=None):
+    """
+    Allocate a unique ID and insert the user in one write transaction, so two
+    concurrent signups can never receive the same ID. The clinic (if any) decides
+    the user's prediction shard under clinic-based sharding.
+
+    Returns:
+    - The new user's unique ID, or the existing one if the email is already registered.
+    """
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_S, isolation_level=None)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute("SELECT unique_id FROM users WHERE email = ?", (email,))
+            existing = cursor.fetchone()
+            if existing:
+                unique_id = existing[0]
+            else:
+                unique_id = allocate_unique_id(cursor, name)
+                cursor.execute(
+                    "INSERT INTO users (name, email, unique_id, clinic) VALUES (?, ?, ?, ?)",
+                    (name, email, unique_id, clinic)
+                )
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    return unique_id
+
+
+def find_user(unique_id=None, email=None, db_path=DB_PATH):
+    """
+    Look up a user by unique ID or email with one indexed query (cached on hit).
+
+    Returns:
+    - (unique_id, name) or None.
+    """
+    # Keyed by database too, so a lookup in one catalog never returns another's user
+    key = (db_path, "id", unique_id) if unique_id else (db_path, "email", email)
+    user = user_cache.get(key)
+    if user is not None:
+        return user
+
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_S)
+    try:
+        column = "unique_id" if unique_id else "email"
+        row = conn.execute(f"SELECT unique_id, name FROM users WHERE {column} = ?", (key[2],)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    user = (row[0], row[1])
+    user_cache.put(key, user)
+    return user
+
+
+def fetch_users(conn):
+    query = '''
+    SELECT DISTINCT
+        predictions.user_id,
+        users.email,
+        predictions.Sex,
+        predictions.Age,
+        predictions.Education
+    FROM predictions
+    INNER JOIN users
+    ON users.unique_id = predictions.user_id
+    '''
+    return pd.read_sql_query(query, conn)
+
+
+def fetch_user_data(conn, user_id, start_date=None, end_date=None):
+    """
+    A user's predictions, newest first, optionally limited to an inclusive
+    'YYYY-MM-DD' date window (served by the (user_id, date) index).
+    """
+    query = '''
+    SELECT
+        predictions.*,
+        users.email,
+        users.name
+    FROM predictions
+    INNER JOIN users
+    ON users.unique_id = predictions.user_id
+    WHERE predictions.user_id = ? AND date >= ? AND date <= ?
+    ORDER BY date DESC
+    '''
+    return pd.read_sql_query(query, conn, params=(user_id, start_date or '', end_date or '9999-12-31'))
+
+
+def fetch_user_date_range(conn, user_id):
+    """
+    (first date, last date) of a user's predictions, or (None, None).
+    """
+    return conn.execute(
+        "SELECT MIN(date), MAX(date) FROM predictions WHERE user_id = ?", (user_id,)
+    ).fetchone()
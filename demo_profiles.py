@@ -0,0 +1,77 @@
+"""
+Example patient profiles offered on the predictions page (and used to warm up
+the model and explainer at server start).
+"""
+
+# Demo Templates
+DEMO_PROFILES = {
+    "Sample Profile 1: Older Male with High BMI and Unhealthy Lifestyle": {
+        'HighBP': 1,
+        'HighChol': 1,
+        'CholCheck': 0,
+        'BMI': 35,
+        'Smoker': 1,
+        'Stroke': 1,
+        'HeartDiseaseorAttack': 1,
+        'PhysActivity': 0,
+        'Fruits': 0,
+        'Veggies': 0,
+        'HvyAlcoholConsump': 1,
+        'AnyHealthcare': 0,
+        'NoDocbcCost': 1,
+        'GenHlth': 5,
+        'MentHlth': 20,
+        'PhysHlth': 25,
+        'DiffWalk': 1,
+        'Sex': 1,  # Male
+        'Age': 65,  # 80+
+        'Education': 3,  # Some high school
+        'Income': 2  # $10,000 - $15,000
+    },
+    "Sample Profile 2: Younger Male with High BMI and Unhealthy Lifestyle": {
+        'HighBP': 0,
+        'HighChol': 1,
+        'CholCheck': 1,
+        'BMI': 32,
+        'Smoker': 1,
+        'Stroke': 0,
+        'HeartDiseaseorAttack': 0,
+        'PhysActivity': 0,
+        'Fruits': 0,
+        'Veggies': 0,
+        'HvyAlcoholConsump': 1,
+        'AnyHealthcare': 1,
+        'NoDocbcCost': 0,
+        'GenHlth': 4,
+        'MentHlth': 15,
+        'PhysHlth': 10,
+        'DiffWalk': 0,
+        'Sex': 1,  # Male
+        'Age': 25,  # 25-29
+        'Education': 4,  # High school graduate
+        'Income': 5  # $25,000 - $35,000
+    },
+    "Sample Profile 3: Older Under Educated Female with Healthy Diet": {
+        'HighBP': 1,
+        'HighChol': 0,
+        'CholCheck': 1,
+        'BMI': 22,
+        'Smoker': 0,
+        'Stroke': 0,
+        'HeartDiseaseorAttack': 0,
+        'PhysActivity': 1,
+        'Fruits': 1,
+        'Veggies': 1,
+        'HvyAlcoholConsump': 0,
+        'AnyHealthcare': 1,
+        'NoDocbcCost': 0,
+        'GenHlth': 2,
+        'MentHlth': 2,
+        'PhysHlth': 3,
+        'DiffWalk': 0,
+        'Sex': 0,  # Female
+        'Age': 74,  # 70-74
+        'Education': 1,  # No formal education
+        'Income': 1  # < $10,000
+    }
+}
@@ -0,0 +1,112 @@
+"""
+Downsampling of per-user time series for the dashboard charts.
+
+A chart is about 800 pixels wide, so drawing more than a few hundred points only
+costs render time. Continuous series (risk, BMI, unhealthy days) are reduced with
+Largest-Triangle-Three-Buckets, which keeps the visually important peaks and
+dips; yes/no series use per-bucket min/max, which keeps every change of state
+that is visible at chart resolution.
+"""
+import numpy as np
+import pandas as pd
+
+from database import FEATURE_NAMES, numeric_feature
+
+# Points per chart: roughly one per two pixels of a 10-inch, 100 dpi figure's plot area
+CHART_POINTS = 400
+
+# Features drawn as yes/no step charts (every other integer feature is continuous enough for LTTB)
+BINARY_FEATURES = {
+    'HighBP', 'HighChol', 'CholCheck', 'Smoker', 'Stroke', 'HeartDiseaseorAttack',
+    'PhysActivity', 'Fruits', 'Veggies', 'HvyAlcoholConsump', 'AnyHealthcare',
+    'NoDocbcCost', 'DiffWalk',
+}
+
+
+def lttb(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+
+    Parameters:
+    - x: 1D array of increasing x values (e.g. numeric dates).
+    - y: 1D array of values.
+    - n_out: Number of points to keep (including the first and last).
+
+    Returns:
+    - Sorted indices of the points to keep.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    # n_out - 2 buckets between the fixed first and last points
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_start, next_end = edges[bucket + 1], edges[bucket + 2]
+            next_x, next_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        # Twice the area of the triangle (previous point, candidate, next bucket's average)
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return selected
+
+
+def min_max(y, n_out):
+    """
+    Keep the minimum and maximum of each of n_out / 2 equal-count buckets.
+
+    Returns:
+    - Sorted, unique indices of the points to keep (always including the first and last).
+    """
+    n = len(y)
+    if n_out >= n:
+        return np.arange(n)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(0, n, max(1, n_out // 2) + 1).astype(int)
+    keep = [0, n - 1]
+    for start, end in zip(edges[:-1], edges[1:]):
+        if end > start:
+            keep.append(start + int(np.argmin(y[start:end])))
+            keep.append(start + int(np.argmax(y[start:end])))
+    return np.unique(keep)
+
+
+def chart_series(history, feature, n_points=CHART_POINTS):
+    """
+    The rows of a user's history to draw for one feature, oldest first.
+
+    Parameters:
+    - history: DataFrame with a 'date' column and the feature's column (any order).
+    - feature: Column to chart. 'Prediction' charts are downsampled on 'Probability'.
+    - n_points: Target number of points.
+
+    Returns:
+    - DataFrame with at most about n_points rows, sorted by date, with the feature
+      as numbers (older rows store yes/no features as "Yes"/"No" text).
+    """
+    history = history.sort_values('date', ignore_index=True)
+    if feature in FEATURE_NAMES:
+        history[feature] = numeric_feature(history[feature])
+    if len(history) <= n_points:
+        return history
+    x = pd.to_datetime(history['date']).to_numpy(dtype='datetime64[D]').astype(np.int64)
+    if feature in ("Prediction", "Probability"):
+        # Risk is a continuous series; the colour (prediction) follows the kept rows
+        keep = lttb(x, history['Probability'].to_numpy(), n_points)
+    elif feature in BINARY_FEATURES:
+        keep = min_max(history[feature].to_numpy(), n_points)
+    else:
+        keep = lttb(x, history[feature].to_numpy(), n_points)
+    return history.iloc[keep].reset_index(drop=True)
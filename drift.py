@@ -0,0 +1,333 @@
+"""
+Input-drift monitor: compares the distribution of live prediction inputs with the
+CDC training data the model was fitted on.
+
+Each feature is summarised by a fixed-bin histogram. Reference histograms are
+computed once from the training split (models/drift_reference.json). Live
+histograms are kept per day, updated in place with one counter increment per
+feature per prediction, and only the last WINDOW_DAYS days are compared with the
+reference, so months of old traffic can't hide a recent shift. PSI and KS scores
+are computed from the two histograms on demand.
+
+Usage (rebuild the reference from data/cdc_diabetes_health_indicators.csv):
+    python drift.py build-reference
+    python drift.py report
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import threading
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from database import FEATURE_NAMES
+from tracing import register_collector
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_PATH = './models/drift_reference.json'
+TRAINING_CSV = './data/cdc_diabetes_health_indicators.csv'
+
+# Live counts survive restarts through this file, rewritten every FLUSH_EVERY updates
+STATE_PATH = os.getenv("HEALTHTRACK_DRIFT_STATE", "drift_live.json")
+FLUSH_EVERY = 50
+
+# Days of live inputs the scores cover (older daily histograms are dropped)
+WINDOW_DAYS = int(os.getenv("HEALTHTRACK_DRIFT_WINDOW_DAYS", "30"))
+
+# Scores are not reported until this many live inputs have been seen
+MIN_OBSERVATIONS = 50
+
+# PSI rule of thumb: < 0.1 stable, < 0.25 moderate shift, otherwise significant
+PSI_THRESHOLDS = (0.1, 0.25)
+
+# Value range of each integer-coded feature; every value gets its own bin
+INTEGER_RANGES = {feature: (0, 1) for feature in FEATURE_NAMES}
+INTEGER_RANGES.update({
+    'GenHlth': (1, 5), 'MentHlth': (0, 30), 'PhysHlth': (0, 30),
+    'Age': (1, 13), 'Education': (1, 6), 'Income': (1, 8),
+})
+del INTEGER_RANGES['BMI']
+
+# BMI is continuous: 2-unit bins from 12 to 98, out-of-range values go to the end bins
+BMI_RANGE = (12.0, 98.0)
+BMI_WIDTH = 2.0
+
+
+def _bin_layout():
+    """
+    (feature, first bin value, bin width, number of bins) in FEATURE_NAMES order.
+    """
+    layout = []
+    for feature in FEATURE_NAMES:
+        if feature == 'BMI':
+            layout.append((feature, BMI_RANGE[0], BMI_WIDTH, int((BMI_RANGE[1] - BMI_RANGE[0]) / BMI_WIDTH)))
+        else:
+            low, high = INTEGER_RANGES[feature]
+            layout.append((feature, low, 1, high - low + 1))
+    return layout
+
+
+BIN_LAYOUT = _bin_layout()
+
+
+def histograms(X):
+    """
+    Per-feature bin counts of a batch of rows.
+
+    Parameters:
+    - X: DataFrame with the FEATURE_NAMES columns.
+
+    Returns:
+    - {feature: list of counts}.
+    """
+    counts = {}
+    for feature, low, width, n_bins in BIN_LAYOUT:
+        bins = np.clip(np.floor((X[feature].to_numpy(dtype=float) - low) / width), 0, n_bins - 1).astype(int)
+        counts[feature] = np.bincount(bins, minlength=n_bins).tolist()
+    return counts
+
+
+def save_reference(X, path=REFERENCE_PATH):
+    """
+    Store the training-data histograms the live inputs are compared against.
+    Called from model_training.ipynb after the forest is fitted.
+    """
+    with open(path, "w") as f:
+        json.dump({"rows": len(X), "histograms": histograms(X)}, f)
+
+
+def load_reference(path=REFERENCE_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)["histograms"]
+
+
+def psi(expected, actual, epsilon=1e-4):
+    """
+    Population stability index between two histograms (counts over the same bins).
+    """
+    expected = np.maximum(np.asarray(expected, dtype=float) / max(sum(expected), 1), epsilon)
+    actual = np.maximum(np.asarray(actual, dtype=float) / max(sum(actual), 1), epsilon)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+def ks(expected, actual):
+    """
+    Kolmogorov-Smirnov statistic (largest CDF gap) between two binned distributions.
+    """
+    expected_cdf = np.cumsum(expected) / max(sum(expected), 1)
+    actual_cdf = np.cumsum(actual) / max(sum(actual), 1)
+    return float(np.max(np.abs(expected_cdf - actual_cdf)))
+
+
+def status(psi_value):
+    if psi_value < PSI_THRESHOLDS[0]:
+        return "Stable"
+    if psi_value < PSI_THRESHOLDS[1]:
+        return "Moderate shift"
+    return "Significant shift"
+
+
+def _empty_histograms():
+    return {feature: [0] * n_bins for feature, _, _, n_bins in BIN_LAYOUT}
+
+
+class DriftMonitor:
+    """
+    Live input histograms (one per day, over a rolling window) plus on-demand drift
+    scores against the reference.
+
+    Parameters:
+    - reference: {feature: counts} from load_reference(), or None if not built yet.
+    - state_path: JSON file the live counts are checkpointed to (None to keep them in memory only).
+    - flush_every: Number of updates between checkpoints.
+    - window_days: Number of days (today included) the scores cover.
+    """
+
+    def __init__(self, reference=None, state_path=None, flush_every=FLUSH_EVERY, window_days=WINDOW_DAYS):
+        self.reference = reference
+        self.state_path = state_path
+        self.flush_every = flush_every
+        self.window_days = window_days
+        # 'YYYY-MM-DD' -> {"observations": n, "histograms": {feature: counts}}
+        self.days = {}
+        self._unflushed = 0
+        self._lock = threading.Lock()
+        # Serializes checkpoint writes, so an older snapshot never replaces a newer one
+        self._flush_lock = threading.Lock()
+        if state_path and os.path.exists(state_path):
+            with open(state_path) as f:
+                state = json.load(f)
+            if "days" in state:
+                self.days = state["days"]
+            else:
+                # Older all-time counts: dated by the file, so they leave the window like any other day
+                day = datetime.fromtimestamp(os.path.getmtime(state_path)).date().isoformat()
+                self.days = {day: {"observations": state["observations"], "histograms": state["histograms"]}}
+            self._prune(date.today())
+
+    def _prune(self, today):
+        # Caller holds self._lock (or owns the monitor exclusively)
+        first_day = (today - timedelta(days=self.window_days - 1)).isoformat()
+        for day in [day for day in self.days if day < first_day]:
+            del self.days[day]
+
+    def update(self, user_input, today=None):
+        """
+        Count one prediction input: a single increment per feature, in today's histograms.
+
+        Parameters:
+        - user_input: Dictionary of encoded feature values, keyed by FEATURE_NAMES.
+        - today: datetime.date the input is counted on (default today; for tests and benchmarks).
+        """
+        today = today or date.today()
+        day = today.isoformat()
+        with self._lock:
+            bucket = self.days.get(day)
+            if bucket is None:
+                # First input of a new day: drop the days that left the window
+                bucket = self.days[day] = {"observations": 0, "histograms": _empty_histograms()}
+                self._prune(today)
+            live = bucket["histograms"]
+            for feature, low, width, n_bins in BIN_LAYOUT:
+                i = int((float(user_input[feature]) - low) // width)
+                live[feature][min(max(i, 0), n_bins - 1)] += 1
+            bucket["observations"] += 1
+            self._unflushed += 1
+            flush = self.state_path and self._unflushed >= self.flush_every
+        if flush:
+            # The prediction is already saved; a failed checkpoint only delays persisting the counts
+            try:
+                self.flush()
+            except OSError:
+                logger.exception("Could not write the drift state to %s", self.state_path)
+
+    def flush(self):
+        """
+        Checkpoint the daily histograms to state_path (via a unique temporary file in the same directory).
+        """
+        with self._flush_lock:
+            with self._lock:
+                state = {"days": {
+                    day: {"observations": bucket["observations"],
+                          "histograms": {feature: list(counts) for feature, counts in bucket["histograms"].items()}}
+                    for day, bucket in self.days.items()
+                }}
+                self._unflushed = 0
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(self.state_path)), prefix=os.path.basename(self.state_path) + ".", suffix=".tmp"
+            )
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(state, f)
+                os.replace(tmp_path, self.state_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+    def reset(self):
+        with self._lock:
+            self.days = {}
+        if self.state_path:
+            self.flush()
+
+    def window(self, today=None):
+        """
+        Live histograms summed over the days in the window.
+
+        Returns:
+        - (number of inputs, {feature: counts}).
+        """
+        first_day = ((today or date.today()) - timedelta(days=self.window_days - 1)).isoformat()
+        observations, live = 0, _empty_histograms()
+        with self._lock:
+            for day, bucket in self.days.items():
+                if day < first_day:
+                    continue
+                observations += bucket["observations"]
+                for feature, counts in bucket["histograms"].items():
+                    live[feature] = [total + count for total, count in zip(live[feature], counts)]
+        return observations, live
+
+    @property
+    def observations(self):
+        return self.window()[0]
+
+    def scores(self):
+        """
+        PSI and KS per feature, most drifted first.
+
+        Returns:
+        - DataFrame with Feature, PSI, KS and Status columns (empty if there is no
+          reference or fewer than MIN_OBSERVATIONS live inputs in the window).
+        """
+        observations, live = self.window()
+        if self.reference is None or observations < MIN_OBSERVATIONS:
+            return pd.DataFrame(columns=["Feature", "PSI", "KS", "Status"])
+        rows = []
+        for feature in FEATURE_NAMES:
+            psi_value = psi(self.reference[feature], live[feature])
+            rows.append((feature, psi_value, ks(self.reference[feature], live[feature]), status(psi_value)))
+        scores = pd.DataFrame(rows, columns=["Feature", "PSI", "KS", "Status"])
+        return scores.sort_values("PSI", ascending=False, ignore_index=True)
+
+
+def render_prometheus():
+    """
+    Drift gauges for the tracing /metrics endpoint.
+    """
+    lines = [
+        "# HELP healthtrack_input_drift_observations Live prediction inputs counted by the drift monitor.",
+        "# TYPE healthtrack_input_drift_observations gauge",
+        f"healthtrack_input_drift_observations {monitor.observations}",
+    ]
+    scores = monitor.scores()
+    if scores.empty:
+        return lines
+    for metric, column, description in (
+        ("healthtrack_input_drift_psi", "PSI", "Population stability index of live inputs vs the training data."),
+        ("healthtrack_input_drift_ks", "KS", "Kolmogorov-Smirnov statistic of live inputs vs the training data."),
+    ):
+        lines.append(f"# HELP {metric} {description}")
+        lines.append(f"# TYPE {metric} gauge")
+        lines += [f'{metric}{{feature="{feature}"}} {value:.6f}' for feature, value in zip(scores["Feature"], scores[column])]
+    return lines
+
+
+# Process-wide monitor shared by all sessions
+monitor = DriftMonitor(load_reference(), STATE_PATH)
+register_collector("drift", render_prometheus)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Input-drift monitor")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build-reference", help="Compute reference histograms from the training split")
+    build.add_argument("--data", default=TRAINING_CSV)
+    subparsers.add_parser("report", help="Print the current drift scores")
+    args = parser.parse_args()
+
+    if args.command == "build-reference":
+        from sklearn.model_selection import train_test_split
+        data = pd.read_csv(args.data)
+        # Same split as model_training.ipynb
+        X_train, _ = train_test_split(data[FEATURE_NAMES].fillna(data[FEATURE_NAMES].mean()), test_size=0.2, random_state=42)
+        save_reference(X_train)
+        print(f"Reference histograms for {len(X_train)} training rows saved to {REFERENCE_PATH}")
+    else:
+        scores = monitor.scores()
+        if scores.empty:
+            print(f"No scores yet ({monitor.observations} live inputs, reference {'found' if monitor.reference else 'missing'})")
+        else:
+            print(scores.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
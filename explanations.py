@@ -0,0 +1,374 @@
+"""
+Explanation modes for the diabetes model, trading exactness for speed.
+
+- exact: TreeSHAP over every tree of the forest (utils.explain_model's default).
+- sampled: TreeSHAP over a fixed random subset of the trees. A forest's SHAP values
+  are the mean of its trees' SHAP values, so this is an unbiased estimate.
+- surrogate: Precomputed per-feature linear fit of exact SHAP on the scaled input
+  (one multiply-add per feature).
+
+`python explanations.py calibrate` measures each fast mode against exact SHAP on
+held-out rows: rank agreement, top-feature overlap, sign agreement and absolute
+error. The results go to models/explanation_calibration.json, together with a
+per-feature error bound. At prediction time the "auto" mode uses the fastest
+mode that met the agreement threshold. A row falls back to exact SHAP when any
+of its top features has a contribution within that feature's error bound (so its
+sign or rank could be wrong).
+
+Usage (calibrate against the test split of data/cdc_diabetes_health_indicators.csv):
+    python explanations.py calibrate
+    python explanations.py report
+"""
+import argparse
+import copy
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import shap
+
+from database import FEATURE_NAMES
+from tracing import span
+
+CALIBRATION_PATH = './models/explanation_calibration.json'
+TRAINING_CSV = './data/cdc_diabetes_health_indicators.csv'
+
+MODES = ("exact", "sampled", "surrogate")
+
+# "auto" picks a calibrated fast mode (with per-row fallback); "exact" always runs full TreeSHAP
+EXPLAIN_MODE = os.getenv("HEALTHTRACK_EXPLAIN_MODE", "auto")
+
+# Trees kept by the sampled mode (of the forest's 100)
+SAMPLED_TREES = 20
+SAMPLE_SEED = 0
+
+# The recommendations prompt only uses the sign and rough order of the top contributions
+TOP_FEATURES = 5
+
+# A fast mode is used only if its top-feature overlap and sign agreement reach this on the validation rows
+MIN_AGREEMENT = 0.9
+
+# Per-feature error bound: this quantile of the absolute error on the validation rows
+ERROR_QUANTILE = 95
+
+
+class SampledTreeExplainer:
+    """
+    TreeSHAP over a fixed random subset of a forest's trees.
+
+    Parameters:
+    - model: Fitted forest with an estimators_ list.
+    - n_trees: Number of trees to keep.
+    - seed: Seed of the tree sample (stored in the calibration so results are reproducible).
+    """
+
+    def __init__(self, model, n_trees=SAMPLED_TREES, seed=SAMPLE_SEED):
+        rng = np.random.default_rng(seed)
+        self.tree_indices = np.sort(rng.choice(len(model.estimators_), min(n_trees, len(model.estimators_)), replace=False))
+        subset = copy.copy(model)
+        subset.estimators_ = [model.estimators_[i] for i in self.tree_indices]
+        subset.n_estimators = len(subset.estimators_)
+        self.explainer = shap.TreeExplainer(subset)
+
+    def shap_values(self, X_scaled):
+        return self.explainer.shap_values(X_scaled)
+
+
+class LinearSurrogate:
+    """
+    Per-feature linear approximation of SHAP values: phi_j = intercept_j + slope_j * x_j.
+
+    Parameters:
+    - intercepts, slopes: One value per feature (scaled-input units).
+    """
+
+    def __init__(self, intercepts, slopes):
+        self.intercepts = np.asarray(intercepts, dtype=float)
+        self.slopes = np.asarray(slopes, dtype=float)
+
+    @classmethod
+    def fit(cls, X_scaled, exact_values):
+        """
+        Least-squares fit of each feature's exact SHAP value on that feature alone.
+
+        Parameters:
+        - X_scaled: 2D array of scaled inputs.
+        - exact_values: Positive-class SHAP values for the same rows.
+        """
+        X_scaled = np.asarray(X_scaled, dtype=float)
+        x_mean, phi_mean = X_scaled.mean(axis=0), exact_values.mean(axis=0)
+        variance = ((X_scaled - x_mean) ** 2).sum(axis=0)
+        covariance = ((X_scaled - x_mean) * (exact_values - phi_mean)).sum(axis=0)
+        slopes = np.divide(covariance, variance, out=np.zeros_like(variance), where=variance > 0)
+        return cls(phi_mean - slopes * x_mean, slopes)
+
+    def shap_values(self, X_scaled):
+        phi = self.intercepts + self.slopes * np.asarray(X_scaled, dtype=float)
+        # Same (rows, features, classes) layout as TreeExplainer; class 0 mirrors class 1
+        return np.stack([-phi, phi], axis=-1)
+
+
+class AdaptiveExplainer:
+    """
+    A fast explainer whose uncertain rows are recomputed with exact TreeSHAP.
+
+    A row is uncertain when one of its TOP_FEATURES largest approximate contributions
+    is smaller in magnitude than that feature's calibrated error bound.
+
+    Parameters:
+    - fast: Explainer with shap_values(X_scaled), e.g. SampledTreeExplainer.
+    - exact: shap.TreeExplainer over the full model.
+    - error_bound: Per-feature absolute error bound of the fast explainer.
+    - mode: Name of the fast mode (for tracing).
+    """
+
+    def __init__(self, fast, exact, error_bound, mode):
+        self.fast = fast
+        self.exact = exact
+        self.error_bound = np.asarray(error_bound, dtype=float)
+        self.mode = mode
+        self.rows = 0
+        self.fallbacks = 0
+
+    def uncertain_rows(self, values):
+        top = np.argsort(-np.abs(values), axis=1)[:, :TOP_FEATURES]
+        return np.any(np.take_along_axis(np.abs(values), top, axis=1) <= self.error_bound[top], axis=1)
+
+    def shap_values(self, X_scaled):
+        with span(f"explanations.{self.mode}"):
+            values = np.array(self.fast.shap_values(X_scaled), dtype=float)
+        uncertain = self.uncertain_rows(values[..., 1])
+        self.rows += len(values)
+        if uncertain.any():
+            self.fallbacks += int(uncertain.sum())
+            with span("explanations.exact_fallback"):
+                values[uncertain] = np.asarray(self.exact.shap_values(np.asarray(X_scaled)[uncertain]))
+        return values
+
+
+def positive_class(shap_values):
+    # shap returns (rows, features, classes) for sklearn forests
+    shap_values = np.asarray(shap_values)
+    return shap_values[..., 1] if shap_values.ndim == 3 else shap_values
+
+
+def agreement(exact_values, approx_values, top_k=TOP_FEATURES):
+    """
+    How well approximate SHAP values reproduce exact ones, row by row.
+
+    Parameters:
+    - exact_values, approx_values: Positive-class SHAP values, shape (rows, features).
+    - top_k: Number of leading features compared for overlap and sign.
+
+    Returns:
+    - Dictionary with the mean and 10th-percentile Spearman rank correlation (of
+      |SHAP|), the mean top-k overlap, the sign agreement on the exact top-k
+      features, the mean absolute error and the per-feature error bound.
+    """
+    n_features = exact_values.shape[1]
+    exact_ranks = np.argsort(np.argsort(-np.abs(exact_values), axis=1), axis=1)
+    approx_ranks = np.argsort(np.argsort(-np.abs(approx_values), axis=1), axis=1)
+    spearman = 1 - 6 * ((exact_ranks - approx_ranks) ** 2).sum(axis=1) / (n_features * (n_features ** 2 - 1))
+
+    exact_top = np.argsort(-np.abs(exact_values), axis=1)[:, :top_k]
+    approx_top = np.argsort(-np.abs(approx_values), axis=1)[:, :top_k]
+    overlap = [len(set(e) & set(a)) / top_k for e, a in zip(exact_top, approx_top)]
+    signs = np.sign(np.take_along_axis(exact_values, exact_top, axis=1)) == np.sign(np.take_along_axis(approx_values, exact_top, axis=1))
+
+    errors = np.abs(exact_values - approx_values)
+    return {
+        "rank_agreement": float(spearman.mean()),
+        "rank_agreement_p10": float(np.percentile(spearman, 10)),
+        "top_k_overlap": float(np.mean(overlap)),
+        "sign_agreement": float(signs.mean()),
+        "mean_abs_error": float(errors.mean()),
+        "error_bound": np.percentile(errors, ERROR_QUANTILE, axis=0).tolist(),
+    }
+
+
+def _timed(explainer, X_scaled):
+    start = time.perf_counter()
+    values = positive_class(explainer.shap_values(X_scaled))
+    return values, (time.perf_counter() - start) * 1000 / len(X_scaled)
+
+
+def calibrate(model, X_fit_scaled, X_validation_scaled, model_version, path=CALIBRATION_PATH, n_trees=SAMPLED_TREES):
+    """
+    Fit the surrogate, measure every mode against exact SHAP and save the results.
+
+    Each fast mode is measured on its own and with the exact fallback. The error
+    bounds come from the first half of the validation rows and the fallback is
+    evaluated on the second half.
+
+    Parameters:
+    - model: The fitted forest.
+    - X_fit_scaled: Scaled rows the surrogate is fitted on (e.g. a training sample).
+    - X_validation_scaled: Held-out scaled rows the modes are evaluated on.
+    - model_version: prediction_cache.file_version of the model files; a calibration
+      for another version is ignored.
+
+    Returns:
+    - The calibration dictionary that was written.
+    """
+    X_validation_scaled = np.asarray(X_validation_scaled, dtype=float)
+    half = len(X_validation_scaled) // 2
+    exact = shap.TreeExplainer(model)
+    surrogate = LinearSurrogate.fit(X_fit_scaled, positive_class(exact.shap_values(X_fit_scaled)))
+    sampled = SampledTreeExplainer(model, n_trees)
+
+    exact_values, exact_ms = _timed(exact, X_validation_scaled)
+    modes = {"exact": dict(agreement(exact_values, exact_values), ms_per_row=exact_ms)}
+    for mode, fast in (("sampled", sampled), ("surrogate", surrogate)):
+        values, ms = _timed(fast, X_validation_scaled)
+        error_bound = agreement(exact_values[:half], values[:half])["error_bound"]
+        adaptive = AdaptiveExplainer(fast, exact, error_bound, mode)
+        adaptive_values, adaptive_ms = _timed(adaptive, X_validation_scaled[half:])
+        adaptive_metrics = agreement(exact_values[half:], adaptive_values)
+        del adaptive_metrics["error_bound"]
+        modes[mode] = dict(
+            agreement(exact_values, values), ms_per_row=ms, error_bound=error_bound,
+            with_fallback=dict(adaptive_metrics, ms_per_row=adaptive_ms, fallback_rate=adaptive.fallbacks / adaptive.rows),
+        )
+
+    calibration = {
+        "model_version": model_version,
+        "rows": len(X_validation_scaled),
+        "top_features": TOP_FEATURES,
+        "sampled": {"trees": n_trees, "seed": SAMPLE_SEED},
+        "surrogate": {"intercepts": surrogate.intercepts.tolist(), "slopes": surrogate.slopes.tolist()},
+        "modes": modes,
+    }
+    with open(path, "w") as f:
+        json.dump(calibration, f, indent=1)
+    return calibration
+
+
+def load_calibration(model_version, path=CALIBRATION_PATH):
+    """
+    The saved calibration, or None if there is none for this model version.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        calibration = json.load(f)
+    if calibration["model_version"] != model_version:
+        return None
+    return calibration
+
+
+def qualifies(metrics):
+    return metrics["top_k_overlap"] >= MIN_AGREEMENT and metrics["sign_agreement"] >= MIN_AGREEMENT
+
+
+def choose_mode(calibration):
+    """
+    The fast mode that, with its exact fallback, met MIN_AGREEMENT and was quickest
+    per row; "exact" if none did or there is no calibration.
+    """
+    if calibration is None:
+        return "exact"
+    exact_ms = calibration["modes"]["exact"]["ms_per_row"]
+    candidates = [
+        mode for mode in ("sampled", "surrogate")
+        if qualifies(calibration["modes"][mode]["with_fallback"])
+        and calibration["modes"][mode]["with_fallback"]["ms_per_row"] < exact_ms
+    ]
+    if not candidates:
+        return "exact"
+    return min(candidates, key=lambda mode: calibration["modes"][mode]["with_fallback"]["ms_per_row"])
+
+
+def build_explainer(model, exact, mode, calibration):
+    """
+    Explainer for one mode. Fast modes are wrapped in an AdaptiveExplainer when
+    their error bounds are known.
+
+    Parameters:
+    - model: The fitted forest.
+    - exact: Shared shap.TreeExplainer for the model.
+    - mode: "exact", "sampled", "surrogate" or "auto".
+    - calibration: Result of load_calibration (None if not calibrated).
+    """
+    if mode == "auto":
+        mode = choose_mode(calibration)
+    if mode == "exact":
+        return exact
+    if mode == "surrogate":
+        if calibration is None:
+            raise ValueError("The surrogate mode needs a calibration; run python explanations.py calibrate")
+        fast = LinearSurrogate(calibration["surrogate"]["intercepts"], calibration["surrogate"]["slopes"])
+    elif mode == "sampled":
+        settings = calibration["sampled"] if calibration else {"trees": SAMPLED_TREES, "seed": SAMPLE_SEED}
+        fast = SampledTreeExplainer(model, settings["trees"], settings["seed"])
+    else:
+        raise ValueError(f"Unknown explanation mode {mode!r}; expected one of {MODES + ('auto',)}")
+    if calibration is None:
+        return fast
+    return AdaptiveExplainer(fast, exact, calibration["modes"][mode]["error_bound"], mode)
+
+
+_explainers = {}
+_explainers_lock = threading.Lock()
+
+
+def explainer_for(bundle, mode=EXPLAIN_MODE):
+    """
+    Process-wide explainer for a model_host bundle in the given mode, built on first use.
+    """
+    key = (bundle.name, bundle.version, mode)
+    if key not in _explainers:
+        with _explainers_lock:
+            if key not in _explainers:
+                # Explainers of the model's earlier versions are no longer served
+                for stale in [stale for stale in _explainers if stale[0] == bundle.name and stale[1] != bundle.version]:
+                    del _explainers[stale]
+                calibration = load_calibration(bundle.version)
+                _explainers[key] = build_explainer(bundle.model, bundle.explainer, mode, calibration)
+    return _explainers[key]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Explanation modes")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    calibrate_parser = subparsers.add_parser("calibrate", help="Measure the fast modes against exact SHAP")
+    calibrate_parser.add_argument("--data", default=TRAINING_CSV)
+    calibrate_parser.add_argument("--rows", type=int, default=2000, help="Validation rows (and surrogate fitting rows)")
+    calibrate_parser.add_argument("--trees", type=int, default=SAMPLED_TREES)
+    subparsers.add_parser("report", help="Print the saved calibration")
+    args = parser.parse_args()
+
+    import model_host
+    bundle = model_host.get_host().get("diabetes")
+
+    if args.command == "calibrate":
+        import pandas as pd
+        from sklearn.model_selection import train_test_split
+        data = pd.read_csv(args.data)
+        # Same split as model_training.ipynb; the surrogate is fitted on training rows only
+        X_train, X_test = train_test_split(data[FEATURE_NAMES].fillna(data[FEATURE_NAMES].mean()), test_size=0.2, random_state=42)
+        X_fit = bundle.transform(X_train.sample(min(args.rows, len(X_train)), random_state=0))
+        X_validation = bundle.transform(X_test.sample(min(args.rows, len(X_test)), random_state=0))
+        calibration = calibrate(bundle.model, X_fit, X_validation, bundle.version, n_trees=args.trees)
+        print(f"Calibrated on {calibration['rows']} validation rows; saved to {CALIBRATION_PATH}")
+    else:
+        calibration = load_calibration(bundle.version)
+        if calibration is None:
+            print("No calibration for the current model; run python explanations.py calibrate")
+            return
+
+    print(f"{'mode':<26} {'ms/row':>7} {'spearman':>9} {'p10':>6} {'top-' + str(TOP_FEATURES):>6} {'sign':>6} {'MAE':>7} {'fallback':>9}")
+    for mode, metrics in calibration["modes"].items():
+        rows = [(mode, metrics)]
+        if "with_fallback" in metrics:
+            rows.append((f"{mode} + exact fallback", metrics["with_fallback"]))
+        for name, row in rows:
+            fallback = f"{row['fallback_rate']:.1%}" if "fallback_rate" in row else ""
+            print(f"{name:<26} {row['ms_per_row']:>7.2f} {row['rank_agreement']:>9.3f} {row['rank_agreement_p10']:>6.3f} "
+                  f"{row['top_k_overlap']:>6.3f} {row['sign_agreement']:>6.3f} {row['mean_abs_error']:>7.4f} {fallback:>9}")
+    print(f"auto mode uses: {choose_mode(calibration)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,509 @@
+"""
+Incremental updates of the diabetes model from confirmed outcomes.
+
+Clinicians record confirmed diagnoses (or ruled-out ones) in the outcomes table;
+each row keeps the inputs of the patient's latest prediction before the
+diagnosis. An update trains on the outcomes no model has used yet, instead of
+re-reading the CDC CSV, rerunning ADASYN and refitting every tree:
+
+- Random forests grow TREES_PER_UPDATE extra trees (warm_start); gradient
+  boosting and XGBoost models continue boosting for as many rounds.
+- The new trees see the new outcomes plus an equal-sized replay sample of the
+  original training rows, so both classes and the general population stay
+  represented. Both samples are stored once in models/holdout.npz.
+- The candidate is scored on a fixed holdout (a sample of the notebook's test
+  split, also in models/holdout.npz). It is published only if its ROC AUC and
+  recall are within MAX_DROP of the current model's.
+
+Publishing writes the model atomically over models/random_forest_diabetes_model.pkl,
+keeps a copy under models/versions/ (for rollback) and appends the metrics to
+models/model_versions.jsonl. Running servers pick it up through
+model_host.get_host(). Outcomes used by a published version are marked with its
+version. A rejected update leaves them pending for the next attempt.
+
+The cost of an update grows with the number of new outcomes (plus a fixed
+holdout evaluation), not with the size of the original training set.
+
+Usage:
+    python incremental_training.py init-holdout
+    python incremental_training.py record --user smith1 --diabetes 1 --date 2024-05-02
+    python incremental_training.py import outcomes.csv
+    python incremental_training.py update
+    python incremental_training.py history
+    python incremental_training.py rollback <version>
+"""
+import argparse
+import copy
+import json
+import os
+import shutil
+import time
+import warnings
+
+import joblib
+import numpy as np
+import pandas as pd
+
+import archive
+import explanations
+import prediction_cache
+import sharding
+from database import FEATURE_NAMES, numeric_features, save_outcome
+from model_host import DIABETES_MODEL_PATH, DIABETES_SCALER_PATH
+from tracing import span
+
+TRAINING_CSV = './data/cdc_diabetes_health_indicators.csv'
+HOLDOUT_PATH = './models/holdout.npz'
+VERSIONS_DIR = './models/versions'
+VERSION_LOG = './models/model_versions.jsonl'
+
+# Rows of the notebook's test split kept as the fixed holdout, and of its training
+# split kept for replay
+HOLDOUT_ROWS = 20000
+REPLAY_ROWS = 20000
+
+# Trees (or boosting rounds) added per update, and replayed training rows per new outcome
+TREES_PER_UPDATE = 10
+REPLAY_RATIO = 1.0
+
+# Fewest new outcomes worth an update
+MIN_NEW_ROWS = 50
+
+# Largest drop in holdout ROC AUC or recall a published version may have
+MAX_DROP = 0.005
+
+# Beyond this many trees, prediction and SHAP get slow; retrain from scratch instead
+MAX_TREES = 300
+
+# Published versions kept under models/versions/
+KEEP_VERSIONS = 5
+
+
+def build_holdout(data_path=TRAINING_CSV, path=HOLDOUT_PATH, holdout_rows=HOLDOUT_ROWS, replay_rows=REPLAY_ROWS):
+    """
+    Save the fixed holdout and the replay sample (raw features and labels) from the training CSV.
+
+    Uses the same mean imputation and 80/20 split as model_training.ipynb, so the
+    holdout rows were never seen by the deployed model. This reads the whole CSV,
+    once; updates only read the saved sample.
+
+    Returns:
+    - Number of holdout rows and replay rows saved.
+    """
+    from sklearn.model_selection import train_test_split
+
+    data = pd.read_csv(data_path)
+    X = data[FEATURE_NAMES].fillna(data[FEATURE_NAMES].mean())
+    X_train, X_test, y_train, y_test = train_test_split(X, data['Diabetes_binary'], test_size=0.2, random_state=42)
+    holdout = X_test.sample(min(holdout_rows, len(X_test)), random_state=0)
+    replay = X_train.sample(min(replay_rows, len(X_train)), random_state=0)
+    np.savez(
+        path,
+        X_holdout=holdout.to_numpy(dtype=np.float32), y_holdout=y_test.loc[holdout.index].to_numpy(dtype=np.int8),
+        X_replay=replay.to_numpy(dtype=np.float32), y_replay=y_train.loc[replay.index].to_numpy(dtype=np.int8),
+    )
+    return len(holdout), len(replay)
+
+
+def load_holdout(path=HOLDOUT_PATH):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found; run python incremental_training.py init-holdout")
+    with np.load(path) as arrays:
+        return {name: arrays[name] for name in arrays.files}
+
+
+def record_outcome(user_id, diabetes, diagnosed_on=None, router=None):
+    """
+    Label a user's latest prediction on or before the diagnosis date.
+
+    Parameters:
+    - user_id: The user's unique ID.
+    - diabetes: 1 if diabetes was confirmed, 0 if it was ruled out.
+    - diagnosed_on: 'YYYY-MM-DD' string, defaults to today.
+
+    Returns:
+    - The id of the outcomes row.
+
+    Raises:
+    - ValueError if the user has no prediction on or before that date, or its
+      features aren't numeric (legacy "Yes"/"No" text is converted to 1/0).
+    """
+    router = router or sharding.get_router()
+    conn = router.connect_for_user(user_id)
+    try:
+        history = archive.fetch_user_history(conn, user_id, end_date=diagnosed_on)
+    finally:
+        conn.close()
+    if history.empty:
+        raise ValueError(f"{user_id} has no prediction on or before {diagnosed_on or 'today'}")
+    features = numeric_features(history.iloc[[0]]).iloc[0]
+    if features.isna().any():
+        raise ValueError(
+            f"{user_id}'s latest prediction has non-numeric {', '.join(features.index[features.isna()])}"
+        )
+    # tolist() gives plain Python numbers (sqlite3 would store numpy integers as blobs)
+    latest = dict(zip(FEATURE_NAMES, features.tolist()))
+    conn = router.connect_catalog()
+    try:
+        return save_outcome(conn, user_id, latest, diabetes, diagnosed_on)
+    finally:
+        conn.close()
+
+
+def pending_outcomes(conn):
+    """
+    Outcomes no published model was trained on yet. Rows recorded with "Yes"/"No"
+    text are read as 1/0; rows with other non-numeric values are left out, so they
+    can't block every later update.
+
+    Returns:
+    - (ids, raw feature matrix, labels).
+    """
+    rows = pd.read_sql_query(
+        f"SELECT id, {', '.join(FEATURE_NAMES)}, Diabetes_binary FROM outcomes WHERE model_version IS NULL ORDER BY id",
+        conn
+    )
+    features = numeric_features(rows)
+    valid = features.notna().all(axis=1) & rows['Diabetes_binary'].notna()
+    return (rows['id'][valid].to_numpy(dtype=int), features[valid].to_numpy(dtype=float),
+            rows['Diabetes_binary'][valid].to_numpy(dtype=int))
+
+
+def mark_trained(conn, ids, model_version, chunk_size=900):
+    for start in range(0, len(ids), chunk_size):
+        chunk = [int(outcome_id) for outcome_id in ids[start:start + chunk_size]]
+        conn.execute(
+            f"UPDATE outcomes SET model_version = ? WHERE id IN ({', '.join('?' for _ in chunk)})",
+            [model_version] + chunk
+        )
+    conn.commit()
+
+
+def scale(scaler, X):
+    # The notebook fits the scaler on a DataFrame; pass one back so scikit-learn doesn't warn about feature names
+    if hasattr(scaler, "feature_names_in_"):
+        X = pd.DataFrame(X, columns=scaler.feature_names_in_)
+    return scaler.transform(X)
+
+
+def tree_count(model):
+    if hasattr(model, "get_booster"):
+        return model.get_booster().num_boosted_rounds()
+    return len(model.estimators_)
+
+
+def supports_incremental(model):
+    """
+    True for XGBoost models and fitted scikit-learn ensembles with warm_start
+    (random forests, extra trees, gradient boosting).
+    """
+    return hasattr(model, "get_booster") or (hasattr(model, "estimators_") and "warm_start" in model.get_params())
+
+
+def extend_model(model, X_scaled, y, trees=TREES_PER_UPDATE):
+    """
+    Copy of the model with extra trees (or boosting rounds) fitted on the given rows.
+    The model itself is left untouched.
+    """
+    candidate = copy.deepcopy(model)
+    if hasattr(candidate, "get_booster"):
+        # XGBoost: boost for `trees` more rounds, starting from the current booster
+        candidate.set_params(n_estimators=trees)
+        candidate.fit(X_scaled, y, xgb_model=candidate.get_booster())
+        return candidate
+    candidate.set_params(warm_start=True, n_estimators=len(candidate.estimators_) + trees)
+    with warnings.catch_warnings():
+        # The "balanced" class weights of the new trees come from the rows they are fitted on, as intended
+        warnings.filterwarnings("ignore", message="class_weight presets")
+        candidate.fit(X_scaled, y)
+    candidate.set_params(warm_start=False)
+    return candidate
+
+
+def evaluate(model, X_scaled, y):
+    """
+    Holdout ROC AUC, recall, precision and accuracy (positive class: diabetes).
+    """
+    from sklearn.metrics import accuracy_score, precision_score, recall_score, roc_auc_score
+
+    probabilities = model.predict_proba(X_scaled)[:, 1]
+    predicted = (probabilities >= 0.5).astype(int)
+    return {
+        "roc_auc": round(float(roc_auc_score(y, probabilities)), 5),
+        "recall": round(float(recall_score(y, predicted, zero_division=0)), 5),
+        "precision": round(float(precision_score(y, predicted, zero_division=0)), 5),
+        "accuracy": round(float(accuracy_score(y, predicted)), 5),
+    }
+
+
+def quality_regressions(current, candidate, max_drop=MAX_DROP):
+    """
+    The gated metrics (ROC AUC, recall) on which the candidate is worse than the current model by more than max_drop.
+    """
+    return [
+        f"{metric} {current[metric]:.4f} -> {candidate[metric]:.4f}"
+        for metric in ("roc_auc", "recall") if candidate[metric] < current[metric] - max_drop
+    ]
+
+
+def read_versions(path=VERSION_LOG):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_version(entry, path=VERSION_LOG):
+    with open(path, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+
+
+def version_path(version, versions_dir=VERSIONS_DIR):
+    return os.path.join(versions_dir, f"diabetes_{version}.pkl")
+
+
+def publish(model, model_path=DIABETES_MODEL_PATH, scaler_path=DIABETES_SCALER_PATH, versions_dir=VERSIONS_DIR):
+    """
+    Replace the live model file with model (atomically) and keep a copy of both the
+    previous and the new version under versions_dir.
+
+    Returns:
+    - The new model version (prediction_cache.file_version of the model files).
+    """
+    os.makedirs(versions_dir, exist_ok=True)
+    previous = version_path(prediction_cache.file_version(model_path, scaler_path), versions_dir)
+    if not os.path.exists(previous):
+        shutil.copyfile(model_path, previous)
+
+    tmp_path = model_path + ".tmp"
+    joblib.dump(model, tmp_path)
+    version = prediction_cache.file_version(tmp_path, scaler_path)
+    shutil.copyfile(tmp_path, version_path(version, versions_dir))
+    os.replace(tmp_path, model_path)
+    return version
+
+
+def prune_versions(keep=KEEP_VERSIONS, model_path=DIABETES_MODEL_PATH, scaler_path=DIABETES_SCALER_PATH,
+                   versions_dir=VERSIONS_DIR):
+    """
+    Delete all but the newest `keep` saved versions (the live one is always kept).
+    """
+    live = version_path(prediction_cache.file_version(model_path, scaler_path), versions_dir)
+    paths = sorted(
+        (os.path.join(versions_dir, name) for name in os.listdir(versions_dir) if name.endswith(".pkl")),
+        key=os.path.getmtime, reverse=True
+    )
+    for path in paths[keep:]:
+        if os.path.abspath(path) != os.path.abspath(live):
+            os.remove(path)
+
+
+def update(router=None, trees=TREES_PER_UPDATE, replay_ratio=REPLAY_RATIO, min_rows=MIN_NEW_ROWS,
+           max_drop=MAX_DROP, dry_run=False, calibrate_rows=0, model_path=DIABETES_MODEL_PATH, scaler_path=DIABETES_SCALER_PATH,
+           holdout_path=HOLDOUT_PATH, versions_dir=VERSIONS_DIR, log_path=VERSION_LOG):
+    """
+    Train on the pending outcomes and publish a new model version if quality holds.
+
+    Parameters:
+    - router: Shard router whose catalog holds the outcomes (default: sharding.get_router()).
+    - trees: Trees (or boosting rounds) to add.
+    - replay_ratio: Replayed training rows per new outcome.
+    - min_rows: Fewest pending outcomes worth an update.
+    - max_drop: Largest allowed drop in holdout ROC AUC or recall.
+    - dry_run: Train and evaluate, but publish nothing.
+    - calibrate_rows: If above 0 and the current version has an explanation calibration,
+      calibrate the new version on this many replay and holdout rows (explanations.py),
+      so it keeps the fast explanation mode. Costs exact SHAP for 2 x calibrate_rows rows.
+
+    Returns:
+    - Summary dict: status ("published", "rejected", "skipped" or "dry run"), row
+      counts, trees, holdout metrics of both models, new version and step timings.
+    """
+    router = router or sharding.get_router()
+    timings = {}
+    started = time.perf_counter()
+
+    conn = router.connect_catalog()
+    try:
+        ids, X_new, y_new = pending_outcomes(conn)
+    finally:
+        conn.close()
+    timings["load_outcomes_s"] = time.perf_counter() - started
+    summary = {"new_rows": len(ids), "positives": int(y_new.sum()), "timings": timings}
+    if len(ids) == 0 or len(ids) < min_rows:
+        return dict(summary, status="skipped", reason=f"{len(ids)} pending outcomes, fewer than {max(min_rows, 1)}")
+
+    model = joblib.load(model_path)
+    scaler = joblib.load(scaler_path)
+    version = prediction_cache.file_version(model_path, scaler_path)
+    if not supports_incremental(model):
+        return dict(summary, status="skipped", reason=f"{type(model).__name__} can't be updated incrementally")
+    if tree_count(model) + trees > MAX_TREES:
+        return dict(summary, status="skipped",
+                    reason=f"the model would exceed {MAX_TREES} trees; retrain from scratch in model_training.ipynb")
+
+    step = time.perf_counter()
+    holdout = load_holdout(holdout_path)
+    holdout_version = prediction_cache.file_version(holdout_path)
+    rng = np.random.default_rng(int(ids[0]))
+    n_replay = min(len(holdout["y_replay"]), int(round(replay_ratio * len(ids))))
+    replay = rng.choice(len(holdout["y_replay"]), size=n_replay, replace=False)
+    X_fit = scale(scaler, np.vstack([X_new, holdout["X_replay"][replay]]))
+    y_fit = np.concatenate([y_new, holdout["y_replay"][replay]])
+    timings["prepare_s"] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    with span("incremental_training.fit"):
+        candidate = extend_model(model, X_fit, y_fit, trees)
+    timings["fit_s"] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    X_holdout = scale(scaler, holdout["X_holdout"])
+    # The current model's holdout metrics are logged when it is published; reuse them
+    current_metrics = next(
+        (entry["metrics"] for entry in reversed(read_versions(log_path))
+         if entry["version"] == version and entry.get("holdout") == holdout_version and entry["published"]),
+        None
+    ) or evaluate(model, X_holdout, holdout["y_holdout"])
+    candidate_metrics = evaluate(candidate, X_holdout, holdout["y_holdout"])
+    timings["evaluate_s"] = time.perf_counter() - step
+
+    regressions = quality_regressions(current_metrics, candidate_metrics, max_drop)
+    summary.update(
+        replay_rows=n_replay, parent=version, trees=tree_count(candidate),
+        current_metrics=current_metrics, metrics=candidate_metrics, regressions=regressions,
+    )
+    if dry_run:
+        timings["total_s"] = time.perf_counter() - started
+        return dict(summary, status="dry run")
+
+    entry = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "parent": version, "new_rows": len(ids),
+        "replay_rows": n_replay, "trees": tree_count(candidate), "holdout": holdout_version,
+        "metrics": candidate_metrics, "parent_metrics": current_metrics,
+    }
+    if regressions:
+        append_version(dict(entry, version=None, published=False, regressions=regressions), log_path)
+        timings["total_s"] = time.perf_counter() - started
+        return dict(summary, status="rejected")
+
+    step = time.perf_counter()
+    new_version = publish(candidate, model_path, scaler_path, versions_dir)
+    # If this is interrupted before the outcomes are marked, the next update trains on them again
+    conn = router.connect_catalog()
+    try:
+        mark_trained(conn, ids, new_version)
+    finally:
+        conn.close()
+    append_version(dict(entry, version=new_version, published=True), log_path)
+    prune_versions(KEEP_VERSIONS, model_path, scaler_path, versions_dir)
+    timings["publish_s"] = time.perf_counter() - step
+
+    # Without a calibration for the new version, explanations use exact SHAP
+    calibration = explanations.load_calibration(version)
+    if calibration is not None and calibrate_rows > 0:
+        step = time.perf_counter()
+        explanations.calibrate(
+            candidate, scale(scaler, holdout["X_replay"][:calibrate_rows]), X_holdout[:calibrate_rows], new_version,
+            n_trees=calibration["sampled"]["trees"]
+        )
+        timings["calibrate_s"] = time.perf_counter() - step
+    elif calibration is not None:
+        summary["reason"] = "the new version explains with exact SHAP until python explanations.py calibrate is rerun"
+    timings["total_s"] = time.perf_counter() - started
+    return dict(summary, status="published", version=new_version)
+
+
+def rollback(version, model_path=DIABETES_MODEL_PATH, versions_dir=VERSIONS_DIR, log_path=VERSION_LOG):
+    """
+    Make a saved version live again. Outcomes stay marked with the version they
+    were trained into.
+    """
+    path = version_path(version, versions_dir)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No saved model version {version} in {versions_dir}")
+    tmp_path = model_path + ".tmp"
+    shutil.copyfile(path, tmp_path)
+    os.replace(tmp_path, model_path)
+    append_version({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "version": version, "published": True, "rollback": True}, log_path)
+
+
+def print_summary(summary):
+    print(f"{summary['status']}: {summary['new_rows']} new outcomes ({summary['positives']} positive)")
+    if summary.get("reason"):
+        print(f"  {summary['reason']}")
+    if "metrics" in summary:
+        print(f"  {summary['replay_rows']} replayed training rows, {summary['trees']} trees")
+        for metric in summary["metrics"]:
+            print(f"  {metric:<10}{summary['current_metrics'][metric]:.4f} -> {summary['metrics'][metric]:.4f}")
+    for regression in summary.get("regressions", []):
+        print(f"  regression: {regression}")
+    if summary.get("version"):
+        print(f"  published version {summary['version']} (parent {summary['parent']})")
+    print("  " + ", ".join(f"{name} {seconds:.2f}" for name, seconds in summary["timings"].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental model updates from confirmed outcomes")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    holdout_parser = subparsers.add_parser("init-holdout", help="Save the fixed holdout and replay sample from the training CSV")
+    holdout_parser.add_argument("--data", default=TRAINING_CSV)
+    record_parser = subparsers.add_parser("record", help="Record one confirmed outcome")
+    record_parser.add_argument("--user", required=True, help="The patient's unique ID")
+    record_parser.add_argument("--diabetes", type=int, choices=[0, 1], required=True)
+    record_parser.add_argument("--date", default=None, help="Diagnosis date, YYYY-MM-DD (default: today)")
+    import_parser = subparsers.add_parser("import", help="Record outcomes from a CSV with user_id, diabetes and diagnosed_on columns")
+    import_parser.add_argument("csv")
+    update_parser = subparsers.add_parser("update", help="Train on pending outcomes and publish if quality holds")
+    update_parser.add_argument("--trees", type=int, default=TREES_PER_UPDATE)
+    update_parser.add_argument("--replay-ratio", type=float, default=REPLAY_RATIO)
+    update_parser.add_argument("--min-rows", type=int, default=MIN_NEW_ROWS)
+    update_parser.add_argument("--max-drop", type=float, default=MAX_DROP)
+    update_parser.add_argument("--dry-run", action="store_true")
+    update_parser.add_argument("--calibrate-rows", type=int, default=0,
+                               help="Recalibrate the fast explanation mode for the new version on this many rows")
+    subparsers.add_parser("history", help="List published and rejected versions")
+    rollback_parser = subparsers.add_parser("rollback", help="Make a saved version live again")
+    rollback_parser.add_argument("version")
+    args = parser.parse_args()
+
+    if args.command == "init-holdout":
+        holdout_rows, replay_rows = build_holdout(args.data)
+        print(f"Saved {holdout_rows} holdout rows and {replay_rows} replay rows to {HOLDOUT_PATH}")
+    elif args.command == "record":
+        try:
+            outcome_id = record_outcome(args.user, args.diabetes, args.date)
+        except ValueError as e:
+            parser.exit(1, f"{e}\n")
+        print(f"Recorded outcome {outcome_id}")
+    elif args.command == "import":
+        outcomes = pd.read_csv(args.csv)
+        recorded, failed = 0, 0
+        for row in outcomes.itertuples(index=False):
+            diagnosed_on = getattr(row, "diagnosed_on", None)
+            try:
+                record_outcome(row.user_id, int(row.diabetes), None if pd.isna(diagnosed_on) else diagnosed_on)
+                recorded += 1
+            except ValueError as e:
+                print(e)
+                failed += 1
+        print(f"Recorded {recorded} outcomes ({failed} without a usable prediction)")
+    elif args.command == "update":
+        print_summary(update(trees=args.trees, replay_ratio=args.replay_ratio, min_rows=args.min_rows,
+                             max_drop=args.max_drop, dry_run=args.dry_run, calibrate_rows=args.calibrate_rows))
+    elif args.command == "history":
+        for entry in read_versions():
+            if entry.get("rollback"):
+                print(f"{entry['created']}  {entry['version']}  rollback")
+                continue
+            metrics = entry["metrics"]
+            print(f"{entry['created']}  {entry['version'] or 'rejected':<12}  parent {entry['parent']}  "
+                  f"{entry['new_rows']} rows  {entry['trees']} trees  "
+                  f"AUC {metrics['roc_auc']:.4f}  recall {metrics['recall']:.4f}")
+    else:
+        rollback(args.version)
+        print(f"Version {args.version} is live again")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,10 @@
 import streamlit as st
-import sqlite3
+
+import database
+import session_memory
+import sharding
+import warmup
+from tracing import traced, start_metrics_server
 
 st.set_page_config(page_title="Login", page_icon="🔑")
 st.markdown(
@@ -14,68 +19,24 @@ st.markdown(
     """,
     unsafe_allow_html=True
 )
+start_metrics_server()
+# Preload the model, explainer and caches in the background (once per process)
+warmup.start()
+
 # Database setup
+@traced("login.init_db")
 def init_db():
-    conn = sqlite3.connect('user_predictions.db')
-    cursor = conn.cursor()
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT,
-        email TEXT UNIQUE,
-        unique_id TEXT UNIQUE
-    )
-    """)
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS predictions (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        unique_id TEXT,
-        date TEXT,
-        inputs TEXT,
-        prediction_result TEXT,
-        diabetes_probability REAL,
-        no_diabetes_probability REAL,
-        FOREIGN KEY (unique_id) REFERENCES users (unique_id)
-    )
-    """)
-    conn.commit()
-    conn.close()
+    sharding.get_router().init_shards()
 
-# Generate unique ID
-def generate_unique_id(name):
-    conn = sqlite3.connect('user_predictions.db')
-    cursor = conn.cursor()
-    
-    last_name = name.split()[-1].lower()
-    cursor.execute("SELECT unique_id FROM users WHERE unique_id LIKE ?", (f"{last_name}%",))
-    existing_ids = cursor.fetchall()
-    
-    if not existing_ids:
-        return f"{last_name}1"
-    
-    existing_numbers = [int(id[0].replace(last_name, "")) for id in existing_ids if id[0].replace(last_name, "").isdigit()]
-    next_number = max(existing_numbers, default=0) + 1
-    return f"{last_name}{next_number}"
-
-# Save user details
-def save_user(name, email, unique_id):
-    conn = sqlite3.connect('user_predictions.db')
-    cursor = conn.cursor()
-    cursor.execute("INSERT OR IGNORE INTO users (name, email, unique_id) VALUES (?, ?, ?)", (name, email, unique_id))
-    conn.commit()
-    conn.close()
+# Create a user with a freshly allocated unique ID
+@traced("login.create_user")
+def create_user(name, email):
+    return database.create_user(name, email, clinic=sharding.CLINIC)
 
 # Check if user exists
-def user_exists(unique_id=None, email=None, name=None):
-    conn = sqlite3.connect('user_predictions.db')
-    cursor = conn.cursor()
-    if unique_id:
-        cursor.execute("SELECT name FROM users WHERE unique_id = ?", (unique_id,))
-    elif email:
-        cursor.execute("SELECT name FROM users WHERE email = ? and name=?", (email,name,))
-    result = cursor.fetchone()
-    conn.close()
-    return result
+@traced("login.find_user")
+def find_user(unique_id=None, email=None):
+    return database.find_user(unique_id=unique_id, email=email)
 
 # Initialize database on startup
 init_db()
@@ -88,6 +49,10 @@ if "logged_in" not in st.session_state:
     st.session_state.user = None
     st.session_state.name = None
 
+# Sessions idle for too long are logged out (see session_memory.py)
+if session_memory.track():
+    st.info("Your session expired after a period of inactivity. Please log in again.")
+
 # Login page
 def login_page():
     st.header("Login")
@@ -100,20 +65,15 @@ def login_page():
             email = st.text_input("Enter your email")
             if st.button("Submit"):
                 if name and email:
-                    user = user_exists(email=email)
+                    user = find_user(email=email)
                     if user:
-                        conn = sqlite3.connect('user_predictions.db')
-                        cursor = conn.cursor()
-                        cursor.execute("SELECT unique_id FROM users WHERE email = ?", (email,))
-                        existing_id = cursor.fetchone()[0]
-                        conn.close()
+                        existing_id, user_name = user
                         st.session_state.logged_in = True
                         st.session_state.user_id = existing_id
                         st.session_state.log_in_method = "existing_user"
-                        st.session_state.user = user[0]
+                        st.session_state.user = user_name
                     else:
-                        unique_id = generate_unique_id(name)
-                        save_user(name, email, unique_id)
+                        unique_id = create_user(name, email)
                         st.session_state.logged_in = True
                         st.session_state.user_id = unique_id
                         st.session_state.log_in_method = "new_user"
@@ -125,12 +85,12 @@ def login_page():
             unique_id = st.text_input("Enter your unique ID")
             if st.button("Submit"):
                 if unique_id:
-                    user = user_exists(unique_id=unique_id)
+                    user = find_user(unique_id=unique_id)
                     if user:
                         st.session_state.logged_in = True
                         st.session_state.user_id = unique_id
                         st.session_state.log_in_method = "existing_user"
-                        st.session_state.user = user[0]
+                        st.session_state.user = user[1]
                         st.rerun()
                     else:
                         st.error("Unique ID not found. Please log in with your name and email.")
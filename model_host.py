@@ -0,0 +1,312 @@
+"""
+Multi-model host: one registry of (model, scaler, feature schema) bundles shared by
+every session in the server process.
+
+A patient is scored against every registered model in one pass, requests are
+batched per model, and each bundle lazily builds (and then reuses) its SHAP
+explainer. Scores go through the predictions page's LRU cache, under keys that
+start with the bundle name and include its version.
+
+Usage (train the heart-disease model from data/cleveland_heart_disease.csv):
+    python model_host.py train-heart
+"""
+import argparse
+import os
+import threading
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+import shap
+
+import prediction_cache
+from database import FEATURE_NAMES
+from tracing import span
+
+DIABETES_MODEL_PATH = './models/random_forest_diabetes_model.pkl'
+DIABETES_SCALER_PATH = './models/scaler.pkl'
+
+HEART_DATA_PATH = './data/cleveland_heart_disease.csv'
+HEART_MODEL_PATH = './models/heart_disease_model.pkl'
+HEART_SCALER_PATH = './models/heart_disease_scaler.pkl'
+HEART_FEATURE_NAMES = ['age', 'sex', 'cp', 'trestbps', 'chol', 'fbs', 'restecg',
+                       'thalach', 'exang', 'oldpeak', 'slope', 'ca', 'thal']
+# UCI Machine Learning Repository id of the Cleveland heart disease dataset
+HEART_UCI_ID = 45
+
+# How often get_host() checks whether the model files were replaced (e.g. by incremental_training.py)
+RELOAD_CHECK_S = float(os.getenv("HEALTHTRACK_MODEL_RELOAD_S", "30"))
+
+
+class ModelBundle:
+    """
+    A trained model together with its scaler and input schema.
+
+    Parameters:
+    - name: Registry name, e.g. "diabetes".
+    - model: Fitted classifier with predict_proba.
+    - scaler: Fitted scaler (or None if the model takes raw features).
+    - feature_names: Input features, in the order the scaler and model expect.
+    - version: String identifying the artifacts (used in cache keys).
+    - positive_label / negative_label: Text for the two classes.
+    """
+
+    def __init__(self, name, model, scaler, feature_names, version,
+                 positive_label="Present", negative_label="Not Present"):
+        self.name = name
+        self.model = model
+        self.scaler = scaler
+        self.feature_names = list(feature_names)
+        self.version = version
+        self.positive_label = positive_label
+        self.negative_label = negative_label
+        self._explainer = None
+        self._lock = threading.Lock()
+
+    def vector(self, patient):
+        return [patient[feature] for feature in self.feature_names]
+
+    def accepts(self, patient):
+        return all(patient.get(feature) is not None for feature in self.feature_names)
+
+    def cache_key(self, patient):
+        return (self.name,) + prediction_cache.input_key(self.vector(patient), self.version)
+
+    def label(self, probability):
+        return self.positive_label if probability > 0.5 else self.negative_label
+
+    def transform(self, X):
+        X = np.asarray(X, dtype=float)
+        return self.scaler.transform(X) if self.scaler is not None else X
+
+    def predict_proba(self, X):
+        """
+        Positive-class probabilities for a 2D array of raw feature vectors.
+        """
+        return self.model.predict_proba(self.transform(X))[:, 1]
+
+    @property
+    def explainer(self):
+        # Building a TreeExplainer walks every tree, so do it once per bundle
+        if self._explainer is None:
+            with self._lock:
+                if self._explainer is None:
+                    self._explainer = shap.TreeExplainer(self.model)
+        return self._explainer
+
+
+def load_bundle(name, model_path, scaler_path, feature_names, **labels):
+    with span(f"model_host.load.{name}"):
+        return ModelBundle(
+            name,
+            joblib.load(model_path),
+            joblib.load(scaler_path) if scaler_path else None,
+            feature_names,
+            prediction_cache.file_version(*[path for path in (model_path, scaler_path) if path]),
+            **labels
+        )
+
+
+# Bundles the host can load: name -> (model path, scaler path, feature names, class labels)
+BUNDLE_SPECS = {
+    "diabetes": (DIABETES_MODEL_PATH, DIABETES_SCALER_PATH, FEATURE_NAMES,
+                 {"positive_label": "Diabetes Present", "negative_label": "No Diabetes Present"}),
+    "heart_disease": (HEART_MODEL_PATH, HEART_SCALER_PATH, HEART_FEATURE_NAMES,
+                      {"positive_label": "Heart Disease Present", "negative_label": "No Heart Disease Present"}),
+}
+
+
+class ModelHost:
+    """
+    Registry of model bundles (each loaded from BUNDLE_SPECS on first use) with
+    batched, cached scoring across all of them.
+
+    Parameters:
+    - cache: LRUCache for scores, defaults to the predictions page's cache.
+    """
+
+    def __init__(self, cache=None):
+        self.bundles = {}
+        self.cache = cache if cache is not None else prediction_cache.predictions
+        self._lock = threading.Lock()
+
+    def register(self, bundle):
+        self.bundles[bundle.name] = bundle
+        return bundle
+
+    def get(self, name):
+        """
+        The named bundle, loading it if needed.
+
+        Raises:
+        - KeyError if the name is unknown or its model file hasn't been trained yet.
+        """
+        bundle = self.bundles.get(name)
+        if bundle is not None:
+            return bundle
+        with self._lock:
+            if name not in self.bundles:
+                if name not in self:
+                    raise KeyError(name)
+                model_path, scaler_path, feature_names, labels = BUNDLE_SPECS[name]
+                self.register(load_bundle(name, model_path, scaler_path, feature_names, **labels))
+            return self.bundles[name]
+
+    def __contains__(self, name):
+        return name in self.bundles or (name in BUNDLE_SPECS and os.path.exists(BUNDLE_SPECS[name][0]))
+
+    def available(self):
+        """
+        Every bundle that is registered or has trained artifacts, loading those not loaded yet.
+        """
+        names = list(self.bundles) + [name for name in BUNDLE_SPECS if name not in self.bundles]
+        return [self.get(name) for name in names if name in self]
+
+    def score_batch(self, patients):
+        """
+        Score many patients against every available model.
+
+        Rows are grouped per model so each model runs one predict_proba call for the
+        whole batch; rows already in the cache are skipped. A model is skipped for a
+        patient whose input doesn't contain all of its features.
+
+        Parameters:
+        - patients: List of dictionaries of encoded feature values.
+
+        Returns:
+        - List (one per patient) of {model name: positive-class probability}.
+        """
+        scores = [{} for _ in patients]
+        for bundle in self.available():
+            pending_rows, pending_keys, pending_patients = [], [], []
+            for i, patient in enumerate(patients):
+                if not bundle.accepts(patient):
+                    continue
+                key = bundle.cache_key(patient)
+                cached = self.cache.get(key)
+                if cached is not None:
+                    scores[i][bundle.name] = cached
+                else:
+                    pending_rows.append(bundle.vector(patient))
+                    pending_keys.append(key)
+                    pending_patients.append(i)
+            if pending_rows:
+                with span(f"model_host.predict_proba.{bundle.name}"):
+                    probabilities = bundle.predict_proba(pending_rows)
+                for i, key, probability in zip(pending_patients, pending_keys, probabilities):
+                    self.cache.put(key, float(probability))
+                    scores[i][bundle.name] = float(probability)
+        return scores
+
+    def score_all(self, patient):
+        """
+        Score one patient against every available model that accepts their input.
+
+        Returns:
+        - {model name: positive-class probability}.
+        """
+        return self.score_batch([patient])[0]
+
+
+def artifact_mtimes():
+    """
+    Modification times of the model files (None for a missing file).
+    """
+    return tuple(
+        os.path.getmtime(path) if os.path.exists(path) else None
+        for path in (DIABETES_MODEL_PATH, DIABETES_SCALER_PATH, HEART_MODEL_PATH, HEART_SCALER_PATH)
+    )
+
+
+_host = None
+_host_mtimes = None
+_host_checked = 0.0
+_host_lock = threading.Lock()
+
+
+def get_host():
+    """
+    Process-wide host, loaded on first use and shared by all sessions. At most every
+    RELOAD_CHECK_S seconds it checks the model files and reloads them if they changed,
+    so a newly published model version is served without a restart.
+    """
+    global _host, _host_mtimes, _host_checked
+    now = time.monotonic()
+    if _host is None or now - _host_checked >= RELOAD_CHECK_S:
+        with _host_lock:
+            if _host is None or now - _host_checked >= RELOAD_CHECK_S:
+                mtimes = artifact_mtimes()
+                if _host is None or mtimes != _host_mtimes:
+                    _host = ModelHost()
+                    _host_mtimes = mtimes
+                _host_checked = now
+    return _host
+
+
+def load_heart_disease_data(data_path=HEART_DATA_PATH, target_column='num'):
+    """
+    Cleveland features and binary heart-disease labels (num > 0).
+
+    The CSV in data/ holds only the features (as saved from ucimlrepo), so when it
+    has no target column the labels are fetched from the UCI repository.
+    """
+    features = pd.read_csv(data_path)
+    if target_column in features.columns:
+        targets = features.pop(target_column)
+    else:
+        from ucimlrepo import fetch_ucirepo
+        dataset = fetch_ucirepo(id=HEART_UCI_ID)
+        if len(dataset.data.targets) != len(features):
+            raise ValueError(
+                f"{data_path} has {len(features)} rows but UCI dataset {HEART_UCI_ID} has "
+                f"{len(dataset.data.targets)} labels; add a '{target_column}' column to the CSV instead."
+            )
+        targets = dataset.data.targets[target_column]
+    return features[HEART_FEATURE_NAMES], (targets.to_numpy() > 0).astype(int)
+
+
+def train_heart_disease_model(data_path=HEART_DATA_PATH, model_path=HEART_MODEL_PATH, scaler_path=HEART_SCALER_PATH):
+    """
+    Train and save the heart-disease bundle, mirroring the diabetes pipeline in
+    model_training.ipynb (mean imputation, StandardScaler, balanced random forest).
+
+    Returns:
+    - Test-set accuracy.
+    """
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.impute import SimpleImputer
+    from sklearn.metrics import accuracy_score
+    from sklearn.model_selection import train_test_split
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+
+    X, y = load_heart_disease_data(data_path)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y)
+
+    # The imputer lives in the scaler pipeline so the host can treat it like any other scaler
+    scaler = make_pipeline(SimpleImputer(strategy='mean'), StandardScaler())
+    X_train_scaled = scaler.fit_transform(X_train)
+    model = RandomForestClassifier(n_estimators=100, max_depth=5, class_weight='balanced', random_state=42)
+    model.fit(X_train_scaled, y_train)
+
+    accuracy = accuracy_score(y_test, model.predict(scaler.transform(X_test)))
+    joblib.dump(model, model_path)
+    joblib.dump(scaler, scaler_path)
+    return accuracy
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Model host utilities")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    train = subparsers.add_parser("train-heart", help="Train the Cleveland heart-disease model")
+    train.add_argument("--data", default=HEART_DATA_PATH)
+    args = parser.parse_args()
+
+    if args.command == "train-heart":
+        accuracy = train_heart_disease_model(args.data)
+        print(f"Heart disease model saved to {HEART_MODEL_PATH} (test accuracy {accuracy:.3f})")
+
+
+if __name__ == "__main__":
+    main()
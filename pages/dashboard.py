@@ -7,45 +7,54 @@ import matplotlib.dates as mdates
 from matplotlib.lines import Line2D
 from matplotlib.collections import LineCollection
 import matplotlib.ticker as ticker
-from datetime import datetime
+from datetime import date, datetime
 from email.mime.text import MIMEText
 import smtplib
 
+import archive
+import downsample
+import drift
+import session_memory
+import sharding
+from tracing import span, traced, start_metrics_server
+
+start_metrics_server()
+
+if session_memory.track():
+    st.info("Your session expired after a period of inactivity. Please log in again.")
+
 if not st.session_state.logged_in:
     st.warning("You need to log in first")
 else:
-    # Connect to SQLite database
-    conn = sqlite3.connect('user_predictions.db')
+    # Users live in the catalog database, predictions in one or more shards
+    router = sharding.get_router()
 
-    # Function to fetch users
+    # Function to fetch users (from every shard and the archive)
+    @traced("dashboard.fetch_users")
     def fetch_users():
-        query = '''
-        SELECT DISTINCT 
-            predictions.user_id, 
-            users.email, 
-            predictions.Sex, 
-            predictions.Age, 
-            predictions.Education
-        FROM predictions
-        INNER JOIN users
-        ON users.unique_id = predictions.user_id
-        '''
-        return pd.read_sql_query(query, conn)
-
-    # Function to fetch data for a specific user
-    def fetch_user_data(user_id):
-        query = f'''
-        SELECT 
-            predictions.*, 
-            users.email,
-            users.name
-        FROM predictions
-        INNER JOIN users
-        ON users.unique_id = predictions.user_id
-        WHERE predictions.user_id = '{user_id}'
-        ORDER BY date DESC
-        '''
-        return pd.read_sql_query(query, conn)
+        conn = router.connect_catalog()
+        try:
+            return archive.fetch_all_users(conn, users=router.fetch_users())
+        finally:
+            conn.close()
+
+    # Function to fetch data for a specific user (recent rows from their shard, older ones from the archive)
+    @traced("dashboard.fetch_user_data")
+    def fetch_user_data(user_id, start_date=None, end_date=None):
+        conn = router.connect_for_user(user_id)
+        try:
+            return archive.fetch_user_history(conn, user_id, start_date=start_date, end_date=end_date)
+        finally:
+            conn.close()
+
+    # First and last prediction date of a user, for the date-range selector
+    @traced("dashboard.fetch_user_date_range")
+    def fetch_user_date_range(user_id):
+        conn = router.connect_for_user(user_id)
+        try:
+            return archive.user_date_range(conn, user_id)
+        finally:
+            conn.close()
 
     def map_value(value, mapping, default="Unknown"):
         return mapping.get(value, default)
@@ -87,15 +96,29 @@ else:
             users_df.apply(lambda x: f"{x['user_id']} - {x['email']}", axis=1)
         )
         selected_user_id = user_selection.split(' - ')[0]
+
+        # Zoom: only the selected window is fetched from the database and the archive
+        first_date, last_date = fetch_user_date_range(selected_user_id)
+        if first_date is None:
+            st.warning("No data available for this user.")
+            return
+        first_date, last_date = date.fromisoformat(first_date), date.fromisoformat(last_date)
+        start_date, end_date = first_date, last_date
+        if first_date < last_date:
+            start_date, end_date = st.slider(
+                "Date range",
+                min_value=first_date,
+                max_value=last_date,
+                value=(first_date, last_date),
+                format="YYYY-MM-DD"
+            )
         
         # Fetch user data
-        user_data = fetch_user_data(selected_user_id)
+        user_data = fetch_user_data(selected_user_id, start_date.isoformat(), end_date.isoformat())
         if user_data.empty:
             st.warning("No data available for this user.")
             return
         
-        conn.close() 
-        
         # Display basic information
         st.subheader("User Information")
         user_info = user_data.iloc[0]
@@ -153,17 +176,21 @@ else:
         for feature in selected_features:
             st.subheader(f"{feature}")
 
-            user_data['date'] = pd.to_datetime(user_data['date']).dt.date            
+            # At most downsample.CHART_POINTS points per chart, however long the window
+            plot_data = downsample.chart_series(user_data, feature)
+            plot_data['date'] = pd.to_datetime(plot_data['date']).dt.date
+            if len(plot_data) < len(user_data):
+                st.caption(f"Showing {len(plot_data)} of {len(user_data)} predictions; narrow the date range for more detail.")
             if feature == "BMI":
                 fig, ax = plt.subplots(figsize=(10, 6))
 
                 # Define the healthy BMI range
-                healthy_bmi_mask = (user_data[feature] >= 18.5) & (user_data[feature] <= 25)
-                user_data['is_healthy'] = healthy_bmi_mask
+                healthy_bmi_mask = (plot_data[feature] >= 18.5) & (plot_data[feature] <= 25)
+                plot_data['is_healthy'] = healthy_bmi_mask
 
                 # Prepare the data
-                dates = user_data['date'].values
-                values = user_data[feature].values
+                dates = plot_data['date'].values
+                values = plot_data[feature].values
 
                 # Convert dates to numeric for LineCollection
                 numeric_dates = mdates.date2num(dates)
@@ -171,14 +198,13 @@ else:
                 segments = np.concatenate([points[:-1], points[1:]], axis=1)
 
                 # Define the colors for healthy and not healthy BMI
-                colors = ['green' if is_healthy else 'red' for is_healthy in user_data['is_healthy']]
+                colors = ['green' if is_healthy else 'red' for is_healthy in plot_data['is_healthy']]
 
                 # Create a LineCollection with the segments and colors
                 lc = LineCollection(segments, colors=colors, linewidth=2)
                 ax.add_collection(lc)
 
-                for x, y, color in zip(dates, values, colors):
-                    ax.scatter(x, y, color=color, zorder=5)
+                ax.scatter(dates, values, c=colors, zorder=5)
 
                 # Format x-axis for dates
                 ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
@@ -199,11 +225,15 @@ else:
                 ]
                 ax.legend(handles=legend_elements, loc='upper left')
                 plt.xticks(rotation=45, ha='right')
-                st.pyplot(fig)
+                with span("dashboard.st_pyplot"):
+                    st.pyplot(fig)
+                # Free the figure (and its renderer) now rather than when the run ends
+                plt.close(fig)
 
             elif feature in ["MentHlth", "PhysHlth"]:
                 fig, ax = plt.subplots(figsize=(10, 6))
-                ax.plot(user_data['date'], user_data[feature], label=feature, marker='o', linestyle='-')
+                dates = plot_data['date']
+                ax.plot(dates, plot_data[feature], label=feature, marker='o', linestyle='-')
                 ax.set_title(f"{feature} Over Time")
                 ax.set_xlabel("Date")
                 ax.set_ylabel("Number of unhealthy days")
@@ -214,7 +244,9 @@ else:
                 else:
                     ax.xaxis.set_major_locator(ticker.MaxNLocator(nbins=10))
                 plt.xticks(rotation=45, ha='right')
-                st.pyplot(fig)
+                with span("dashboard.st_pyplot"):
+                    st.pyplot(fig)
+                plt.close(fig)
             
             elif feature == 'Income':
                 income_map = {
@@ -222,11 +254,12 @@ else:
                     4: "$20,000 - $24,999", 5: "$25,000 - $34,999", 6: "$35,000 - $49,999",
                     7: "$50,000 - $74,999", 8: "$75,000 and above"
                 }
-                user_data['IncomeCategory'] = user_data['Income'].map(income_map)
+                plot_data['IncomeCategory'] = plot_data['Income'].map(income_map)
 
                 fig, ax = plt.subplots(figsize=(10, 6))
                 
-                ax.plot(user_data['date'], user_data['Income'], label='Income', marker='o', linestyle='-', color='b')
+                dates = plot_data['date']
+                ax.plot(dates, plot_data['Income'], label='Income', marker='o', linestyle='-', color='b')
                 
                 ax.set_title(f"{feature} Over Time")
                 # Format x-axis for dates
@@ -243,28 +276,29 @@ else:
                 ax.set_yticks(range(1, 9))
                 ax.set_yticklabels(income_map.values())
                 ax.legend()
-                st.pyplot(fig)
+                with span("dashboard.st_pyplot"):
+                    st.pyplot(fig)
+                plt.close(fig)
 
             elif feature in ["Prediction","Probability"]:
                 fig, ax = plt.subplots(figsize=(10, 6))
 
-                dates = user_data['date']
+                dates = plot_data['date']
                 numeric_dates = mdates.date2num(dates)
-                probabilities = user_data['Probability'] * 100  # Scale probability to percentage
+                probabilities = plot_data['Probability'] * 100  # Scale probability to percentage
 
                 # Combine the prediction and probability into segments
                 points = np.array([numeric_dates, probabilities]).T.reshape(-1, 1, 2)
                 segments = np.concatenate([points[:-1], points[1:]], axis=1)
 
                 # Define colors based on predictions
-                colors = ['green' if pred == "No Diabetes Present" else 'red' for pred in user_data['Prediction']]
+                colors = ['green' if pred == "No Diabetes Present" else 'red' for pred in plot_data['Prediction']]
 
                 # Create a LineCollection with segments and colors
                 lc = LineCollection(segments, colors=colors, linewidth=2)
                 ax.add_collection(lc)
 
-                for x, y, color in zip(dates, probabilities, colors):
-                    ax.scatter(x, y, color=color, zorder=5)
+                ax.scatter(dates, probabilities, c=colors, zorder=5)
 
                 # Set axis limits and labels
                 ax.set_xlim(numeric_dates.min(), numeric_dates.max())
@@ -289,15 +323,17 @@ else:
                 ax.legend(handles=legend_elements, loc='upper left')
 
                 # Show the plot
-                st.pyplot(fig)
+                with span("dashboard.st_pyplot"):
+                    st.pyplot(fig)
+                plt.close(fig)
                 
             elif feature in ["CholCheck","PhysActivity","Fruits","Veggies","AnyHealthcare"]:
                 fig, ax = plt.subplots(figsize=(10, 6))
 
                 # Convert dates to numeric for LineCollection
-                dates = user_data['date']
+                dates = plot_data['date']
                 numeric_dates = mdates.date2num(dates)
-                binary_values = user_data[feature].astype(int)  # Convert Yes/No to 1/0
+                binary_values = plot_data[feature]
 
                 # Prepare segments for LineCollection
                 points = np.array([numeric_dates, binary_values]).T.reshape(-1, 1, 2)
@@ -310,8 +346,7 @@ else:
                 lc = LineCollection(segments, colors=colors, linewidth=2)
                 ax.add_collection(lc)
 
-                for x, y, color in zip(dates, binary_values, colors):
-                    ax.scatter(x, y, color=color, zorder=5)
+                ax.scatter(dates, binary_values, c=colors, zorder=5)
 
                 # Set axis limits and labels
                 ax.set_xlim(numeric_dates.min(), numeric_dates.max())
@@ -338,13 +373,15 @@ else:
                 ax.legend(handles=legend_elements, loc='upper left')
 
                 # Show the plot
-                st.pyplot(fig)
+                with span("dashboard.st_pyplot"):
+                    st.pyplot(fig)
+                plt.close(fig)
             else:
                 fig, ax = plt.subplots(figsize=(10, 6))
                 # Convert dates to numeric for LineCollection
-                dates = user_data['date']
+                dates = plot_data['date']
                 numeric_dates = mdates.date2num(dates)
-                binary_values = user_data[feature].astype(int)  # Convert Yes/No to 1/0
+                binary_values = plot_data[feature]
 
                 # Prepare segments for LineCollection
                 points = np.array([numeric_dates, binary_values]).T.reshape(-1, 1, 2)
@@ -357,8 +394,7 @@ else:
                 lc = LineCollection(segments, colors=colors, linewidth=2)
                 ax.add_collection(lc)
 
-                for x, y, color in zip(dates, binary_values, colors):
-                    ax.scatter(x, y, color=color, zorder=5)
+                ax.scatter(dates, binary_values, c=colors, zorder=5)
 
                 # Set axis limits and labels
                 ax.set_xlim(numeric_dates.min(), numeric_dates.max())
@@ -385,9 +421,22 @@ else:
                 ax.legend(handles=legend_elements, loc='upper left')
 
                 # Show the plot
-                st.pyplot(fig)
+                with span("dashboard.st_pyplot"):
+                    st.pyplot(fig)
+                plt.close(fig)
+
+
+        # Live inputs (all users) compared with the training data
+        st.subheader("Input Drift")
+        drift_scores = drift.monitor.scores()
+        if drift.monitor.reference is None:
+            st.info("No reference histograms yet. Run `python drift.py build-reference` to enable drift monitoring.")
+        elif drift_scores.empty:
+            st.info(f"Drift scores appear after {drift.MIN_OBSERVATIONS} predictions in the last {drift.monitor.window_days} days ({drift.monitor.observations} so far).")
+        else:
+            st.caption(f"Based on {drift.monitor.observations} predictions in the last {drift.monitor.window_days} days. PSI above {drift.PSI_THRESHOLDS[1]} indicates a significant shift.")
+            st.dataframe(drift_scores.style.format({"PSI": "{:.3f}", "KS": "{:.3f}"}), hide_index=True)
 
-        
         st.subheader("Email Dashboard")
         email_address = st.text_input("Enter email address:")
         if st.button("Send Email"):
@@ -1,83 +1,57 @@
 import pandas as pd
 import shap
 import streamlit as st
-import joblib
 import numpy as np
 import matplotlib.pyplot as plt
-from datetime import date
 
-from utils import explain_model, generate_recommendations, load_api_key
-import sqlite3
+import cohort_index
+import drift
+import explanations
+import model_host
+import prediction_cache
+import session_memory
+import sharding
+import what_if
+from database import save_prediction
+from demo_profiles import DEMO_PROFILES
+from utils import contributions_frame, explain_model, generate_recommendations, load_api_key
+from tracing import span, traced, start_metrics_server
+
+start_metrics_server()
+
+# Account this session's memory (its state and the cached results it is showing);
+# sessions idle for too long are logged out and their results released
+current_key = st.session_state.get("prediction_key")
+if session_memory.track(pinned=[(prediction_cache.predictions, current_key), (prediction_cache.what_if_results, current_key)]):
+    st.info("Your session expired after a period of inactivity. Please log in again.")
 
 if not st.session_state.logged_in:
     st.warning("You need to log in first")
 else:
-    conn = sqlite3.connect('user_predictions.db')
-    cursor = conn.cursor()
+    # Predictions are written to the shard that holds this user
+    conn = sharding.get_router().connect_for_user(st.session_state.user_id)
 
+    @traced("predictions.save_prediction_to_db")
     def save_prediction_to_db(user_id, user_input, prediction_result, diabetes_prob):
         try:
-            today_date = date.today().strftime('%Y-%m-%d')  # Format as YYYY-MM-DD
-
-            # Check if an entry exists for this user and date
-            cursor.execute('''
-            SELECT id FROM predictions 
-            WHERE user_id = ? AND date = ?
-            ''', (user_id, today_date))
-            existing_entry = cursor.fetchone()
-
-            if existing_entry:
-                # Update the existing entry
-                cursor.execute('''
-                UPDATE predictions
-                SET 
-                    HighBP = ?, HighChol = ?, CholCheck = ?, BMI = ?, Smoker = ?, Stroke = ?,
-                    HeartDiseaseorAttack = ?, PhysActivity = ?, Fruits = ?, Veggies = ?,
-                    HvyAlcoholConsump = ?, AnyHealthcare = ?, NoDocbcCost = ?, GenHlth = ?, 
-                    MentHlth = ?, PhysHlth = ?, DiffWalk = ?, Sex = ?, Age = ?, 
-                    Education = ?, Income = ?, Prediction = ?, Probability = ?
-                WHERE id = ?
-                ''', (
-                    user_input['HighBP'], user_input['HighChol'], user_input['CholCheck'], user_input['BMI'],
-                    user_input['Smoker'], user_input['Stroke'], user_input['HeartDiseaseorAttack'],
-                    user_input['PhysActivity'], user_input['Fruits'], user_input['Veggies'],
-                    user_input['HvyAlcoholConsump'], user_input['AnyHealthcare'], user_input['NoDocbcCost'],
-                    user_input['GenHlth'], user_input['MentHlth'], user_input['PhysHlth'],
-                    user_input['DiffWalk'], user_input['Sex'], user_input['Age'],
-                    user_input['Education'], user_input['Income'], prediction_result, diabetes_prob,
-                    existing_entry[0]
-                ))
-            else:
-                # Insert a new entry
-                cursor.execute('''
-                INSERT INTO predictions (
-                    user_id, HighBP, HighChol, CholCheck, BMI, Smoker, Stroke,
-                    HeartDiseaseorAttack, PhysActivity, Fruits, Veggies, 
-                    HvyAlcoholConsump, AnyHealthcare, NoDocbcCost, GenHlth, 
-                    MentHlth, PhysHlth, DiffWalk, Sex, Age, Education, Income, 
-                    Prediction, Probability, date
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    user_id,
-                    user_input['HighBP'], user_input['HighChol'], user_input['CholCheck'], user_input['BMI'],
-                    user_input['Smoker'], user_input['Stroke'], user_input['HeartDiseaseorAttack'],
-                    user_input['PhysActivity'], user_input['Fruits'], user_input['Veggies'],
-                    user_input['HvyAlcoholConsump'], user_input['AnyHealthcare'], user_input['NoDocbcCost'],
-                    user_input['GenHlth'], user_input['MentHlth'], user_input['PhysHlth'],
-                    user_input['DiffWalk'], user_input['Sex'], user_input['Age'],
-                    user_input['Education'], user_input['Income'],
-                    prediction_result, diabetes_prob, today_date
-                ))
-
-            conn.commit()
+            prediction_id = save_prediction(conn, user_id, user_input, prediction_result, diabetes_prob)
+            with span("predictions.drift_update"):
+                drift.monitor.update(user_input)
             st.success("Prediction saved successfully!")
             conn.close() 
+            return prediction_id
         except Exception as e:
             st.error(f"Error saving to database: {e}")
 
-    # Load the trained Random Forest model and scaler
-    model = joblib.load('./models/random_forest_diabetes_model.pkl')
-    scaler = joblib.load('./models/scaler.pkl')
+    # The trained Random Forest model and scaler, loaded once per server process and
+    # shared (with their SHAP explainer) by all sessions
+    host = model_host.get_host()
+    bundle = host.get("diabetes")
+    model, scaler, model_version = bundle.model, bundle.scaler, bundle.version
+
+    # Build the "patients like me" index in the background on first use
+    if cohort_index.get_index() is None:
+        cohort_index.build_in_background(scaler)
 
     # Feature names and descriptions
     feature_info = {
@@ -108,78 +82,8 @@ else:
 
     # st.title("Diabetes Prediction and Lifestyle Recommendations")
 
-    # Demo Templates
-    demo_profiles = {
-        "Sample Profile 1: Older Male with High BMI and Unhealthy Lifestyle": {
-            'HighBP': 1,
-            'HighChol': 1,
-            'CholCheck': 0,
-            'BMI': 35,
-            'Smoker': 1,
-            'Stroke': 1,
-            'HeartDiseaseorAttack': 1,
-            'PhysActivity': 0,
-            'Fruits': 0,
-            'Veggies': 0,
-            'HvyAlcoholConsump': 1,
-            'AnyHealthcare': 0,
-            'NoDocbcCost': 1,
-            'GenHlth': 5,
-            'MentHlth': 20,
-            'PhysHlth': 25,
-            'DiffWalk': 1,
-            'Sex': 1,  # Male
-            'Age': 65,  # 80+
-            'Education': 3,  # Some high school
-            'Income': 2  # $10,000 - $15,000
-        },
-        "Sample Profile 2: Younger Male with High BMI and Unhealthy Lifestyle": {
-            'HighBP': 0,
-            'HighChol': 1,
-            'CholCheck': 1,
-            'BMI': 32,
-            'Smoker': 1,
-            'Stroke': 0,
-            'HeartDiseaseorAttack': 0,
-            'PhysActivity': 0,
-            'Fruits': 0,
-            'Veggies': 0,
-            'HvyAlcoholConsump': 1,
-            'AnyHealthcare': 1,
-            'NoDocbcCost': 0,
-            'GenHlth': 4,
-            'MentHlth': 15,
-            'PhysHlth': 10,
-            'DiffWalk': 0,
-            'Sex': 1,  # Male
-            'Age': 25,  # 25-29
-            'Education': 4,  # High school graduate
-            'Income': 5  # $25,000 - $35,000
-        },
-        "Sample Profile 3: Older Under Educated Female with Healthy Diet": {
-            'HighBP': 1,
-            'HighChol': 0,
-            'CholCheck': 1,
-            'BMI': 22,
-            'Smoker': 0,
-            'Stroke': 0,
-            'HeartDiseaseorAttack': 0,
-            'PhysActivity': 1,
-            'Fruits': 1,
-            'Veggies': 1,
-            'HvyAlcoholConsump': 0,
-            'AnyHealthcare': 1,
-            'NoDocbcCost': 0,
-            'GenHlth': 2,
-            'MentHlth': 2,
-            'PhysHlth': 3,
-            'DiffWalk': 0,
-            'Sex': 0,  # Female
-            'Age': 74,  # 70-74
-            'Education': 1,  # No formal education
-            'Income': 1  # < $10,000
-        }
-    }
+    # Demo Templates (copied, because the page overwrites the selected profile with the inputs)
+    demo_profiles = {name: dict(profile) for name, profile in DEMO_PROFILES.items()}
 
     # Use a radio button for better visual clarity
     selected_demo = st.radio(
@@ -295,68 +199,133 @@ else:
             )
             user_input[feature] = value
 
+    # Inputs for the heart-disease model (Cleveland encoding), when it has been trained
+    heart_input = {}
+    if "heart_disease" in host and st.checkbox("Also check my heart-disease risk (needs recent clinical test results)"):
+        chest_pain_options = {"Typical angina": 1, "Atypical angina": 2, "Non-anginal pain": 3, "No chest pain": 4}
+        ecg_options = {"Normal": 0, "ST-T wave abnormality": 1, "Left ventricular hypertrophy": 2}
+        slope_options = {"Upsloping": 1, "Flat": 2, "Downsloping": 3}
+        thal_options = {"Normal": 3, "Fixed defect": 6, "Reversible defect": 7}
+        heart_input['age'] = age
+        heart_input['sex'] = user_input['Sex']
+        heart_input['cp'] = chest_pain_options[st.selectbox("Chest pain type:", options=list(chest_pain_options.keys()), index=3)]
+        heart_input['trestbps'] = st.number_input("Resting blood pressure (mm Hg):", min_value=50, max_value=250, value=120)
+        heart_input['chol'] = st.number_input("Serum cholesterol (mg/dl):", min_value=100, max_value=600, value=200)
+        heart_input['fbs'] = 1 if st.selectbox("Fasting blood sugar above 120 mg/dl:", options=["No", "Yes"]) == "Yes" else 0
+        heart_input['restecg'] = ecg_options[st.selectbox("Resting ECG result:", options=list(ecg_options.keys()))]
+        heart_input['thalach'] = st.number_input("Maximum heart rate during exercise test:", min_value=60, max_value=220, value=150)
+        heart_input['exang'] = 1 if st.selectbox("Chest pain during exercise:", options=["No", "Yes"]) == "Yes" else 0
+        heart_input['oldpeak'] = st.number_input("ST depression during exercise relative to rest:", min_value=0.0, max_value=7.0, value=0.0, step=0.1)
+        heart_input['slope'] = slope_options[st.selectbox("Slope of the peak exercise ST segment:", options=list(slope_options.keys()))]
+        heart_input['ca'] = st.number_input("Major vessels colored by fluoroscopy (0-3):", min_value=0, max_value=3, value=0)
+        heart_input['thal'] = thal_options[st.selectbox("Thallium stress test result:", options=list(thal_options.keys()))]
+
+    # Everything entered, for scoring against every model the host serves
+    patient = dict(user_input, **heart_input)
+
     # show input values as dataframe
     # st.write(pd.DataFrame(user_input, index=[0]))
 
     # Convert user input to a numpy array and reshape to 2D
     user_input_array = np.array(list(user_input.values())).reshape(1, -1)
 
-    # Scale the input features using the loaded scaler
-    scaled_input = scaler.transform(user_input_array)
+    # Results are memoized per encoded input vector and model version, so reruns and
+    # identical profiles (e.g. the demo profiles) skip scaling, prediction and SHAP
+    prediction_key = prediction_cache.input_key(user_input_array[0], model_version)
 
+    def compute_prediction():
+        # Scale the input features using the loaded scaler
+        with span("predictions.scaler_transform"):
+            scaled_input = scaler.transform(user_input_array)
+
+        # Get the prediction probabilities (every model is scored in one batched pass)
+        with span("predictions.score_all"):
+            diabetes_prob = host.score_all(patient)["diabetes"]  # Probability of class 1 (Diabetes Present)
+        no_diabetes_prob = 1 - diabetes_prob  # Probability of class 0 (No Diabetes)
+
+        # Determine the prediction result
+        prediction_result = "Diabetes Present" if diabetes_prob > no_diabetes_prob else "No Diabetes Present"
+        user_model_text = f"The model predicts: **{prediction_result}** with {max(diabetes_prob, no_diabetes_prob) * 100:.2f}% probability"
+
+        # Get SHAP values and feature contributions (fast approximate mode when calibrated,
+        # with exact TreeSHAP for rows whose ranking it can't vouch for)
+        with span("predictions.explain_model"):
+            shap_values, _ = explain_model(
+                feature_names=list(feature_info.keys()),
+                X_sample=user_input_array,
+                X_sample_scaled=scaled_input,
+                rf_model=model,
+                explainer=explanations.explainer_for(bundle)
+            )
+
+        # Cached (and shared by sessions) for as long as the LRU keeps it, so keep it compact:
+        # the contributions table is rebuilt from the float32 SHAP values when shown
+        return {
+            "diabetes_prob": float(diabetes_prob),
+            "prediction_result": prediction_result,
+            "user_model_text": user_model_text,
+            "shap_values": shap_values[0][:, 1].astype(np.float32),  # SHAP values for class 1 (diabetes) for the first sample
+            "scaled_input": scaled_input[0].astype(np.float32),
+        }
 
     # Initialize session state for prediction_made
     if "prediction_made" not in st.session_state:
         st.session_state.prediction_made = False
+        st.session_state.prediction_key = None
 
     # Predict button
     if st.button("Predict"):
-        # Get the prediction probabilities
-        probabilities = model.predict_proba(scaled_input)[0]
-        diabetes_prob = probabilities[1]  # Probability of class 1 (Diabetes Present)
-        no_diabetes_prob = probabilities[0]  # Probability of class 0 (No Diabetes)
-
-        # Determine the prediction result
-        prediction_result = "Diabetes Present" if diabetes_prob > no_diabetes_prob else "No Diabetes Present"
-
-        user_model_text = f"The model predicts: **{prediction_result}** with {max(diabetes_prob, no_diabetes_prob) * 100:.2f}% probability"
-        save_prediction_to_db(st.session_state.user_id,user_input, prediction_result, diabetes_prob)
+        result = prediction_cache.predictions.get_or_compute(prediction_key, compute_prediction)
+        prediction_id = save_prediction_to_db(st.session_state.user_id, user_input, result["prediction_result"], result["diabetes_prob"])
+        if prediction_id is not None:
+            with span("predictions.cohort_index_add"):
+                cohort_index.add_prediction(prediction_id, st.session_state.user_id, result["scaled_input"], scaler)
 
         # Display the prediction result with probabilities
-        st.success(user_model_text)
-
-        # Save prediction result in session state
+        st.success(result["user_model_text"])
+
+        # Results of the other models (cache hits: they were scored with the diabetes model)
+        with span("predictions.score_all"):
+            scores = host.score_all(patient)
+        for name, probability in scores.items():
+            if name != "diabetes":
+                other = host.get(name)
+                st.success(
+                    f"The {name.replace('_', '-')} model predicts: **{other.label(probability)}** "
+                    f"with {max(probability, 1 - probability) * 100:.2f}% probability"
+                )
+
+        # Remember which inputs the shown results belong to
         st.session_state.prediction_made = True
-        st.session_state.user_model_text = user_model_text
+        st.session_state.prediction_key = prediction_key
 
-        # Get SHAP values and feature contributions
-        shap_values, feature_contributions = explain_model(
-            feature_names=list(feature_info.keys()),
-            X_sample=user_input_array,
-            X_sample_scaled=scaled_input,
-            rf_model=model
-        )
-
-        # Save SHAP values and contributions in session state
-        st.session_state.shap_values = shap_values
-        st.session_state.feature_contributions = feature_contributions
+    # Results computed for other inputs are stale
+    prediction_current = st.session_state.prediction_made and st.session_state.prediction_key == prediction_key
+    if st.session_state.prediction_made and not prediction_current:
+        st.info("Your inputs have changed. Click Predict to update your results.")
 
     llm, api_key = load_api_key()
 
     # Show additional options only if prediction has been made
-    if st.session_state.prediction_made and api_key is not None:
+    if prediction_current and api_key is not None:
+        result = prediction_cache.predictions.get_or_compute(prediction_key, compute_prediction)
+        feature_contributions = contributions_frame(list(feature_info.keys()), result["shap_values"])
+
         # Generate LLM recommendations
         # if st.button("Generate Personalized Recommendations"):
         st.write("### Personalized Lifestyle Recommendations:")
-        recommendations = generate_recommendations(
-            st.session_state.feature_contributions,
-            feature_info,
-            st.session_state.user_model_text,
-            llm
-        )
-
-        # Display the "content" part of the response
-        st.write(recommendations.content)
+        if "recommendations" not in result:
+            with span("predictions.generate_recommendations"):
+                recommendations = generate_recommendations(
+                    feature_contributions,
+                    feature_info,
+                    result["user_model_text"],
+                    llm
+                )
+            # Keep the "content" part of the response
+            result["recommendations"] = recommendations.content
+
+        st.write(result["recommendations"])
 
         with st.expander("View SHAP Values", expanded=False):
             # Visualize SHAP values using a bar plot
@@ -364,17 +333,80 @@ else:
 
             fig, ax = plt.subplots()
             shap.bar_plot(
-                st.session_state.shap_values[0][:, 1],  # SHAP values for class 1 (diabetes) for the first sample
+                result["shap_values"],
                 feature_names=list(feature_info.keys()),
                 show=False  # Prevent SHAP from auto-displaying the plot
             )
 
-            st.pyplot(fig)
+            with span("predictions.st_pyplot"):
+                st.pyplot(fig)
+            plt.close(fig)
 
             # Display the feature contributions in a table
             st.write("### Feature Contributions:")
-            st.table(st.session_state.feature_contributions)
-
-
-
+            st.table(feature_contributions)
+
+    # What-if explorer: every single and pairwise lifestyle change is scored in one
+    # batched call and cached per profile, so adjusting the filters is instant
+    if prediction_current:
+        result = prediction_cache.predictions.get_or_compute(prediction_key, compute_prediction)
+        with span("predictions.what_if"):
+            what_if_results = prediction_cache.what_if_results.get_or_compute(
+                prediction_key,
+                lambda: what_if.explore(model, scaler, user_input, result["diabetes_prob"])
+            )
 
+        st.write("### What If I Change My Lifestyle?")
+        modifiable = [feature for feature in ['BMI'] + list(what_if.BINARY_TARGETS)
+                      if what_if_results["Features"].map(lambda features: feature in features).any()]
+        if not modifiable:
+            st.write("Your lifestyle indicators are already where they should be.")
+        else:
+            allowed_features = st.multiselect(
+                "Which of these would you be willing to change?",
+                modifiable,
+                default=modifiable,
+                format_func=lambda feature: feature_info[feature][0]
+            )
+            max_bmi_change = 0.0
+            if 'BMI' in allowed_features:
+                max_bmi_change = st.slider(
+                    "Largest BMI change to consider:",
+                    min_value=0.5, max_value=what_if.MAX_BMI_CHANGE, value=5.0, step=what_if.BMI_STEP
+                )
+            best = what_if.best_changes(what_if_results, allowed_features, max_bmi_change)
+            if best.empty:
+                st.write("None of the selected changes would lower your predicted risk.")
+            else:
+                st.table(pd.DataFrame({
+                    "Change": best["Change"],
+                    "New risk": (best["New risk"] * 100).map("{:.1f}%".format),
+                    "Risk reduction": (best["Risk reduction"] * 100).map("{:.1f} points".format),
+                }).reset_index(drop=True))
+
+    # Patients like me: nearest neighbours of the scaled input among all stored predictions
+    if prediction_current:
+        st.write("### Patients Like You")
+        index = cohort_index.get_index()
+        if index is None and cohort_index.last_error() is not None:
+            st.info("The similar-patient lookup is unavailable right now.")
+        elif index is None:
+            st.info("The similar-patient lookup is still loading. It will appear on your next prediction.")
+        else:
+            with span("predictions.similar_patients"):
+                neighbours = index.similar_patients(result["scaled_input"], n_patients=10, exclude_user=st.session_state.user_id)
+                cohort = cohort_index.summarize_cohort(neighbours)
+            if cohort.empty:
+                st.write("There are no similar patients on record yet.")
+            else:
+                at_risk = (cohort["latest_prediction"] == "Diabetes Present").mean() * 100
+                risk_change = (cohort["latest_probability"] - cohort["first_probability"]).mean() * 100
+                col1, col2 = st.columns(2)
+                col1.metric("Similar patients currently at risk", f"{at_risk:.0f}%")
+                col2.metric("Average change in their risk over time", f"{risk_change:+.1f} points")
+                st.table(pd.DataFrame({
+                    "Patient": [f"Patient {i + 1}" for i in range(len(cohort))],
+                    "Current risk": (cohort["latest_probability"] * 100).map("{:.1f}%".format),
+                    "Change since first prediction": ((cohort["latest_probability"] - cohort["first_probability"]) * 100).map("{:+.1f} points".format),
+                    "Days tracked": cohort["days"],
+                }))
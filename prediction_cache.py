@@ -0,0 +1,102 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Maximum number of distinct input vectors kept in memory (shared by all sessions)
+CACHE_SIZE = int(os.getenv("HEALTHTRACK_CACHE_SIZE", "1024"))
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded least-recently-used cache.
+
+    Streamlit serves every session from the same process, so one module-level
+    instance is shared across reruns and users.
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def peek(self, key, default=None):
+        """
+        Return the cached value without counting a hit or refreshing its recency.
+        """
+        with self._lock:
+            return self._data.get(key, default)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached value for key, computing and storing it on a miss.
+        """
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+def file_version(*paths):
+    """
+    Short content hash of the model artifacts, so a retrained model never serves stale cache entries.
+    """
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def input_key(values, model_version):
+    """
+    Cache key for an encoded input vector under a given model version.
+
+    Parameters:
+    - values: Iterable of encoded feature values, in model order.
+    - model_version: String returned by file_version().
+    """
+    return (model_version,) + tuple(round(float(value), 6) for value in values)
+
+
+# Prediction results (probabilities, SHAP contributions, recommendations) per input vector
+predictions = LRUCache()
+
+# Scored what-if candidates per input vector
+what_if_results = LRUCache(maxsize=max(1, CACHE_SIZE // 4))
@@ -0,0 +1,269 @@
+"""
+Per-session memory accounting, budget and idle-session eviction.
+
+Every page run calls track(). It records when the session was last active and
+measures its memory: what it keeps in st.session_state, plus the shared cache
+entries it pins (its current prediction and what-if results). A session over
+SESSION_BUDGET_KB has its non-essential session-state keys dropped, largest
+first.
+
+A session idle for longer than IDLE_TIMEOUT_S is evicted. Its pinned cache
+entries are released straight away, unless another session pins them too. Its
+session state is reset to the logged-out defaults when it next runs. (Streamlit
+only allows safe access to a session's state from that session's own script
+thread.) The numbers are for operators only, on the metrics server: /metrics
+exports the totals and /sessions lists the memory of each active session. The
+registry never records who a session belongs to.
+"""
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from tracing import register_collector, register_endpoint
+
+IDLE_TIMEOUT_S = int(os.getenv("HEALTHTRACK_SESSION_IDLE_S", "1800"))
+SESSION_BUDGET_KB = int(os.getenv("HEALTHTRACK_SESSION_BUDGET_KB", "1024"))
+
+# How often track() looks for idle sessions, and how long evicted sessions are remembered
+SWEEP_INTERVAL_S = 60
+EVICTED_RETENTION_S = 24 * 3600
+
+# Session state set by login.py; an evicted session is reset to these values
+LOGGED_OUT_STATE = {"logged_in": False, "user_id": None, "log_in_method": None, "user": None, "name": None}
+
+# Keys kept when a session is over its budget (everything else is recomputable)
+ESSENTIAL_KEYS = set(LOGGED_OUT_STATE) | {"prediction_made", "prediction_key"}
+
+
+def sizeof(value):
+    """
+    Approximate memory held by a value, following containers, arrays and DataFrames.
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sizeof(key) + sizeof(item) for key, item in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(sizeof(item) for item in value)
+    return sys.getsizeof(value)
+
+
+def process_rss():
+    """
+    Resident set size of the server process in bytes (peak RSS where /proc is unavailable).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class SessionRegistry:
+    """
+    Last activity and measured memory of every session in the process.
+
+    Parameters:
+    - idle_timeout_s: Idle time after which a session is evicted.
+    - budget_bytes: Memory allowed per session (session state plus pinned cache entries).
+    """
+
+    def __init__(self, idle_timeout_s=IDLE_TIMEOUT_S, budget_bytes=SESSION_BUDGET_KB * 1024):
+        self.idle_timeout_s = idle_timeout_s
+        self.budget_bytes = budget_bytes
+        self.sessions = {}
+        self.evicted_total = 0
+        self.trimmed_keys_total = 0
+        self._last_sweep = 0.0
+        self._lock = threading.Lock()
+
+    def track(self, session_id, state, pinned=(), now=None):
+        """
+        Record a run of a session, enforce its budget and sweep idle sessions.
+
+        Parameters:
+        - session_id: Streamlit session id.
+        - state: The session's state (st.session_state, or any mutable mapping).
+        - pinned: (LRUCache, key) pairs of shared cache entries the session uses.
+        - now: Current time.time() (for tests and benchmarks).
+
+        Returns:
+        - True if the session had been evicted and its state was reset.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            record = self.sessions.get(session_id)
+            was_evicted = record is not None and record["evicted"]
+
+        if was_evicted:
+            for key in list(state.keys()):
+                del state[key]
+            for key, value in LOGGED_OUT_STATE.items():
+                state[key] = value
+            pinned = ()
+
+        # Size of each session-state value and of each pinned cache entry
+        state_sizes = {key: sizeof(state[key]) for key in list(state.keys())}
+        pinned = [(cache, key) for cache, key in pinned if key is not None and cache.peek(key) is not None]
+        pinned_bytes = sum(sizeof(cache.peek(key)) for cache, key in pinned)
+
+        # Over budget: drop recomputable session-state values, largest first
+        trimmed = 0
+        for key in sorted(state_sizes, key=state_sizes.get, reverse=True):
+            if sum(state_sizes.values()) + pinned_bytes <= self.budget_bytes:
+                break
+            if key not in ESSENTIAL_KEYS:
+                del state[key]
+                del state_sizes[key]
+                trimmed += 1
+
+        with self._lock:
+            self.sessions[session_id] = {
+                "last_seen": now,
+                "state_bytes": sum(state_sizes.values()),
+                "pinned_bytes": pinned_bytes,
+                "pinned": pinned,
+                "evicted": False,
+            }
+            self.trimmed_keys_total += trimmed
+            sweep = now - self._last_sweep >= SWEEP_INTERVAL_S
+        if sweep:
+            self.sweep(now)
+        return was_evicted
+
+    def sweep(self, now=None):
+        """
+        Evict sessions idle for longer than idle_timeout_s and forget long-evicted ones.
+
+        Returns:
+        - Number of sessions evicted.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._last_sweep = now
+            idle = [
+                session_id for session_id, record in self.sessions.items()
+                if not record["evicted"] and now - record["last_seen"] > self.idle_timeout_s
+            ]
+            released = []
+            for session_id in idle:
+                record = self.sessions[session_id]
+                released += record["pinned"]
+                record.update(evicted=True, state_bytes=0, pinned_bytes=0, pinned=[])
+            # Entries another active session still uses stay cached
+            in_use = {
+                (id(cache), key) for record in self.sessions.values() if not record["evicted"]
+                for cache, key in record["pinned"]
+            }
+            for cache, key in released:
+                if (id(cache), key) not in in_use:
+                    cache.pop(key)
+            for session_id in [
+                session_id for session_id, record in self.sessions.items()
+                if record["evicted"] and now - record["last_seen"] > self.idle_timeout_s + EVICTED_RETENTION_S
+            ]:
+                del self.sessions[session_id]
+            self.evicted_total += len(idle)
+        return len(idle)
+
+    def report(self, now=None):
+        """
+        One row per active session: idle time and memory, largest first. Rows carry no
+        session id or user, so the report can't be tied back to a patient.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            rows = [
+                (now - record["last_seen"], record["state_bytes"] / 1024, record["pinned_bytes"] / 1024,
+                 (record["state_bytes"] + record["pinned_bytes"]) / 1024)
+                for record in self.sessions.values() if not record["evicted"]
+            ]
+        report = pd.DataFrame(rows, columns=["Idle (s)", "State (KB)", "Cached results (KB)", "Total (KB)"])
+        return report.sort_values("Total (KB)", ascending=False, ignore_index=True)
+
+    def totals(self):
+        with self._lock:
+            active = [record for record in self.sessions.values() if not record["evicted"]]
+            return {
+                "sessions": len(active),
+                "bytes": sum(record["state_bytes"] + record["pinned_bytes"] for record in active),
+                "evicted_total": self.evicted_total,
+                "trimmed_keys_total": self.trimmed_keys_total,
+            }
+
+
+# Process-wide registry shared by all sessions
+registry = SessionRegistry()
+
+
+def track(pinned=()):
+    """
+    Account the current Streamlit session (call at the top of every page).
+
+    Parameters:
+    - pinned: (LRUCache, key) pairs of shared cache entries the session uses.
+
+    Returns:
+    - True if the session was evicted for inactivity and is now logged out.
+    """
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    import streamlit as st
+
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return False
+    return registry.track(ctx.session_id, st.session_state, pinned)
+
+
+def render_prometheus():
+    """
+    Session gauges for the tracing /metrics endpoint.
+    """
+    totals = registry.totals()
+    return [
+        "# HELP healthtrack_sessions Active Streamlit sessions.",
+        "# TYPE healthtrack_sessions gauge",
+        f"healthtrack_sessions {totals['sessions']}",
+        "# HELP healthtrack_session_bytes Memory held by active sessions (session state and pinned cache entries).",
+        "# TYPE healthtrack_session_bytes gauge",
+        f"healthtrack_session_bytes {totals['bytes']}",
+        "# HELP healthtrack_sessions_evicted_total Sessions evicted after being idle.",
+        "# TYPE healthtrack_sessions_evicted_total counter",
+        f"healthtrack_sessions_evicted_total {totals['evicted_total']}",
+        "# HELP healthtrack_process_rss_bytes Resident set size of the server process.",
+        "# TYPE healthtrack_process_rss_bytes gauge",
+        f"healthtrack_process_rss_bytes {process_rss()}",
+    ]
+
+
+register_collector("sessions", render_prometheus)
+
+
+def sessions_endpoint():
+    """
+    Handler for GET /sessions on the (operator-only) metrics server: the totals, the
+    per-session budget and timeout, and the anonymous per-session report as JSON.
+    """
+    body = dict(
+        registry.totals(),
+        process_rss_bytes=process_rss(),
+        budget_kb=SESSION_BUDGET_KB,
+        idle_timeout_s=IDLE_TIMEOUT_S,
+        sessions_detail=registry.report().round(1).to_dict(orient="records"),
+    )
+    return 200, "application/json", json.dumps(body)
+
+
+register_endpoint("/sessions", sessions_endpoint)
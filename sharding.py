@@ -0,0 +1,368 @@
+"""
+Storage router that spreads the predictions table over several SQLite files.
+
+Users (with the unique-ID counters) stay in the catalog database,
+user_predictions.db, because signups are rare and need global uniqueness of
+emails and IDs. Predictions, which every session writes, live in shard files so
+that writers for different users don't queue on one database lock. A user's
+shard is chosen by a stable hash of their unique ID, or by their clinic.
+
+Each shard connection ATTACHes the catalog, so the existing queries in
+database.py (which join users and predictions) run unchanged on any shard.
+Cross-shard reads fan out over a thread pool and merge the results.
+
+Without a shards.json the router has a single shard, the catalog itself, and
+behaves exactly like the unsharded app.
+
+Usage (move all predictions onto 4 hash shards, then restart the app):
+    python sharding.py reshard --shards 4
+    python sharding.py reshard --strategy clinic --clinics north=0 south=1
+    python sharding.py status
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import prediction_cache
+from database import (BUSY_TIMEOUT_S, DB_PATH, PREDICTION_COLUMNS, create_prediction_tables,
+                      fetch_users, init_db)
+from tracing import span
+
+CONFIG_PATH = os.getenv("HEALTHTRACK_SHARD_CONFIG", "shards.json")
+SHARD_DIR = "shards"
+
+# Clinic of this deployment; new users are registered under it (clinic strategy)
+CLINIC = os.getenv("HEALTHTRACK_CLINIC")
+
+# Prediction ids of shard i start at i << ID_SHIFT, so ids stay unique across shards
+ID_SHIFT = 40
+
+
+def stable_hash(user_id):
+    # Python's hash() is salted per process, so use CRC32 for a placement that never changes
+    return zlib.crc32(str(user_id).encode("utf-8"))
+
+
+class ShardRouter:
+    """
+    Maps users to prediction shards and runs queries on one or all shards.
+
+    Parameters:
+    - shard_paths: Database file of each shard.
+    - catalog_path: Database holding the users table.
+    - strategy: "hash" (stable hash of unique_id) or "clinic".
+    - clinics: {clinic: shard index} for the clinic strategy.
+    - default_shard: Shard of users without a (known) clinic.
+    """
+
+    def __init__(self, shard_paths, catalog_path=DB_PATH, strategy="hash", clinics=None, default_shard=0):
+        if strategy not in ("hash", "clinic"):
+            raise ValueError(f"Unknown sharding strategy: {strategy}")
+        self.shard_paths = list(shard_paths)
+        self.catalog_path = catalog_path
+        self.strategy = strategy
+        self.clinics = dict(clinics or {})
+        self.default_shard = default_shard
+        self._user_shards = prediction_cache.LRUCache(maxsize=100000)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.shard_paths)
+
+    def config(self):
+        return {
+            "catalog": self.catalog_path,
+            "strategy": self.strategy,
+            "shards": self.shard_paths,
+            "clinics": self.clinics,
+            "default_shard": self.default_shard,
+        }
+
+    def shard_for(self, user_id):
+        """
+        Index of the shard holding a user's predictions.
+        """
+        if len(self.shard_paths) == 1:
+            return 0
+        if self.strategy == "hash":
+            return stable_hash(user_id) % len(self.shard_paths)
+
+        shard = self._user_shards.get(user_id)
+        if shard is None:
+            conn = self.connect_catalog()
+            try:
+                row = conn.execute("SELECT clinic FROM users WHERE unique_id = ?", (user_id,)).fetchone()
+            finally:
+                conn.close()
+            shard = self.clinics.get(row[0], self.default_shard) if row else self.default_shard
+            self._user_shards.put(user_id, shard)
+        return shard
+
+    def shards_for(self, user_ids):
+        """
+        Shard index of many users at once (one catalog query for the clinic strategy).
+        """
+        if len(self.shard_paths) == 1:
+            return [0] * len(user_ids)
+        if self.strategy == "hash":
+            return [stable_hash(user_id) % len(self.shard_paths) for user_id in user_ids]
+        if len(user_ids) <= 1000:
+            return [self.shard_for(user_id) for user_id in user_ids]
+        conn = self.connect_catalog()
+        try:
+            clinic_of = dict(conn.execute("SELECT unique_id, clinic FROM users"))
+        finally:
+            conn.close()
+        return [self.clinics.get(clinic_of.get(user_id), self.default_shard) for user_id in user_ids]
+
+    def connect_catalog(self):
+        return sqlite3.connect(self.catalog_path, timeout=BUSY_TIMEOUT_S)
+
+    def connect(self, shard):
+        """
+        Connection to one shard, with the catalog attached for joins against users.
+        """
+        path = self.shard_paths[shard]
+        conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_S)
+        if os.path.abspath(path) != os.path.abspath(self.catalog_path):
+            conn.execute("ATTACH DATABASE ? AS catalog", (self.catalog_path,))
+        return conn
+
+    def connect_for_user(self, user_id):
+        return self.connect(self.shard_for(user_id))
+
+    def init_shards(self):
+        """
+        Create the catalog and any missing shard files.
+        """
+        init_db(self.catalog_path)
+        for shard, path in enumerate(self.shard_paths):
+            if os.path.abspath(path) == os.path.abspath(self.catalog_path):
+                continue
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            conn = sqlite3.connect(path)
+            # Readers (dashboards, fan-out queries) don't block the shard's writer
+            conn.execute("PRAGMA journal_mode=WAL")
+            create_prediction_tables(conn.cursor())
+            if shard and conn.execute("SELECT COUNT(*) FROM sqlite_sequence WHERE name = 'predictions'").fetchone()[0] == 0:
+                conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('predictions', ?)", (shard << ID_SHIFT,))
+            conn.commit()
+            conn.close()
+
+    def _run(self, shard, query):
+        with span("sharding.shard_query"):
+            conn = self.connect(shard)
+            try:
+                return query(conn)
+            finally:
+                conn.close()
+
+    def _map(self, tasks):
+        if len(tasks) <= 1:
+            return [self._run(shard, query) for shard, query in tasks]
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=len(self.shard_paths), thread_name_prefix="shard")
+        futures = [self._pool.submit(self._run, shard, query) for shard, query in tasks]
+        return [future.result() for future in futures]
+
+    def fan_out(self, query, shards=None):
+        """
+        Run query(conn) on every shard in parallel.
+
+        Parameters:
+        - query: Function taking a shard connection.
+        - shards: Shard indices to run on (default: all).
+
+        Returns:
+        - List of results, in shard order.
+        """
+        shards = range(len(self.shard_paths)) if shards is None else shards
+        return self._map([(shard, query) for shard in shards])
+
+    def fan_out_users(self, query, user_ids):
+        """
+        Run query(conn, user_ids) on each shard with the subset of users it holds.
+
+        Returns:
+        - List of results, one per shard that holds any of the users.
+        """
+        by_shard = {}
+        for user_id, shard in zip(user_ids, self.shards_for(user_ids)):
+            by_shard.setdefault(shard, []).append(user_id)
+        return self._map([
+            (shard, lambda conn, ids=ids: query(conn, ids)) for shard, ids in sorted(by_shard.items())
+        ])
+
+    def fetch_users(self):
+        """
+        database.fetch_users() merged across shards.
+        """
+        with span("sharding.fetch_users"):
+            frames = self.fan_out(fetch_users)
+        return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+    def status(self):
+        """
+        Prediction rows and file size per shard.
+        """
+        counts = self.fan_out(lambda conn: conn.execute("SELECT COUNT(*) FROM main.predictions").fetchone()[0])
+        return pd.DataFrame({
+            "shard": range(len(self.shard_paths)),
+            "path": self.shard_paths,
+            "predictions": counts,
+            "mb": [os.path.getsize(path) / 1e6 for path in self.shard_paths],
+        })
+
+
+def load_config(path=CONFIG_PATH):
+    """
+    Router described by a shards.json file, or the single-shard router if there is none.
+    """
+    if not os.path.exists(path):
+        return ShardRouter([DB_PATH])
+    with open(path) as f:
+        config = json.load(f)
+    return ShardRouter(
+        config["shards"],
+        catalog_path=config.get("catalog", DB_PATH),
+        strategy=config.get("strategy", "hash"),
+        clinics=config.get("clinics"),
+        default_shard=config.get("default_shard", 0),
+    )
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    """
+    Process-wide router, created on first use (restart the app after resharding).
+    """
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                router = load_config()
+                router.init_shards()
+                _router = router
+    return _router
+
+
+def save_config(router, path=CONFIG_PATH):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(router.config(), f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def reshard(new_router, source_router=None, batch_size=50000):
+    """
+    Copy every prediction from the current shards into a new shard layout.
+
+    Rows are streamed shard by shard and routed with new_router. Prediction ids are
+    reassigned from each new shard's id range (the cohort index is rebuilt from the
+    database on startup, so nothing depends on the old ids). The app should be
+    stopped while this runs; switch over with save_config() afterwards.
+
+    Parameters:
+    - new_router: Router describing the new layout. Its shard files must not exist yet.
+    - source_router: Current layout (default: the one in shards.json).
+    - batch_size: Rows read and written per batch.
+
+    Returns:
+    - Number of rows written to each new shard.
+    """
+    source_router = source_router or load_config()
+    for path in new_router.shard_paths:
+        if os.path.exists(path):
+            raise ValueError(f"{path} already exists; reshard into new files")
+    new_router.init_shards()
+
+    columns = ", ".join(PREDICTION_COLUMNS)
+    insert = f"INSERT INTO predictions ({columns}) VALUES ({', '.join('?' for _ in PREDICTION_COLUMNS)})"
+    targets = [sqlite3.connect(path, timeout=BUSY_TIMEOUT_S) for path in new_router.shard_paths]
+    written = [0] * len(targets)
+    try:
+        for source_path in source_router.shard_paths:
+            source = sqlite3.connect(source_path)
+            try:
+                cursor = source.execute(f"SELECT {columns} FROM predictions ORDER BY id")
+                while True:
+                    with span("sharding.reshard_batch"):
+                        rows = cursor.fetchmany(batch_size)
+                        if not rows:
+                            break
+                        by_shard = {}
+                        for row, shard in zip(rows, new_router.shards_for([row[0] for row in rows])):
+                            by_shard.setdefault(shard, []).append(row)
+                        for shard, shard_rows in by_shard.items():
+                            targets[shard].executemany(insert, shard_rows)
+                            written[shard] += len(shard_rows)
+                        for target in targets:
+                            target.commit()
+            finally:
+                source.close()
+    finally:
+        for target in targets:
+            target.close()
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prediction shard management")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    reshard_parser = subparsers.add_parser("reshard", help="Move all predictions into a new shard layout")
+    reshard_parser.add_argument("--shards", type=int, default=None, help="Number of shards (hash strategy)")
+    reshard_parser.add_argument("--strategy", choices=["hash", "clinic"], default="hash")
+    reshard_parser.add_argument("--clinics", nargs="*", default=[], help="clinic=shard pairs (clinic strategy)")
+    reshard_parser.add_argument("--default-shard", type=int, default=0)
+    reshard_parser.add_argument("--dir", default=None, help="Directory for the new shard files")
+    subparsers.add_parser("status", help="Rows and size of each shard")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        print(get_router().status().to_string(index=False))
+        return
+
+    clinics = {name: int(shard) for name, shard in (pair.split("=", 1) for pair in args.clinics)}
+    n_shards = args.shards or (max(clinics.values(), default=0) + 1)
+    generation = 1
+    while args.dir is None and os.path.exists(os.path.join(SHARD_DIR, f"gen{generation}")):
+        generation += 1
+    shard_dir = args.dir or os.path.join(SHARD_DIR, f"gen{generation}")
+    new_router = ShardRouter(
+        [os.path.join(shard_dir, f"predictions_{shard:02d}.db") for shard in range(n_shards)],
+        strategy=args.strategy, clinics=clinics, default_shard=args.default_shard
+    )
+
+    source_router = load_config()
+    written = reshard(new_router, source_router)
+    save_config(new_router)
+    print(f"Wrote {sum(written)} predictions to {n_shards} shards in {shard_dir}: {written}")
+
+    # Predictions that lived in the catalog have been copied out; reclaim the space
+    catalog = os.path.abspath(source_router.catalog_path)
+    if any(os.path.abspath(path) == catalog for path in source_router.shard_paths):
+        conn = sqlite3.connect(source_router.catalog_path)
+        conn.execute("DELETE FROM predictions")
+        conn.commit()
+        conn.execute("VACUUM")
+        conn.close()
+    old_files = [path for path in source_router.shard_paths if os.path.abspath(path) != catalog]
+    if old_files:
+        print("The previous shard files are no longer used and can be deleted:", " ".join(old_files))
+    print(f"Configuration saved to {CONFIG_PATH}; restart the app to use it.")
+
+
+if __name__ == "__main__":
+    main()
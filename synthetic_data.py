@@ -0,0 +1,296 @@
+"""
+Synthetic patient generator for stress-testing the predictions database and dashboard.
+
+Feature vectors follow the CDC Diabetes Health Indicators training data: rows are
+bootstrapped from data/cdc_diabetes_health_indicators.csv when it has been
+downloaded (see model_training.ipynb), otherwise drawn from the published
+marginals of that dataset with a shared latent health factor so that e.g. BMI,
+high blood pressure and difficulty walking stay correlated. Each user gets a
+multi-month history of check-ins that is scored with the real model and bulk
+loaded with batched executemany calls. Output is deterministic for a given seed.
+
+Usage:
+    python synthetic_data.py --users 10000 --months 12 --db stress.db
+    python synthetic_data.py --rows 5000000 --db stress.db --seed 7
+"""
+import argparse
+import os
+import sqlite3
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from database import FEATURE_NAMES, PREDICTION_COLUMNS, init_db
+
+TRAINING_CSV = './data/cdc_diabetes_health_indicators.csv'
+MODEL_PATH = './models/random_forest_diabetes_model.pkl'
+SCALER_PATH = './models/scaler.pkl'
+
+# Users are generated in fixed-size blocks, each with its own seed derived from
+# (seed, block index), so the output doesn't depend on how much is generated.
+USERS_PER_BLOCK = 1000
+
+# Share of respondents answering "yes" in the CDC data, and how strongly each
+# answer loads on the latent health factor (positive = more likely when unhealthy)
+BINARY_MARGINALS = {
+    'HighBP': (0.429, 0.9), 'HighChol': (0.424, 0.6), 'CholCheck': (0.963, 0.3),
+    'Smoker': (0.443, 0.3), 'Stroke': (0.041, 0.8), 'HeartDiseaseorAttack': (0.094, 0.9),
+    'PhysActivity': (0.757, -0.7), 'Fruits': (0.634, -0.3), 'Veggies': (0.811, -0.3),
+    'HvyAlcoholConsump': (0.056, -0.1), 'AnyHealthcare': (0.951, 0.1), 'NoDocbcCost': (0.084, 0.3),
+    'DiffWalk': (0.168, 1.1), 'Sex': (0.441, 0.0),
+}
+
+# Category probabilities (starting at the lowest code) for the ordinal features
+CATEGORICAL_MARGINALS = {
+    'GenHlth': [0.179, 0.351, 0.298, 0.124, 0.048],
+    'Age': [0.022, 0.030, 0.044, 0.054, 0.064, 0.078, 0.104, 0.121, 0.131, 0.127, 0.093, 0.063, 0.069],
+    'Education': [0.001, 0.016, 0.037, 0.247, 0.276, 0.423],
+    'Income': [0.039, 0.046, 0.063, 0.079, 0.102, 0.144, 0.170, 0.357],
+}
+CATEGORICAL_FIRST_CODE = {'GenHlth': 1, 'Age': 1, 'Education': 1, 'Income': 1}
+
+# Days of poor mental/physical health: share of zero days and of the full 30 days
+HEALTH_DAYS_MARGINALS = {'MentHlth': (0.69, 0.047), 'PhysHlth': (0.63, 0.076)}
+
+BMI_MEAN, BMI_STD = 28.4, 6.6
+
+# Features that can change between check-ins, with the daily chance of a new value
+TIME_VARYING = {
+    'PhysActivity': 0.01, 'Fruits': 0.01, 'Veggies': 0.01, 'HvyAlcoholConsump': 0.005,
+    'Smoker': 0.001, 'CholCheck': 0.003, 'GenHlth': 0.01, 'MentHlth': 0.05, 'PhysHlth': 0.05,
+    'HighBP': 0.002, 'HighChol': 0.002, 'NoDocbcCost': 0.005,
+}
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def _logit(p):
+    return np.log(p / (1.0 - p))
+
+
+def _sample_health_days(rng, n_rows, zero_share, thirty_share):
+    draws = rng.random(n_rows)
+    # Non-zero, non-30 answers skew towards a few days
+    middle = np.minimum(rng.geometric(0.15, n_rows), 29)
+    return np.where(draws < zero_share, 0, np.where(draws < zero_share + thirty_share, 30, middle))
+
+
+def sample_from_marginals(rng, n_rows, latent=None):
+    """
+    Draw encoded feature vectors from the CDC marginals, tied together by a latent health factor.
+
+    Parameters:
+    - rng: numpy Generator.
+    - n_rows: Number of vectors to draw.
+    - latent: Optional array of latent health scores (higher = less healthy), one per row.
+
+    Returns:
+    - DataFrame with one column per feature in FEATURE_NAMES.
+    """
+    if latent is None:
+        latent = rng.normal(0, 1, n_rows)
+    columns = {}
+    for feature, (share, loading) in BINARY_MARGINALS.items():
+        columns[feature] = (rng.random(n_rows) < _sigmoid(_logit(share) + loading * latent)).astype(int)
+    for feature, probabilities in CATEGORICAL_MARGINALS.items():
+        probabilities = np.asarray(probabilities) / np.sum(probabilities)
+        codes = rng.choice(len(probabilities), size=n_rows, p=probabilities) + CATEGORICAL_FIRST_CODE[feature]
+        if feature in ('GenHlth', 'Age'):
+            # Older and less healthy respondents report worse general health
+            shift = np.rint(0.6 * latent).astype(int) if feature == 'GenHlth' else 0
+            codes = np.clip(codes + shift, CATEGORICAL_FIRST_CODE[feature], CATEGORICAL_FIRST_CODE[feature] + len(probabilities) - 1)
+        columns[feature] = codes
+    for feature, (zero_share, thirty_share) in HEALTH_DAYS_MARGINALS.items():
+        columns[feature] = _sample_health_days(rng, n_rows, zero_share, thirty_share)
+    columns['BMI'] = np.clip(np.rint(rng.normal(BMI_MEAN, BMI_STD, n_rows) + 2.0 * latent), 12, 98)
+    return pd.DataFrame(columns, columns=FEATURE_NAMES)
+
+
+class FeatureSampler:
+    """
+    Draws realistic feature vectors: bootstrapped training rows if the CDC CSV is
+    available, otherwise the marginal model above.
+    """
+
+    def __init__(self, training_csv=TRAINING_CSV):
+        self.training_rows = None
+        if training_csv and os.path.exists(training_csv):
+            self.training_rows = pd.read_csv(training_csv, usecols=FEATURE_NAMES)[FEATURE_NAMES].to_numpy()
+
+    @property
+    def source(self):
+        return "cdc-csv" if self.training_rows is not None else "cdc-marginals"
+
+    def sample(self, rng, n_rows):
+        if self.training_rows is not None:
+            picks = rng.integers(0, len(self.training_rows), size=n_rows)
+            return pd.DataFrame(self.training_rows[picks], columns=FEATURE_NAMES)
+        return sample_from_marginals(rng, n_rows)
+
+
+def load_model(model_path=MODEL_PATH, scaler_path=SCALER_PATH):
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(
+            f"{model_path} not found. Train the model with model_training.ipynb first."
+        )
+    return joblib.load(model_path), joblib.load(scaler_path)
+
+
+def score(model, scaler, features):
+    """
+    Score feature vectors with the model in one batched call.
+
+    Returns:
+    - (prediction labels, diabetes probabilities)
+    """
+    probabilities = model.predict_proba(scaler.transform(features.astype(float)))[:, 1]
+    labels = np.where(probabilities > 0.5, "Diabetes Present", "No Diabetes Present")
+    return labels, probabilities
+
+
+def generate_block(sampler, seed, block_index, n_users, days, visit_rate, start_date):
+    """
+    Generate check-in histories for one block of users.
+
+    Each user starts from a sampled profile. BMI follows a slow random walk and the
+    lifestyle/health answers in TIME_VARYING occasionally change to a freshly
+    sampled value; the user checks in on a day with probability visit_rate.
+
+    Returns:
+    - DataFrame with user_id, date and one column per feature, ordered by user and date.
+    """
+    rng = np.random.default_rng([seed, block_index])
+    baseline = sampler.sample(rng, n_users)
+
+    visits = rng.random((n_users, days)) < visit_rate
+    visits[:, 0] = True  # every user has at least one prediction
+    user_index, day_index = np.nonzero(visits)
+
+    fresh = sampler.sample(rng, n_users * days)
+    columns = {}
+    day_numbers = np.arange(days)
+    for feature in FEATURE_NAMES:
+        values = np.repeat(baseline[feature].to_numpy()[:, None], days, axis=1).astype(float)
+        if feature == 'BMI':
+            values = values + np.cumsum(rng.normal(0, 0.05, (n_users, days)), axis=1)
+            values = np.clip(np.round(values, 1), 12, 98)
+        elif feature in TIME_VARYING:
+            changes = rng.random((n_users, days)) < TIME_VARYING[feature]
+            changes[:, 0] = False
+            fresh_values = fresh[feature].to_numpy().reshape(n_users, days)
+            # Carry each new value forward until the next change
+            last_change = np.maximum.accumulate(np.where(changes, day_numbers, 0), axis=1)
+            values = np.where(last_change > 0, np.take_along_axis(fresh_values, last_change, axis=1), values)
+        columns[feature] = values[user_index, day_index]
+
+    user_numbers = block_index * USERS_PER_BLOCK + user_index + 1
+    frame = pd.DataFrame(columns, columns=FEATURE_NAMES)
+    frame.insert(0, 'user_id', [f"synthetic{number}" for number in user_numbers])
+    frame['date'] = (np.datetime64(start_date) + day_index.astype('timedelta64[D]')).astype(str)
+    return frame
+
+
+def generate(n_users, months=12, visit_rate=0.5, seed=42, start_date='2023-01-01', sampler=None):
+    """
+    Yield scored-ready history blocks (see generate_block) for n_users users.
+    """
+    sampler = sampler or FeatureSampler()
+    days = int(months * 30)
+    for block_index in range((n_users + USERS_PER_BLOCK - 1) // USERS_PER_BLOCK):
+        users_in_block = min(USERS_PER_BLOCK, n_users - block_index * USERS_PER_BLOCK)
+        yield generate_block(sampler, seed, block_index, users_in_block, days, visit_rate, start_date)
+
+
+def bulk_load(db_path, blocks, model, scaler, max_rows=None, batch_size=50000, transaction_rows=1000000):
+    """
+    Score generated blocks and insert them (and their users) into a predictions database.
+
+    Rows are written with executemany in batches of batch_size, committing once per
+    transaction_rows rows, with synchronous writes turned off for the load.
+
+    Returns:
+    - Number of prediction rows written.
+    """
+    init_db(db_path)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA journal_mode = MEMORY")
+    placeholders = ", ".join("?" for _ in PREDICTION_COLUMNS)
+    insert_prediction = f"INSERT INTO predictions ({', '.join(PREDICTION_COLUMNS)}) VALUES ({placeholders})"
+    insert_user = "INSERT OR IGNORE INTO users (name, email, unique_id) VALUES (?, ?, ?)"
+
+    written = 0
+    in_transaction = 0
+    conn.execute("BEGIN")
+    try:
+        for frame in blocks:
+            if max_rows is not None:
+                frame = frame.iloc[:max_rows - written]
+            if frame.empty:
+                break
+            labels, probabilities = score(model, scaler, frame[FEATURE_NAMES])
+            frame = frame.assign(Prediction=labels, Probability=probabilities)[PREDICTION_COLUMNS]
+
+            user_ids = frame['user_id'].unique()
+            conn.executemany(insert_user, [
+                (f"Synthetic User {user_id[len('synthetic'):]}", f"{user_id}@example.com", user_id)
+                for user_id in user_ids
+            ])
+            # Cast to plain Python objects so sqlite3 stores INTEGER/REAL, not blobs
+            rows = frame.astype(object).to_numpy().tolist()
+            for start in range(0, len(rows), batch_size):
+                conn.executemany(insert_prediction, rows[start:start + batch_size])
+
+            written += len(rows)
+            in_transaction += len(rows)
+            if in_transaction >= transaction_rows:
+                conn.execute("COMMIT")
+                conn.execute("BEGIN")
+                in_transaction = 0
+            if max_rows is not None and written >= max_rows:
+                break
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic prediction histories")
+    parser.add_argument("--db", default="synthetic_predictions.db", help="Target SQLite database")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--rows", type=int, default=None,
+                        help="Stop after this many predictions (adds users as needed)")
+    parser.add_argument("--months", type=float, default=12)
+    parser.add_argument("--visit-rate", type=float, default=0.5, help="Chance a user checks in on a given day")
+    parser.add_argument("--start-date", default="2023-01-01")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    n_users = args.users
+    if args.rows is not None:
+        rows_per_user = max(1.0, args.months * 30 * args.visit_rate)
+        n_users = max(n_users, int(np.ceil(args.rows / rows_per_user * 1.05)) + 1)
+
+    model, scaler = load_model()
+    sampler = FeatureSampler()
+    start = time.perf_counter()
+    written = bulk_load(
+        args.db,
+        generate(n_users, args.months, args.visit_rate, args.seed, args.start_date, sampler),
+        model, scaler, max_rows=args.rows
+    )
+    elapsed = time.perf_counter() - start
+    print(f"Wrote {written} predictions ({sampler.source}) to {args.db} in {elapsed:.1f}s "
+          f"({written / max(elapsed, 1e-9):,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import threading
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Tracing is off unless explicitly enabled, so the hot path only pays for a
+# boolean check and a shared no-op context manager.
+TRACING_ENABLED = os.getenv("HEALTHTRACK_TRACING", "0") == "1"
+TRACE_FILE = os.getenv("HEALTHTRACK_TRACE_FILE")
+METRICS_PORT = int(os.getenv("HEALTHTRACK_METRICS_PORT", "0") or 0)
+# Interface the metrics server listens on; loopback only unless a scraper on another host needs it
+METRICS_HOST = os.getenv("HEALTHTRACK_METRICS_HOST", "127.0.0.1")
+
+# Histogram bucket upper bounds in seconds (Prometheus "le" labels)
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_histograms = {}
+_collectors = {}
+_endpoints = {}
+_trace_file = None
+_metrics_server = None
+
+
+class Histogram:
+    """
+    Cumulative latency histogram for one span name, aggregated in-process.
+    """
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # last slot is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                break
+        else:
+            i = len(BUCKETS)
+        self.counts[i] += 1
+        self.total += seconds
+        self.count += 1
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record(self.name, time.perf_counter() - self.start, error=exc_type is not None)
+        return False
+
+
+def enable(trace_file=None):
+    """
+    Turn tracing on at runtime (e.g. from a benchmark), optionally with a JSONL sink.
+    """
+    global TRACING_ENABLED, TRACE_FILE
+    TRACING_ENABLED = True
+    if trace_file:
+        TRACE_FILE = trace_file
+
+
+def disable():
+    global TRACING_ENABLED
+    TRACING_ENABLED = False
+
+
+def span(name):
+    """
+    Time a block of code under the given span name.
+
+    Usage:
+        with span("predictions.predict_proba"):
+            probabilities = model.predict_proba(scaled_input)
+    """
+    if not TRACING_ENABLED:
+        return _NOOP_SPAN
+    return _Span(name)
+
+
+def traced(name):
+    """
+    Decorator form of span() for whole functions.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TRACING_ENABLED:
+                return func(*args, **kwargs)
+            with _Span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record(name, seconds, error=False):
+    """
+    Add one observation to the in-process histogram and the JSONL sink (if configured).
+    """
+    global _trace_file
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+        if TRACE_FILE:
+            if _trace_file is None:
+                _trace_file = open(TRACE_FILE, "a", buffering=1)
+            _trace_file.write(json.dumps({
+                "ts": time.time(),
+                "span": name,
+                "duration_s": round(seconds, 6),
+                "error": error,
+            }) + "\n")
+
+
+def snapshot():
+    """
+    Return a plain-dict copy of all histograms: {span: {"count", "sum", "buckets"}}.
+    """
+    with _lock:
+        return {
+            name: {"count": h.count, "sum": h.total, "buckets": list(h.counts)}
+            for name, h in _histograms.items()
+        }
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+
+def register_collector(name, collect):
+    """
+    Add extra metrics to /metrics. collect() is called on every scrape and returns
+    a list of lines in the Prometheus text format. Re-registering a name replaces it.
+    """
+    with _lock:
+        _collectors[name] = collect
+
+
+def register_endpoint(path, handle):
+    """
+    Serve an extra path (e.g. a readiness probe) from the metrics server. handle() is
+    called on every request and returns (status code, content type, body text).
+    Re-registering a path replaces it.
+    """
+    with _lock:
+        _endpoints[path.rstrip("/")] = handle
+
+
+def render_prometheus():
+    """
+    Render all histograms, plus the lines of every registered collector, in the
+    Prometheus text exposition format.
+    """
+    lines = [
+        "# HELP healthtrack_span_duration_seconds Duration of traced hot-path stages.",
+        "# TYPE healthtrack_span_duration_seconds histogram",
+    ]
+    for name, data in sorted(snapshot().items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ("+Inf",), data["buckets"]):
+            cumulative += count
+            lines.append(f'healthtrack_span_duration_seconds_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'healthtrack_span_duration_seconds_sum{{span="{name}"}} {data["sum"]:.6f}')
+        lines.append(f'healthtrack_span_duration_seconds_count{{span="{name}"}} {data["count"]}')
+    with _lock:
+        collectors = list(_collectors.values())
+    for collect in collectors:
+        lines += collect()
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path == "/metrics":
+            status, content_type, text = 200, "text/plain; version=0.0.4", render_prometheus()
+        else:
+            with _lock:
+                handle = _endpoints.get(path)
+            if handle is None:
+                self.send_error(404)
+                return
+            status, content_type, text = handle()
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keep scrapes out of the Streamlit console
+        pass
+
+
+def start_metrics_server(port=None, host=None):
+    """
+    Serve /metrics (and registered endpoints) on a background thread, on METRICS_HOST
+    unless a host is given. Safe to call on every script rerun: it does nothing if no
+    port is configured or the server is already running.
+    """
+    global _metrics_server
+    port = port or METRICS_PORT
+    host = host or METRICS_HOST
+    if not port:
+        return None
+    with _lock:
+        if _metrics_server is None:
+            _metrics_server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            thread = threading.Thread(target=_metrics_server.serve_forever, daemon=True)
+            thread.start()
+    return _metrics_server
@@ -6,7 +6,9 @@ from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 import socket
 
-def explain_model(feature_names, X_sample, X_sample_scaled, rf_model):
+from tracing import span
+
+def explain_model(feature_names, X_sample, X_sample_scaled, rf_model, explainer=None):
     """
     Explain the model's prediction for a single sample using SHAP values.
 
@@ -15,21 +17,39 @@ def explain_model(feature_names, X_sample, X_sample_scaled, rf_model):
     - X_sample: Original input data for the sample.
     - X_sample_scaled: Scaled input data for the sample.
     - rf_model: Trained Random Forest model.
+    - explainer: Optional prebuilt shap.TreeExplainer for rf_model, reused across calls.
 
     Returns:
     - shap_values: SHAP values for the sample.
     - feature_contributions: DataFrame with feature names and SHAP values.
     """
     # Initialize SHAP Tree Explainer
-    explainer = shap.TreeExplainer(rf_model)
+    if explainer is None:
+        with span("utils.tree_explainer_init"):
+            explainer = shap.TreeExplainer(rf_model)
 
     # Compute SHAP values for the scaled sample
-    shap_values = explainer.shap_values(X_sample_scaled)
+    with span("utils.shap_values"):
+        shap_values = explainer.shap_values(X_sample_scaled)
 
     # Extract SHAP values for class 1 (positive class)
     # shap_values_class_1 = shap_values[1][0]  # SHAP values for class 1, first sample
     shap_values_class_1 = shap_values[0][:, 1]  # SHAP values for class 1, all features
 
+    return shap_values, contributions_frame(feature_names, shap_values_class_1)
+
+
+def contributions_frame(feature_names, shap_values_class_1):
+    """
+    Feature contributions of one sample, sorted by absolute SHAP value.
+
+    Parameters:
+    - feature_names: List of feature names.
+    - shap_values_class_1: The sample's SHAP values for class 1, one per feature.
+
+    Returns:
+    - DataFrame with "Feature" and "SHAP Value" columns.
+    """
     # Ensure SHAP values and feature names align
     assert len(feature_names) == len(shap_values_class_1), "Mismatch in feature and SHAP value lengths!"
 
@@ -40,12 +60,10 @@ def explain_model(feature_names, X_sample, X_sample_scaled, rf_model):
     })
 
     # Sort features by absolute SHAP value
-    feature_contributions = feature_contributions.reindex(
+    return feature_contributions.reindex(
         feature_contributions["SHAP Value"].abs().sort_values(ascending=False).index
     )
 
-    return shap_values, feature_contributions
-
 
 def load_api_key():
     # Load environment variables from .env for local testing
@@ -73,18 +91,16 @@ def load_api_key():
     return chat, api_key
 
 
-def generate_recommendations(feature_contributions, feature_info, user_model_text, llm):
+def recommendation_prompt(feature_contributions, user_model_text):
     """
-    Generate personalized lifestyle recommendations based on SHAP values.
+    Build the LLM prompt for a patient's lifestyle recommendations.
 
     Parameters:
     - feature_contributions: DataFrame with features and SHAP values
-    - feature_info: Dictionary with feature descriptions
-    - prediction_result: String ("Diabetes Present" or "No Diabetes")
-    - diabetes_prob: Float, probability of the predicted class
+    - user_model_text: Sentence with the prediction result and its probability
 
     Returns:
-    - Recommendations from the LLM
+    - Prompt string
     """
     # Identify top positive and negative contributing features
     positive_features = feature_contributions[feature_contributions["SHAP Value"] > 0]
@@ -117,8 +133,26 @@ def generate_recommendations(feature_contributions, feature_info, user_model_tex
 
     Break down your answer into bullet points for clarity. Make it easy to understand and actionable.
     """
+    return prompt
+
+
+def generate_recommendations(feature_contributions, feature_info, user_model_text, llm):
+    """
+    Generate personalized lifestyle recommendations based on SHAP values.
+
+    Parameters:
+    - feature_contributions: DataFrame with features and SHAP values
+    - feature_info: Dictionary with feature descriptions
+    - prediction_result: String ("Diabetes Present" or "No Diabetes")
+    - diabetes_prob: Float, probability of the predicted class
+
+    Returns:
+    - Recommendations from the LLM
+    """
+    prompt = recommendation_prompt(feature_contributions, user_model_text)
 
     # Use the ChatOpenAI model to generate recommendations
-    response = llm(prompt)
+    with span("utils.llm_call"):
+        response = llm(prompt)
     return response
 
@@ -0,0 +1,288 @@
+"""
+Server warm-up and readiness probe.
+
+Without a warm-up, the first Predict after a deploy pays for the heavy imports,
+the model deserialization, the first explainer build and a cold SQLite page
+cache. warm-up does that work once per server process, step by step: imports,
+database (init_db, migrations and index checks), model bundle, explainer primed
+with a demo profile, cohort index and one pre-rendered dashboard chart.
+
+Streamlit runs no code before the first session connects. To keep the port
+closed until the warm-up has finished, start the server with
+python warmup.py serve, which warms up and then starts Streamlit in the same
+process. login.py also starts the warm-up in the background (it does nothing if
+the warm-up already ran), so plain "streamlit run login.py" warms up on the
+first visit. When HEALTHTRACK_METRICS_PORT is set, GET /ready on the metrics
+server returns 200 once every step has succeeded and 503 before that. Both
+responses list the steps and how long each one took.
+"""
+import argparse
+import io
+import json
+import sys
+import threading
+import time
+
+from tracing import register_endpoint, span, start_metrics_server
+
+# Lookups on the hot path, and the index each must use rather than a full table scan
+INDEXED_QUERIES = {
+    "users by email": ("catalog", "SELECT * FROM users WHERE email = ?", ("",)),
+    "users by unique ID": ("catalog", "SELECT * FROM users WHERE unique_id = ?", ("",)),
+    "predictions by user and date": (
+        "shards", "SELECT * FROM predictions WHERE user_id = ? AND date BETWEEN ? AND ?", ("", "", "")
+    ),
+}
+
+_lock = threading.Lock()
+_thread = None
+status = {"state": "pending", "started_at": None, "total_s": None, "steps": []}
+
+
+def warm_imports():
+    """
+    Import the libraries the pages load on first use.
+    """
+    import joblib  # noqa: F401
+    import langchain_openai  # noqa: F401
+    import matplotlib.pyplot  # noqa: F401
+    import shap  # noqa: F401
+    import sklearn.ensemble  # noqa: F401
+
+
+def warm_database():
+    """
+    Create missing tables and shard files and run the schema migrations (init_db).
+    """
+    import sharding
+    sharding.get_router().init_shards()
+
+
+def check_indexes():
+    """
+    Check that the hot-path lookups use an index, and read those indexes once so
+    their pages are in the OS cache before the first request.
+
+    Raises:
+    - RuntimeError naming every lookup that would scan a whole table.
+    """
+    import sharding
+    router = sharding.get_router()
+    connections = [("catalog", router.connect_catalog())]
+    connections += [("shards", router.connect(shard)) for shard in range(len(router.shard_paths))]
+    missing = []
+    try:
+        for name, (target, query, params) in INDEXED_QUERIES.items():
+            for conn_target, conn in connections:
+                if conn_target != target:
+                    continue
+                plan = " ".join(row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params))
+                if "INDEX" not in plan:
+                    missing.append(f"{name} ({plan})")
+        for conn_target, conn in connections:
+            if conn_target == "catalog":
+                conn.execute("SELECT COUNT(email), COUNT(unique_id) FROM users").fetchone()
+            else:
+                conn.execute(
+                    "SELECT COUNT(*) FROM predictions INDEXED BY idx_predictions_user_date WHERE user_id >= ''"
+                ).fetchone()
+    finally:
+        for _, conn in connections:
+            conn.close()
+    if missing:
+        raise RuntimeError("Full table scan for " + "; ".join(missing))
+
+
+def warm_model():
+    """
+    Load every trained model bundle into the process-wide host.
+    """
+    import model_host
+    host = model_host.get_host()
+    host.get("diabetes")
+    host.available()
+
+
+def warm_explainer():
+    """
+    Build the explainer and run a demo profile through prediction, explanation and what-if.
+    """
+    import explanations
+    import model_host
+    import what_if
+    from database import FEATURE_NAMES
+    from demo_profiles import DEMO_PROFILES
+    from utils import explain_model
+
+    bundle = model_host.get_host().get("diabetes")
+    profile = dict(next(iter(DEMO_PROFILES.values())))
+    row = [[profile[feature] for feature in FEATURE_NAMES]]
+    probability = bundle.predict_proba(row)[0]
+    explain_model(FEATURE_NAMES, row, bundle.transform(row), bundle.model, explainer=explanations.explainer_for(bundle))
+    what_if.explore(bundle.model, bundle.scaler, profile, probability)
+
+
+def warm_cohort_index():
+    """
+    Build the "patients like me" index (or wait for the build that is already running).
+
+    Raises:
+    - RuntimeError if the build failed (the build thread only logs the error).
+    """
+    import cohort_index
+    import model_host
+
+    if cohort_index.get_index() is not None:
+        return
+    thread = cohort_index.build_in_background(model_host.get_host().get("diabetes").scaler)
+    while thread is None and cohort_index.is_building():
+        # Another caller started the build; wait for it to finish
+        time.sleep(0.1)
+    if thread is not None:
+        thread.join()
+    if cohort_index.get_index() is None:
+        raise RuntimeError(f"Cohort index build failed: {cohort_index.last_error() or 'no index was built'}")
+
+
+def warm_chart():
+    """
+    Render a dashboard-style BMI chart to PNG the way st.pyplot does, which loads
+    the fonts, the Agg renderer and the date formatting code.
+    """
+    from datetime import date, timedelta
+
+    import matplotlib.dates as mdates
+    from matplotlib.figure import Figure
+
+    dates = [date(2024, 1, 1) + timedelta(days=30 * i) for i in range(12)]
+    values = [30 - 0.5 * i for i in range(12)]
+    # A standalone Figure, not pyplot, so the chart never touches a session's figures
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    ax.plot(dates, values, label="BMI", marker="o", linestyle="-")
+    ax.scatter(dates, values, c=["green" if value <= 25 else "red" for value in values], zorder=5)
+    ax.xaxis.set_major_formatter(mdates.DateFormatter("%Y-%m-%d"))
+    ax.set_title("BMI Over Time")
+    ax.set_xlabel("Date")
+    ax.set_ylabel("BMI")
+    ax.legend(loc="upper left")
+    for label in ax.get_xticklabels():
+        label.set_rotation(45)
+        label.set_horizontalalignment("right")
+    fig.savefig(io.BytesIO(), format="png", dpi=200, bbox_inches="tight")
+
+
+# Warm-up steps, in order (later steps rely on earlier ones)
+STEPS = [
+    ("imports", warm_imports),
+    ("database", warm_database),
+    ("indexes", check_indexes),
+    ("model", warm_model),
+    ("explainer", warm_explainer),
+    ("cohort_index", warm_cohort_index),
+    ("chart", warm_chart),
+]
+
+
+def run():
+    """
+    Run every warm-up step, recording how long each took and whether it failed.
+    A failed step doesn't stop the steps after it.
+
+    Returns:
+    - The status dict: state ("running", "ready" or "failed"), start time, total
+      seconds and one {name, seconds, ok, error} entry per step.
+    """
+    started = time.perf_counter()
+    with _lock:
+        status.update(state="running", started_at=time.time(), total_s=None, steps=[])
+    for name, step in STEPS:
+        step_started = time.perf_counter()
+        error = None
+        try:
+            with span(f"warmup.{name}"):
+                step()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        with _lock:
+            status["steps"].append({
+                "name": name,
+                "seconds": round(time.perf_counter() - step_started, 3),
+                "ok": error is None,
+                "error": error,
+            })
+    with _lock:
+        status["total_s"] = round(time.perf_counter() - started, 3)
+        status["state"] = "ready" if all(step["ok"] for step in status["steps"]) else "failed"
+        return json.loads(json.dumps(status))
+
+
+def start():
+    """
+    Run the warm-up on a background thread, once per process. Safe to call on every
+    script rerun, and does nothing if the warm-up already ran (e.g. under serve).
+
+    Returns:
+    - The warm-up thread, or None if the warm-up ran without one.
+    """
+    global _thread
+    with _lock:
+        if _thread is None and status["state"] == "pending":
+            _thread = threading.Thread(target=run, name="warmup", daemon=True)
+            _thread.start()
+        return _thread
+
+
+def is_ready():
+    with _lock:
+        return status["state"] == "ready"
+
+
+def readiness():
+    """
+    Handler for GET /ready: 200 once every step has succeeded, 503 while warming up or after a failure.
+    """
+    with _lock:
+        body = json.dumps(status)
+        ready = status["state"] == "ready"
+    return (200 if ready else 503), "application/json", body
+
+
+register_endpoint("/ready", readiness)
+
+
+def print_status(result):
+    for step in result["steps"]:
+        outcome = "ok" if step["ok"] else f"FAILED ({step['error']})"
+        print(f"{step['name']:<14}{step['seconds']:>8.3f} s  {outcome}")
+    print(f"{'total':<14}{result['total_s']:>8.3f} s  {result['state']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server warm-up")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("check", help="Run the warm-up once and print the time each step took")
+    serve_parser = subparsers.add_parser("serve", help="Warm up, then start the Streamlit app in this process")
+    serve_parser.add_argument("streamlit_args", nargs=argparse.REMAINDER,
+                              help="Extra arguments for streamlit run (e.g. -- --server.port 8501)")
+    args = parser.parse_args()
+
+    # /ready reports progress while the warm-up runs
+    start_metrics_server()
+    result = run()
+    print_status(result)
+
+    if args.command == "check":
+        sys.exit(0 if result["state"] == "ready" else 1)
+
+    # Streamlit only opens its port now, and its sessions reuse the warmed modules
+    from streamlit.web import cli as streamlit_cli
+    extra = [arg for arg in args.streamlit_args if arg != "--"]
+    sys.argv = ["streamlit", "run", "login.py"] + extra
+    sys.exit(streamlit_cli.main())
+
+
+if __name__ == "__main__":
+    # Run as the importable module, so the pages (which import warmup) share its status
+    import warmup
+    warmup.main()
@@ -0,0 +1,146 @@
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+from database import FEATURE_NAMES
+
+# Lifestyle features a patient can realistically change, with the value to aim for.
+# BMI is handled separately because it can move by any amount.
+BINARY_TARGETS = {
+    'PhysActivity': 1,
+    'Fruits': 1,
+    'Veggies': 1,
+    'HvyAlcoholConsump': 0,
+    'CholCheck': 1,
+}
+
+CHANGE_LABELS = {
+    'PhysActivity': "Start regular physical activity",
+    'Fruits': "Eat fruit every day",
+    'Veggies': "Eat vegetables every day",
+    'HvyAlcoholConsump': "Stop heavy drinking",
+    'CholCheck': "Get a cholesterol check",
+}
+
+HEALTHY_BMI = (18.5, 24.9)
+BMI_STEP = 0.5
+MAX_BMI_CHANGE = 15.0
+
+
+def single_changes(user_input):
+    """
+    All achievable single-feature changes of a profile, as (feature, new value) pairs.
+    """
+    changes = [
+        (feature, target) for feature, target in BINARY_TARGETS.items()
+        if user_input[feature] != target
+    ]
+
+    # Move BMI towards the healthy range in small steps
+    bmi = float(user_input['BMI'])
+    if bmi > HEALTHY_BMI[1]:
+        lowest = max(HEALTHY_BMI[0], bmi - MAX_BMI_CHANGE)
+        targets = np.arange(bmi - BMI_STEP, lowest - 1e-9, -BMI_STEP)
+    elif bmi < HEALTHY_BMI[0]:
+        targets = np.arange(bmi + BMI_STEP, HEALTHY_BMI[0] + BMI_STEP, BMI_STEP)
+    else:
+        targets = []
+    changes += [('BMI', round(float(target), 1)) for target in targets]
+    return changes
+
+
+def generate_candidates(user_input):
+    """
+    Build every single and pairwise (different-feature) perturbation of a profile.
+
+    Parameters:
+    - user_input: Dictionary of encoded feature values, keyed by FEATURE_NAMES.
+
+    Returns:
+    - candidates: List of tuples of (feature, new value) changes, one per row.
+    - X: 2D array of the perturbed encoded feature vectors, in model order.
+    """
+    singles = single_changes(user_input)
+    candidates = [(change,) for change in singles]
+    candidates += [
+        (first, second) for first, second in combinations(singles, 2)
+        if first[0] != second[0]
+    ]
+
+    base = np.array([user_input[feature] for feature in FEATURE_NAMES], dtype=float)
+    X = np.repeat(base[None, :], len(candidates), axis=0)
+    column = {feature: i for i, feature in enumerate(FEATURE_NAMES)}
+    for row, changes in enumerate(candidates):
+        for feature, value in changes:
+            X[row, column[feature]] = value
+    return candidates, X
+
+
+def describe(changes, user_input):
+    parts = []
+    for feature, value in changes:
+        if feature == 'BMI':
+            parts.append(f"Change BMI from {float(user_input['BMI']):.1f} to {value:.1f}")
+        else:
+            parts.append(CHANGE_LABELS[feature])
+    return " + ".join(parts)
+
+
+def explore(model, scaler, user_input, base_probability):
+    """
+    Score all candidate lifestyle changes in one batched predict_proba call.
+
+    Returns:
+    - DataFrame with one row per candidate: the changed features, BMI change,
+      description, new diabetes probability and the absolute risk reduction,
+      sorted by risk reduction.
+    """
+    candidates, X = generate_candidates(user_input)
+    if not candidates:
+        return pd.DataFrame(columns=["Features", "BMI change", "Change", "New risk", "Risk reduction"])
+
+    probabilities = model.predict_proba(scaler.transform(X))[:, 1]
+    results = pd.DataFrame({
+        "Features": [frozenset(feature for feature, _ in changes) for changes in candidates],
+        "BMI change": [
+            sum(value - float(user_input['BMI']) for feature, value in changes if feature == 'BMI')
+            for changes in candidates
+        ],
+        "Change": [describe(changes, user_input) for changes in candidates],
+        "New risk": probabilities,
+        "Risk reduction": base_probability - probabilities,
+    })
+    return results.sort_values("Risk reduction", ascending=False, ignore_index=True)
+
+
+def best_changes(results, allowed_features, max_bmi_change, top_n=10):
+    """
+    Filter scored candidates to what the patient is willing to change and keep the
+    best option per combination of features.
+
+    Parameters:
+    - results: DataFrame returned by explore().
+    - allowed_features: Features the patient is willing to change.
+    - max_bmi_change: Largest BMI change (absolute) to consider.
+    - top_n: Number of rows to return.
+    """
+    allowed = frozenset(allowed_features)
+    mask = results["Features"].map(lambda features: features <= allowed)
+    mask &= results["BMI change"].abs() <= max_bmi_change + 1e-9
+    mask &= results["Risk reduction"] > 0
+    filtered = results[mask]
+    # Rows are sorted by risk reduction, so the first row per feature set is its best option
+    best = filtered.drop_duplicates(subset="Features", keep="first")
+
+    # The forest isn't monotone: only suggest a pair if it beats each of its changes alone
+    single_best = {
+        next(iter(features)): reduction
+        for features, reduction in zip(best["Features"], best["Risk reduction"])
+        if len(features) == 1
+    }
+    worthwhile = [
+        len(features) == 1 or reduction > max(single_best.get(feature, 0) for feature in features)
+        for features, reduction in zip(best["Features"], best["Risk reduction"])
+    ]
+    return best[worthwhile].head(top_n)